@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import errno
+import os
+import threading
+import time
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Access logs in the Common and Combined Log Formats:
+# http://httpd.apache.org/docs/2.2/logs.html#accesslog
+
+FORMATS = {
+    'common':'%s - - [%s] "%s" %s %s\n',
+    'combined':'%s - - [%s] "%s" %s %s "%s" "%s"\n',}
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+    'Oct', 'Nov', 'Dec')
+
+def log_time(timestamp):
+    '''Format a Unix timestamp as a log time (eg: 10/Oct/2000:13:55:36 +0000)'''
+    t = time.gmtime(timestamp)
+    return '%02d/%s/%d:%02d:%02d:%02d +0000' %(t.tm_mday, MONTHS[t.tm_mon - 1],
+        t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+
+def quote(value):
+    '''Escape a client supplied value for a quoted log field'''
+    if not value:
+        return '-'
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+class AccessLog():
+    '''Buffers access log entries in memory and writes them in batches from
+    a background thread, so requests never wait on the disk.
+
+    Requests only append the request and a few fields to the buffer;
+    formatting happens on the writer thread. The buffer is written once it
+    holds flush_entries entries or flush_interval seconds have passed. If
+    the writer falls behind and the buffer is full, new entries are dropped
+    and counted rather than blocking requests.
+
+    Each batch is written with a single write() to a file opened for
+    appending, so pre-forked workers can share one log file.
+
+    Arguments:
+        path (str): The file to append to, or - for standard output.
+        fmt (str): common or combined.
+        max_entries (int): Entries buffered before new ones are dropped.
+        flush_entries (int): Buffered entries that wake the writer early.
+        flush_interval (float): Most seconds an entry waits to be written.
+
+    Attributes:
+        dropped (int): Entries dropped because the buffer was full.
+        written (int): Entries written.
+    '''
+
+    def __init__(self, path, fmt='combined', max_entries=8192,
+            flush_entries=256, flush_interval=1.0):
+        self.path = path
+        self.line = FORMATS[fmt]
+        self.combined = fmt == 'combined'
+        self.max_entries = max_entries
+        self.flush_entries = flush_entries
+        self.flush_interval = flush_interval
+
+        self.entries = collections.deque()
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.writer = None
+        self.stopping = False
+        self.reopening = False
+        self.dropped = 0
+        self.written = 0
+        self.second, self.stamp = 0, ''
+
+        self.fd = None
+        self._open()
+
+    def _open(self):
+        if self.path == '-':
+            self.fd = 1
+        else:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def start(self):
+        '''Start the writer thread of this process. Call again in each
+        forked worker, as threads do not survive fork().'''
+        self.stopping = False
+        self.writer = threading.Thread(target=self._run)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def log(self, host, request, status, length):
+        '''Queue an entry for a response of length body bytes to an
+        http.HTTPRequest, or to None if the request could not be parsed'''
+        entries = self.entries
+        if len(entries) >= self.max_entries:
+            self.dropped += 1
+            return
+        entries.append((host, time.time(), request, status, length))
+        if len(entries) == self.flush_entries:
+            self.wakeup.set()
+
+    def reopen(self):
+        '''Reopen the log file on the next write, eg: after it is rotated.
+        Safe to call from a signal handler.'''
+        self.reopening = True
+        self.wakeup.set()
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        '''Write every buffered entry'''
+        with self.lock:
+            if self.reopening:
+                self.reopening = False
+                self._reopen()
+
+            entries = self.entries
+            lines = []
+            while entries:
+                lines.append(self._format(*entries.popleft()))
+
+            if lines:
+                self._write(''.join(lines))
+                self.written += len(lines)
+
+    def _format(self, host, when, request, status, length):
+        # Entries in a batch mostly share a second; format it once
+        if int(when) != self.second:
+            self.second, self.stamp = int(when), log_time(when)
+
+        request_line, referer, agent = '', '', ''
+        if request is not None:
+            request_line = '%s %s %s' %(request.method, request.target, request.protocol)
+            referer = request.get_header('referer')
+            agent = request.get_header('user-agent')
+
+        if self.combined:
+            return self.line %(host, self.stamp, quote(request_line), status,
+                length or '-', quote(referer), quote(agent))
+        return self.line %(host, self.stamp, quote(request_line), status, length or '-')
+
+    def _write(self, data):
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    self.dropped += data.count('\n')
+                    return
+
+    def _reopen(self):
+        if self.path == '-':
+            return
+        old = self.fd
+        try:
+            self._open()
+        except OSError: # Keep writing to the old file rather than losing entries
+            self.fd = old
+            return
+        os.close(old)
+
+    def close(self):
+        '''Stop the writer and write anything still buffered'''
+        self.stopping = True
+        self.wakeup.set()
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.join(1)
+        self.flush()
+        if self.fd not in (None, 1):
+            os.close(self.fd)
+            self.fd = None
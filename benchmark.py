@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Load test for server.py. Starts the server once per configuration, drives
+# it with concurrent clients over a mix of files, 404s and redirects, and
+# reports requests/sec, latency percentiles, server CPU and memory.
+#
+# run: python benchmark.py --workers 1,2,4 --threads 1,8 --keep-alive both
+#      python benchmark.py --workers 4 --variants "--cache-size 0;;--mmap"
+#      python benchmark.py --path /base.css --accept-encoding gzip \
+#          --variants ";--no-compression"
+#      python benchmark.py --path /missing.php --keep-alive on
+#      python benchmark.py --json before.json
+#      python benchmark.py --json after.json --compare before.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+HOST, PORT = "127.0.0.1", 8080
+
+REQUEST = 'GET %s HTTP/1.1\r\nHost: %s\r\n%s\r\n'
+
+# Weighted request paths: mostly files under www/, some 404s and redirects
+DEFAULT_MIX = '/index.html:6,/base.css:6,/deep/index.html:4,/deep/deep.css:4,/missing.php:2,/deep:1'
+
+def fetch(path, headers=''):
+    '''Send one GET request on a new connection and read until close.
+
+    Returns the number of bytes received.
+    '''
+    sock = socket.create_connection((HOST, PORT))
+    received = 0
+    try:
+        sock.sendall(REQUEST %(path, HOST, headers + 'Connection: close\r\n'))
+        data = sock.recv(65536)
+        while data:
+            received += len(data)
+            data = sock.recv(65536)
+    finally:
+        sock.close()
+    return received
+
+def read_response(rfile):
+    '''Read one response from a socket file, using its Content-Length.
+
+    Returns the number of bytes read.
+    '''
+    length = 0
+    line = rfile.readline()
+    if not line:
+        raise socket.error('connection closed')
+    received = len(line)
+    while line.strip():
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':')[1])
+        line = rfile.readline()
+        received += len(line)
+    return received + len(rfile.read(length))
+
+class Results():
+    '''The latency of every request a client made and the bytes it read'''
+
+    def __init__(self):
+        self.latencies = []
+        self.received = 0
+        self.errors = 0
+
+    def add(self, latency, received):
+        self.latencies.append(latency)
+        self.received += received
+
+    def extend(self, other):
+        self.latencies.extend(other.latencies)
+        self.received += other.received
+        self.errors += other.errors
+
+def fetch_persistent(paths, start, deadline, results, headers=''):
+    '''Send GET requests for paths in turn on one connection until the
+    deadline or the server closes it. Returns the index of the next path.
+    '''
+    sock = socket.create_connection((HOST, PORT))
+    rfile = sock.makefile('rb')
+    try:
+        while time.time() < deadline:
+            path = paths[start % len(paths)]
+            began = time.time()
+            sock.sendall(REQUEST %(path, HOST, headers))
+            received = read_response(rfile)
+            results.add(time.time() - began, received)
+            start += 1
+    except socket.error:
+        pass
+    finally:
+        rfile.close()
+        sock.close()
+    return start
+
+def client(args):
+    '''Issue requests until the deadline, starting at offset in paths so
+    clients do not move in step. Returns a Results.
+    '''
+    paths, offset, deadline, keep_alive, headers = args
+    results = Results()
+    i = offset
+    while time.time() < deadline:
+        began = time.time()
+        try:
+            if keep_alive:
+                i = fetch_persistent(paths, i, deadline, results, headers)
+            else:
+                received = fetch(paths[i % len(paths)], headers)
+                results.add(time.time() - began, received)
+                i += 1
+        except socket.error:
+            results.errors += 1
+    return results
+
+def parse_mix(value):
+    '''Returns the request paths of a mix like /a.html:3,/b.css:1, each
+    repeated by its weight and interleaved'''
+    weighted = []
+    for item in value.split(','):
+        path, sep, weight = item.strip().rpartition(':')
+        if not sep or not weight.isdigit():
+            path, weight = item.strip(), '1'
+        weighted.append((path, int(weight)))
+
+    # Spread each path through the sequence rather than in runs
+    paths = []
+    for turn in range(max(weight for path, weight in weighted)):
+        paths.extend(path for path, weight in weighted if weight > turn)
+    return paths
+
+def percentile(ordered, fraction):
+    '''Returns the value at fraction (eg: 0.99) of a sorted list'''
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def wait_for_server(timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            fetch('/')
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('server did not start on %s:%s' %(HOST, PORT))
+
+def start_server(options):
+    cmd = [sys.executable, 'server.py', '--listen', '%s:%d' %(HOST, PORT)] + options
+    proc = subprocess.Popen(cmd, stdout=open('/dev/null', 'w'))
+    wait_for_server()
+    return proc
+
+def process_rss(pid):
+    '''Returns the resident memory in KiB of pid, or 0 if unknown'''
+    try:
+        with open('/proc/%d/status' % pid) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+def process_stat(pid):
+    '''Returns the fields of /proc/<pid>/stat after the command name'''
+    with open('/proc/%d/stat' % pid) as stat:
+        return stat.read().rsplit(')', 1)[1].split()
+
+def server_pids(pid):
+    '''Returns pid and the pids of its worker processes'''
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid = int(process_stat(int(entry))[1])
+        except (IOError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return pids
+
+def server_rss(pid):
+    '''Returns the resident memory in KiB of pid and its worker processes'''
+    return sum(process_rss(p) for p in server_pids(pid))
+
+def server_cpu(pid):
+    '''Returns the user and system CPU seconds used by pid and its workers'''
+    ticks = 0
+    for p in server_pids(pid):
+        try:
+            fields = process_stat(p)
+            ticks += int(fields[11]) + int(fields[12])
+        except (IOError, IndexError, ValueError):
+            pass
+    return ticks / float(os.sysconf('SC_CLK_TCK'))
+
+def open_idle(count):
+    '''Open connections that never send a request, like slow clients'''
+    return [socket.create_connection((HOST, PORT)) for i in range(count)]
+
+def run(options, concurrency, duration, paths, idle=0, keep_alive=False, headers=''):
+    '''Returns a dictionary of measurements for a server started with the
+    given options'''
+    proc = start_server(options)
+    pool = multiprocessing.Pool(concurrency)
+    idlers = open_idle(idle)
+    try:
+        cpu = server_cpu(proc.pid)
+        deadline = time.time() + duration
+        start = time.time()
+        work = [(paths, i * len(paths) // concurrency, deadline, keep_alive, headers)
+            for i in range(concurrency)]
+        results = Results()
+        for result in pool.map(client, work):
+            results.extend(result)
+        elapsed = time.time() - start
+        cpu = server_cpu(proc.pid) - cpu
+        rss = server_rss(proc.pid)
+    finally:
+        for sock in idlers:
+            sock.close()
+        pool.terminate()
+        proc.terminate()
+        proc.wait()
+
+    latencies = sorted(results.latencies)
+    requests = max(len(latencies), 1)
+    return {
+        'requests':len(latencies),
+        'errors':results.errors,
+        'rps':len(latencies) / elapsed,
+        'mean_ms':1000 * sum(latencies) / requests,
+        'p50_ms':1000 * percentile(latencies, 0.50),
+        'p99_ms':1000 * percentile(latencies, 0.99),
+        'p999_ms':1000 * percentile(latencies, 0.999),
+        'cpu_percent':100 * cpu / elapsed,
+        'cpu_us_per_request':1000000 * cpu / requests,
+        'rss_kib':rss,
+        'bytes_per_response':results.received // requests,}
+
+def config_key(result):
+    return (result['workers'], result['threads'], result['keep_alive'], result['variant'])
+
+def load_results(path):
+    '''Returns the results of an earlier --json run keyed on their
+    configuration'''
+    with open(path) as saved:
+        return dict((config_key(result), result) for result in json.load(saved)['results'])
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+def main():
+    global PORT
+    parser = argparse.ArgumentParser(description='Load test server.py')
+    parser.add_argument('--workers', type=int_list, default=[1, 2, 4],
+        help='comma separated worker process counts to test')
+    parser.add_argument('--threads', type=int_list, default=[1],
+        help='comma separated thread pool sizes to test')
+    parser.add_argument('--concurrency', type=int, default=16,
+        help='number of concurrent client connections')
+    parser.add_argument('--duration', type=float, default=5,
+        help='seconds to run each configuration for')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+        help='comma separated paths to request with optional :weight '
+             '(default: %(default)s)')
+    parser.add_argument('--path',
+        help='request only this path, in place of --mix')
+    parser.add_argument('--event-loop', action='store_true',
+        help='start the server with its epoll event loop')
+    parser.add_argument('--idle', type=int, default=0,
+        help='idle connections to hold open while measuring')
+    parser.add_argument('--keep-alive', choices=('off', 'on', 'both'), default='off',
+        help='reuse client connections for many requests')
+    parser.add_argument('--variants', default='',
+        help='semicolon separated sets of extra server.py options to compare, '
+             'eg: "--cache-size 0;--mmap"')
+    parser.add_argument('--accept-encoding', default='',
+        help='send this Accept-Encoding header, eg: gzip')
+    parser.add_argument('--json', metavar='FILE',
+        help='save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+        help='show the change in requests/s and p99 from an earlier --json run')
+    parser.add_argument('--port', type=int, default=PORT,
+        help='port the server under test listens on')
+    args = parser.parse_args()
+    PORT = args.port
+
+    modes = {'off':[False], 'on':[True], 'both':[False, True]}[args.keep_alive]
+    variants = [v.strip() for v in args.variants.split(';')]
+    paths = [args.path] if args.path else parse_mix(args.mix)
+    headers = ''
+    if args.accept_encoding:
+        headers = 'Accept-Encoding: %s\r\n' % args.accept_encoding
+    baseline = load_results(args.compare) if args.compare else {}
+
+    print("%-7s %-7s %-5s %10s %8s %8s %8s %6s %9s %8s %10s  %s" %('workers',
+        'threads', 'keep', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms', 'cpu %',
+        'cpu us/rq', 'rss KiB', 'bytes/resp', 'variant'))
+    saved = []
+    for workers in args.workers:
+        for threads in args.threads:
+            for keep_alive in modes:
+                for variant in variants:
+                    options = ['--workers', str(workers), '--threads', str(threads)]
+                    if args.event_loop:
+                        options.append('--event-loop')
+                    options.extend(variant.split())
+                    result = run(options, args.concurrency, args.duration,
+                        paths, args.idle, keep_alive, headers)
+                    result.update({'workers':workers, 'threads':threads,
+                        'keep_alive':keep_alive, 'variant':variant})
+                    saved.append(result)
+
+                    print("%-7d %-7d %-5s %10.1f %8.3f %8.3f %8.3f %6.1f %9.1f %8d %10d  %s" %(
+                        workers, threads, 'on' if keep_alive else 'off',
+                        result['rps'], result['p50_ms'], result['p99_ms'],
+                        result['p999_ms'], result['cpu_percent'],
+                        result['cpu_us_per_request'], result['rss_kib'],
+                        result['bytes_per_response'], variant))
+
+                    before = baseline.get(config_key(result))
+                    if before is not None:
+                        print("%-21s %+9.1f%% %17s %+7.1f%%" %('  vs --compare',
+                            100 * (result['rps'] / before['rps'] - 1), '',
+                            100 * (result['p99_ms'] / max(before['p99_ms'], 1e-9) - 1)))
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({
+                'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'host':platform.node(),
+                'cpus':multiprocessing.cpu_count(),
+                'python':platform.python_version(),
+                'concurrency':args.concurrency,
+                'duration':args.duration,
+                'paths':paths,
+                'accept_encoding':args.accept_encoding,
+                'results':saved}, out, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1045 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import http
+import mmap
+import multiprocessing
+import os
+import stat
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError: # Optional; without it only precompressed .br files are sent
+    brotli = None
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+def file_etag(st):
+    '''Returns a strong ETag built from a file's inode, size and mtime'''
+    return '"%x-%x-%x"' %(st.st_ino, st.st_size, int(st.st_mtime * 1000000))
+
+def content_etag(data):
+    '''Returns a strong ETag built from a hash of the file contents, which
+    stays the same across servers and copies of the docroot'''
+    return '"%s"' % hashlib.sha1(data).hexdigest()[:32]
+
+class CacheEntry():
+    '''A cached file body with the metadata needed to serve it.
+
+    Arguments:
+        body (str): The file contents exactly as read from disk.
+        ctype (str): The content type of the file (eg: text/html).
+        st: The os.stat() result the body was read under.
+        etag_hash (bool): Use content_etag() rather than file_etag().
+    '''
+
+    def __init__(self, body, ctype, st, etag_hash=False):
+        self.body = body
+        self.ctype = ctype
+        self.length = len(body)
+        self.mtime = st.st_mtime
+        # What is sent, should the file change between stat and read
+        self.size = len(body)
+        self.etag = content_etag(body) if etag_hash else file_etag(st)
+        self.checked = time.time()
+
+    def is_current(self, st):
+        '''Returns True if the file has not changed since it was read'''
+        return self.mtime == st.st_mtime and self.size == st.st_size
+
+    def get_part(self, offset=0, count=None):
+        '''Returns the body, or count bytes of it from offset, to send'''
+        if offset == 0 and count in (None, self.length):
+            return self.body
+        return self.body[offset:offset + (self.length if count is None else count)]
+
+    def release(self):
+        pass
+
+class DiskFile():
+    '''A file that is not held in memory and is streamed from disk.
+
+    Arguments:
+        fp (str): The path of the file.
+        st: The os.stat() result of the file.
+    '''
+
+    def __init__(self, fp, st):
+        self.fp = fp
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        self.etag = file_etag(st)
+
+    def get_part(self, offset=0, count=None):
+        '''Returns an http.FileBody for the file, or count bytes of it from
+        offset. Raises IOError if the file can no longer be opened.
+
+        The body never runs past size, the length the response was framed
+        with, even if the file has grown since.
+        '''
+        return http.FileBody(self.fp, offset, self.size - offset if count is None else count)
+
+    def release(self):
+        pass
+
+    @classmethod
+    def open(cls, fp, st=None):
+        '''Returns a DiskFile for a regular file, or None. A known st saves
+        calling os.stat().'''
+        if st is None:
+            try:
+                st = os.stat(fp)
+            except OSError:
+                return None
+        return cls(fp, st) if stat.S_ISREG(st.st_mode) else None
+
+class LRUCache():
+    '''Entries with a length attribute, bounded by their total length, with
+    the least recently used evicted first.
+
+    Arguments:
+        max_bytes (int): The total length of entries before eviction.
+
+    Attributes:
+        hits, misses, evictions, invalidations (int): Running counters.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stats(self):
+        '''Returns a dictionary of the cache counters and current size'''
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'invalidations':self.invalidations,
+            'entries':len(self.entries),
+            'bytes':self.size,}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _lookup(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def _hit(self, key, entry):
+        with self.lock:
+            self.hits += 1
+            # Move to the most recently used end
+            if key in self.entries:
+                del self.entries[key]
+                self.entries[key] = entry
+        return entry
+
+    def _miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def _invalidate(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.length
+                self.invalidations += 1
+
+    def _insert(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.length
+            self.entries[key] = entry
+            self.size += entry.length
+
+            while self.size > self.max_bytes and self.entries:
+                evicted = self.entries.popitem(last=False)[1]
+                self.size -= evicted.length
+                self.evictions += 1
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+class FileCache(LRUCache):
+    '''An in-memory LRU cache of served files keyed on their absolute path.
+
+    Arguments:
+        directory: The ServerDirectory used to find content types.
+        max_bytes (int): The total size of cached bodies before the least
+            recently used are evicted.
+        max_file (int): Files larger than this are never cached.
+        check_interval (float): Seconds an entry is trusted before the file's
+            mtime is checked again. 0 checks on every hit.
+        etag_hash (bool): Tag entries with a hash of their contents.
+    '''
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024,
+            max_file=1024 * 1024, check_interval=0, etag_hash=False):
+        LRUCache.__init__(self, max_bytes)
+        self.directory = directory
+        self.max_file = max_file
+        self.check_interval = check_interval
+        self.etag_hash = etag_hash
+
+    def get(self, fp, st=None):
+        '''Returns the CacheEntry for a regular file, reading it on a miss.
+
+        Returns None if the file does not exist, is not a regular file or is
+        too large to cache. A known st (eg: from a DocIndex) is trusted in
+        place of calling os.stat().
+        '''
+        entry = self._lookup(fp)
+        if entry is not None and time.time() - entry.checked < self.check_interval:
+            return self._hit(fp, entry)
+
+        if st is None:
+            try:
+                st = os.stat(fp)
+            except OSError:
+                st = None
+
+        if st is None or not stat.S_ISREG(st.st_mode):
+            self._invalidate(fp)
+            return None
+
+        if entry is not None and entry.is_current(st):
+            entry.checked = time.time()
+            return self._hit(fp, entry)
+
+        self._invalidate(fp)
+        self._miss()
+
+        if st.st_size > self.max_file:
+            return None
+        return self._load(fp, st)
+
+    def _load(self, fp, st):
+        try:
+            with open(fp, 'rb') as fbody:
+                # st may be stale (eg: from a DocIndex); describe what is read
+                st = os.fstat(fbody.fileno())
+                body = fbody.read()
+        except (IOError, OSError): # File not accessible.
+            return None
+
+        entry = CacheEntry(body, self.directory.get_ctype(fp), st, self.etag_hash)
+        return self._insert(fp, entry)
+
+class SharedEntry():
+    '''A file found in a SharedFileCache, sent straight out of the shared
+    map rather than copied out of it.
+
+    Like MappedFile, requests hold a reference while they send from it. The
+    entry pins the half of the cache's arena holding the body until the
+    last reference is released, so the body is not overwritten mid-send.
+
+    Arguments:
+        cache (SharedFileCache): The cache the entry was found in.
+        offset (int): Where the body starts in the cache's map.
+        length (int): The length of the body.
+        half (int): The half of the arena pinned for the entry.
+        ctype (str): The content type of the file (eg: text/html).
+        mtime (float): The modification time the body was read under.
+        etag (str): The ETag stored with the body.
+    '''
+
+    def __init__(self, cache, offset, length, half, ctype, mtime, etag):
+        self.cache = cache
+        self.offset = offset
+        self.length = length
+        self.half = half
+        self.ctype = ctype
+        self.mtime = mtime
+        self.size = length
+        self.etag = etag
+        self.refs = 1
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            unpin = self.refs == 0
+        if unpin:
+            self.cache._unpin(self.half)
+
+    def get_part(self, offset=0, count=None):
+        '''Returns an http.BufferBody sending the body, or count bytes of it
+        from offset, out of the shared map. It holds a reference to the
+        entry until it is sent.'''
+        self.acquire()
+        return http.BufferBody(self.cache.map, self.offset + offset,
+            self.length - offset if count is None else count, on_close=self.release)
+
+class SharedFileCache():
+    '''A cache of served files in one anonymous shared memory map, made
+    before pre-forked workers are started so they all read and fill the same
+    copy of each file rather than warming one each.
+
+    The map holds a header, a hash table of slots keyed on path and an arena
+    the paths, ETags and bodies are appended to. Writers take a process
+    shared lock. Lookups take none: each slot has a sequence number, odd
+    while it is written, which is checked unchanged after the slot is read,
+    so an entry overwritten meanwhile is a miss.
+
+    Hits are sent from the map without copying (see SharedEntry), so data
+    in the arena must not be overwritten while it is being sent. The arena
+    is split in two halves that are filled in turn, and each half counts
+    the bodies being sent from it. Once the half being filled is full, the
+    entries of the other half are dropped and it is filled instead, unless
+    a body in it is still being sent; then files are not cached until it
+    is free.
+
+    Arguments:
+        directory: The ServerDirectory used to find content types.
+        max_bytes (int): The size of the arena holding cached files.
+        max_file (int): Files larger than this are never cached.
+        etag_hash (bool): Tag entries with a hash of their contents.
+        sharers (int): The processes sharing the cache, to report the memory
+            saved over one cache in each.
+
+    Attributes:
+        hits, misses, evictions (int): Counters of this process alone.
+    '''
+
+    # magic, slots, bytes in each half, entries, the half being filled, and
+    # the bytes used of and bodies being sent from each half
+    header = struct.Struct('=4sIQQQQQQQ')
+    # seq, path hash, arena offset, body length, file size, mtime, path and
+    # ETag lengths
+    slot = struct.Struct('=QqQQQdHH4x')
+    # Slots probed for a path before the table counts as full
+    max_probe = 8
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024,
+            max_file=1024 * 1024, etag_hash=False, sharers=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.etag_hash = etag_hash
+        self.sharers = sharers
+        self.half = max(1, max_bytes // 2)
+        self.slots = max(64, max_bytes // 4096)
+        self.table = self.header.size
+        self.arena = self.table + self.slots * self.slot.size
+
+        self.map = mmap.mmap(-1, self.arena + 2 * self.half)
+        self.header.pack_into(self.map, 0, 'WSC2', self.slots, self.half, 0, 0, 0, 0, 0, 0)
+        self.lock = multiprocessing.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        '''Returns a dictionary of this process's counters and the size of
+        the shared cache'''
+        fields = self.header.unpack_from(self.map, 0)
+        used = fields[5] + fields[6]
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'entries':fields[3],
+            'bytes':used,
+            'saved_bytes':used * (self.sharers - 1),}
+
+    def get(self, fp, st=None):
+        '''Returns a SharedEntry for a regular file, or a CacheEntry of it
+        just read into the cache on a miss. Returns None if the file does not
+        exist, is not a regular file or is too large to cache. A known st
+        (eg: from a DocIndex) is trusted in place of calling os.stat().
+
+        Call release() on the result once finished with it.
+        '''
+        if st is None:
+            try:
+                st = os.stat(fp)
+            except OSError:
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        key = hash(fp)
+        found = self._find(fp, key)
+        if found is not None:
+            index, seq, offset, length, size, mtime, etag = found
+            if mtime == st.st_mtime and size == st.st_size and self._pin(index, seq, offset):
+                self.hits += 1
+                return SharedEntry(self, self.arena + offset, length, offset // self.half,
+                    self.directory.get_ctype(fp), mtime, etag)
+
+        self.misses += 1
+        if st.st_size > self.max_file:
+            return None
+        return self._load(fp, key)
+
+    def _find(self, fp, key):
+        '''Returns the (slot index, seq, body offset in the arena, length,
+        size, mtime, etag) cached for fp, or None'''
+        data = self.map
+        for index in self._probe(key):
+            at = self.table + index * self.slot.size
+            seq, slot_key, offset, length, size, mtime, path_len, etag_len = \
+                self.slot.unpack_from(data, at)
+            if seq & 1: # Being written
+                return None
+            if not path_len: # Never used since the cache was last emptied
+                return None
+            if slot_key != key:
+                continue
+
+            start = self.arena + offset
+            if data[start:start + path_len] != fp:
+                continue
+            start += path_len
+            etag = data[start:start + etag_len]
+            if self.slot.unpack_from(data, at)[0] != seq: # Overwritten meanwhile
+                return None
+            return index, seq, offset + path_len + etag_len, length, size, mtime, etag
+        return None
+
+    def _probe(self, key):
+        start = key % self.slots
+        return [(start + i) % self.slots for i in range(self.max_probe)]
+
+    def _pin(self, index, seq, offset):
+        '''Count a body being sent from the half of the arena at offset,
+        returning False if the slot has changed since it was found'''
+        with self.lock:
+            if self.slot.unpack_from(self.map, self.table + index * self.slot.size)[0] != seq:
+                return False
+            fields = list(self.header.unpack_from(self.map, 0))
+            fields[7 + offset // self.half] += 1
+            self.header.pack_into(self.map, 0, *fields)
+            return True
+
+    def _unpin(self, half):
+        with self.lock:
+            fields = list(self.header.unpack_from(self.map, 0))
+            fields[7 + half] -= 1
+            self.header.pack_into(self.map, 0, *fields)
+
+    def _load(self, fp, key):
+        try:
+            with open(fp, 'rb') as fbody:
+                # st may be stale (eg: from a DocIndex); describe what is read
+                st = os.fstat(fbody.fileno())
+                body = fbody.read()
+        except (IOError, OSError): # File not accessible.
+            return None
+
+        entry = CacheEntry(body, self.directory.get_ctype(fp), st, self.etag_hash)
+        self._store(fp, key, body, st, entry.etag)
+        return entry
+
+    def _store(self, fp, key, body, st, etag):
+        record = len(fp) + len(etag) + len(body)
+        if record > self.half:
+            return
+        with self.lock:
+            fields = list(self.header.unpack_from(self.map, 0))
+            filling = fields[4]
+            index = self._free_slot(fp, key)
+            if index is None or fields[5 + filling] + record > self.half:
+                if not self._switch(fields):
+                    return
+                filling = fields[4]
+                index = self._free_slot(fp, key)
+                if index is None:
+                    return
+
+            at = self.table + index * self.slot.size
+            seq, old_key, offset, length, old_size, mtime, path_len, etag_len = \
+                self.slot.unpack_from(self.map, at)
+            if not path_len:
+                fields[3] += 1
+            # Readers seeing an odd sequence number treat the slot as a miss
+            self.slot.pack_into(self.map, at, seq + 1, old_key, offset, length,
+                old_size, mtime, path_len, etag_len)
+            offset = filling * self.half + fields[5 + filling]
+            start = self.arena + offset
+            self.map[start:start + record] = fp + etag + body
+            self.slot.pack_into(self.map, at, seq + 2, key, offset, len(body),
+                st.st_size, st.st_mtime, len(fp), len(etag))
+            fields[5 + filling] += record
+            self.header.pack_into(self.map, 0, *fields)
+
+    def _free_slot(self, fp, key):
+        '''Returns the slot holding fp, or the first unused one it may take'''
+        for index in self._probe(key):
+            at = self.table + index * self.slot.size
+            seq, slot_key, offset, length, size, mtime, path_len, etag_len = \
+                self.slot.unpack_from(self.map, at)
+            if not path_len:
+                return index
+            start = self.arena + offset
+            if slot_key == key and self.map[start:start + path_len] == fp:
+                return index
+        return None
+
+    def _switch(self, fields):
+        '''Drop the entries of the half of the arena not being filled and
+        fill it instead, updating the header fields. Returns False if a body
+        in it is still being sent. Called with the lock held.'''
+        other = 1 - fields[4]
+        if fields[7 + other]:
+            return False
+        fields[3] -= self._drop(lambda offset: offset // self.half == other)
+        fields[4] = other
+        fields[5 + other] = 0
+        self.header.pack_into(self.map, 0, *fields)
+        return True
+
+    def _drop(self, dropped):
+        '''Empty the slots of entries at an arena offset for which dropped()
+        is true, returning how many there were. Called with the lock held.'''
+        count = 0
+        for index in range(self.slots):
+            at = self.table + index * self.slot.size
+            seq, key, offset, length, size, mtime, path_len, etag_len = \
+                self.slot.unpack_from(self.map, at)
+            if path_len and dropped(offset):
+                # Moving the sequence number on fails lookups under way
+                self.slot.pack_into(self.map, at, seq + 2, 0, 0, 0, 0, 0.0, 0, 0)
+                count += 1
+        self.evictions += count
+        return count
+
+    def clear(self):
+        '''Drop every entry. The halves of the arena are emptied, but for
+        those with bodies still being sent, which are left to be filled on.'''
+        with self.lock:
+            fields = list(self.header.unpack_from(self.map, 0))
+            self._drop(lambda offset: True)
+            fields[3] = 0
+            for half in (0, 1):
+                if not fields[7 + half]:
+                    fields[5 + half] = 0
+            self.header.pack_into(self.map, 0, *fields)
+
+    def __len__(self):
+        return self.header.unpack_from(self.map, 0)[3]
+
+def gzip_compress(data, level=6):
+    '''Returns data compressed in the gzip format'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+# Content codings that can be applied on the fly, in order of preference
+ENCODERS = OrderedDict()
+if brotli is not None:
+    ENCODERS['br'] = lambda data: brotli.compress(data, quality=5)
+ENCODERS['gzip'] = gzip_compress
+
+class EncodedEntry(CacheEntry):
+    '''A compressed copy of a file.
+
+    Arguments:
+        body (str): The compressed contents.
+        source: The entry, map or disk file that was compressed.
+        coding (str): The content coding of body (eg: gzip).
+    '''
+
+    def __init__(self, body, source, coding):
+        self.body = body
+        self.ctype = None
+        self.length = len(body)
+        self.mtime = source.mtime
+        self.size = len(body)
+        self.coding = coding
+        self.source_etag = source.etag
+        # Each representation needs its own strong ETag
+        self.etag = '%s-%s"' %(source.etag[:-1], coding)
+        self.checked = time.time()
+
+class VariantCache(LRUCache):
+    '''An LRU cache of compressed copies of files, so each version of a file
+    is only compressed once per coding.
+
+    Arguments:
+        max_bytes (int): The total size of compressed copies kept.
+        min_size (int): Files smaller than this are not worth compressing.
+        max_size (int): Files larger than this are not compressed on the fly.
+    '''
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, min_size=256, max_size=1024 * 1024):
+        LRUCache.__init__(self, max_bytes)
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def get(self, fp, coding, source):
+        '''Returns an EncodedEntry of source compressed with coding, or None
+        if it cannot be compressed or compressing does not make it smaller
+        '''
+        key = (fp, coding)
+        entry = self._lookup(key)
+        if entry is not None and entry.source_etag == source.etag:
+            self._hit(key, entry)
+        else:
+            if coding not in ENCODERS or not self.min_size <= source.size <= self.max_size:
+                return None
+            self._miss()
+            part = source.get_part()
+            data = part if isinstance(part, basestring) else part.read()
+            entry = self._insert(key, EncodedEntry(ENCODERS[coding](data), source, coding))
+
+        # Incompressible files stay cached so the work is not repeated
+        return entry if entry.length < source.size else None
+
+class IndexEntry():
+    '''What the docroot index knows about one regular file.
+
+    Arguments:
+        fp (str): The absolute path of the file.
+        st: The os.stat() result of the file when it was indexed.
+        ctype (str): The content type of the file (eg: text/html).
+    '''
+
+    def __init__(self, fp, st, ctype):
+        self.fp = fp
+        self.st = st
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.ctype = ctype
+
+class DocIndex():
+    '''An in-memory index of every file and directory under the docroot, so
+    resolving a request is a dictionary probe rather than stat calls.
+
+    The first lookup once interval seconds have passed since the last walk
+    starts a thread walking the docroot again, so no request waits on a
+    walk; lookups carry on with the old index meanwhile. Changes on disk
+    are therefore seen within about interval seconds, and update() corrects
+    an entry found to be stale sooner.
+
+    Arguments:
+        root (str): The absolute path of the docroot.
+        get_ctype: A function returning the content type of a path.
+        interval (float): Seconds between walks of the docroot.
+
+    Attributes:
+        files: A dictionary of IndexEntry keyed on absolute path.
+        redirects: A dictionary of the Location each directory without a
+            trailing / is redirected to, keyed on absolute path.
+    '''
+
+    def __init__(self, root, get_ctype, interval=2.0):
+        self.root = root
+        self.get_ctype = get_ctype
+        self.interval = interval
+        self.files = {}
+        self.redirects = {}
+        self.scans = 0
+        self.lock = threading.Lock()
+        self.rescan()
+
+    def rescan(self):
+        '''Walk the docroot and replace the index'''
+        files, redirects = {}, {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            redirects[dirpath] = os.path.join(dirpath[len(self.root):] or '/', 'index.html')
+            for name in filenames:
+                fp = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fp)
+                except OSError: # Removed during the walk or a broken link
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    files[fp] = IndexEntry(fp, st, self.get_ctype(fp))
+
+        # Swapped whole so lookups never see a partly built index
+        self.files, self.redirects = files, redirects
+        self.scanned = time.time()
+        self.scans += 1
+
+    def _refresh(self):
+        if time.time() - self.scanned < self.interval:
+            return
+        if self.lock.acquire(False): # Otherwise a walk is already under way
+            walker = threading.Thread(target=self._walk)
+            walker.daemon = True
+            walker.start()
+
+    def _walk(self):
+        try:
+            self.rescan()
+        finally:
+            self.lock.release()
+
+    def update(self, fp, st):
+        '''Replace the entry of a file found to have changed since the last
+        walk with its current os.stat() result'''
+        files = self.files
+        if fp in files:
+            files[fp] = IndexEntry(fp, st, self.get_ctype(fp))
+
+    def get(self, fp):
+        '''Returns the IndexEntry of the regular file at fp, or None'''
+        self._refresh()
+        return self.files.get(fp)
+
+    def get_redirect(self, fp):
+        '''Returns the Location for the directory at fp, or None'''
+        self._refresh()
+        return self.redirects.get(fp)
+
+    def __len__(self):
+        return len(self.files)
+
+# d_type values of directory entries (see readdir(3))
+DT_UNKNOWN, DT_DIR, DT_LNK = 0, 4, 10
+
+# getdents64() system call numbers, by machine
+GETDENTS64 = {'x86_64':217, 'aarch64':61, 'i386':220, 'i686':220}
+
+def _load_getdents():
+    '''Returns a getdents(fd, buf) function reading the next directory
+    entries of an open directory into a ctypes buffer, returning them as a
+    string, or None.
+
+    Python 2 has no os.scandir(), and os.listdir() leaves out the type of
+    each entry, so on Linux the system call is made through libc.
+    '''
+    number = GETDENTS64.get(os.uname()[4])
+    if not sys.platform.startswith('linux') or number is None:
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.syscall
+    except (OSError, AttributeError):
+        return None
+    func.restype = ctypes.c_long
+
+    def getdents(fd, buf):
+        while True:
+            length = func(number, fd, buf, len(buf))
+            if length >= 0:
+                return ctypes.string_at(buf, length)
+            code = ctypes.get_errno()
+            if code != errno.EINTR:
+                raise OSError(code, os.strerror(code))
+
+    return getdents
+
+_getdents = _load_getdents()
+
+def scandir(fp):
+    '''Returns the (name, is_dir) of every entry in the directory at fp,
+    other than . and .., in no particular order.
+
+    The type of an entry comes with its name, so nothing is stat()ed
+    except links and entries of filesystems that do not report types.
+    Raises OSError if fp cannot be listed.
+    '''
+    if _getdents is None:
+        return [(name, os.path.isdir(os.path.join(fp, name))) for name in os.listdir(fp)]
+
+    found = []
+    fd = os.open(fp, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    try:
+        buf = ctypes.create_string_buffer(64 * 1024)
+        data = _getdents(fd, buf)
+        while data:
+            # struct linux_dirent64: u64 d_ino, s64 d_off, u16 d_reclen,
+            # u8 d_type, then the name ending with a NUL
+            position, find = 0, data.find
+            while position < len(data):
+                end = find('\0', position + 19)
+                name, kind = data[position + 19:end], ord(data[position + 18])
+                position += ord(data[position + 16]) | ord(data[position + 17]) << 8
+                if name == '.' or name == '..':
+                    continue
+                if kind == DT_UNKNOWN or kind == DT_LNK:
+                    found.append((name, os.path.isdir(os.path.join(fp, name))))
+                else:
+                    found.append((name, kind == DT_DIR))
+            data = _getdents(fd, buf)
+    finally:
+        os.close(fd)
+    return found
+
+class ListingEntry():
+    '''A rendered page of a directory listing, or the sorted entries of a
+    directory the pages are cut from.
+
+    Arguments:
+        body: The page as a string, or the list of entry names, those of
+            directories ending with /.
+        mtime (float): The modification time of the directory listed.
+        length (int): The bytes held, by default the length of body.
+    '''
+
+    def __init__(self, body, mtime, length=None):
+        self.body = body
+        self.mtime = mtime
+        self.length = len(body) if length is None else length
+
+class ListingCache(LRUCache):
+    '''Directory listings rendered as http.HTMLListingPage, keyed on the
+    directory, the location it was requested as (which the page shows),
+    sort order and page. Each is rendered again once the mtime
+    of its directory changes, which is all a lookup checks.
+
+    Arguments:
+        directory: The ServerDirectory to list directories from.
+        max_bytes (int): The total size of rendered pages and sorted
+            listings before the least recently used are evicted.
+        page_size (int): Entries listed on each page, 0 to list a directory
+            on one page that is streamed (see stream()) rather than cached.
+    '''
+
+    # Sort keys by name, None sorting on the name alone. Directories come
+    # first in either order.
+    sorts = OrderedDict((
+        ('name', None),
+        ('type', lambda name: (os.path.splitext(name)[1], name))))
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, page_size=1000):
+        LRUCache.__init__(self, max_bytes)
+        self.directory = directory
+        self.page_size = page_size
+
+    def get(self, fp, location, sort='name', reverse=False, page=1):
+        '''Returns the ListingEntry of one page of the listing of the
+        directory at fp, requested as location. Returns None if fp is not a
+        directory that can be listed or there is no such page.
+        '''
+        mtime = self.directory.get_listing_mtime(fp)
+        if mtime is None:
+            return None
+
+        key = (fp, location, sort, reverse, page)
+        entry = self._lookup(key)
+        if entry is not None and entry.mtime == mtime:
+            return self._hit(key, entry)
+        self._miss()
+
+        entries = self._sorted(fp, mtime, sort, reverse)
+        if entries is None:
+            return None
+        pages = max(1, (len(entries) + self.page_size - 1) // self.page_size)
+        if not 1 <= page <= pages:
+            return None
+        shown = entries[(page - 1) * self.page_size:page * self.page_size]
+        body = http.HTMLListingPage(location, shown, sort, reverse, page, pages).get_page()
+        return self._insert(key, ListingEntry(body, mtime))
+
+    def stream(self, fp, location, sort='name', reverse=False):
+        '''Returns (mtime, chunks) listing the whole directory at fp on one
+        page, chunks being the strings of the page as they are rendered (see
+        http.HTMLListingPage.get_chunks). Only the sorted entries are cached.
+        Returns None if fp is not a directory that can be listed.
+        '''
+        mtime = self.directory.get_listing_mtime(fp)
+        if mtime is None:
+            return None
+        entries = self._sorted(fp, mtime, sort, reverse)
+        if entries is None:
+            return None
+        return mtime, http.HTMLListingPage(location, entries, sort, reverse).get_chunks()
+
+    def _sorted(self, fp, mtime, sort, reverse=False):
+        '''Returns the entries of a directory in sort order, listing it
+        again if it has changed since last sorted'''
+        key = (fp, sort)
+        entry = self._lookup(key)
+        if entry is not None and entry.mtime == mtime:
+            return self._ordered(self._hit(key, entry).body, reverse)
+
+        try:
+            entries = self.directory.list_directory(fp)
+        except OSError:
+            return None
+        dirs = sorted((name for name, is_dir in entries if is_dir), key=self.sorts[sort])
+        files = sorted((name for name, is_dir in entries if not is_dir), key=self.sorts[sort])
+        names = [name + '/' for name in dirs] + files
+        # Roughly what the list of strings takes in memory
+        size = sum(len(name) + 48 for name in names)
+        if size <= self.max_bytes:
+            self._insert(key, ListingEntry(names, mtime, size))
+        return self._ordered(names, reverse)
+
+    def _ordered(self, names, reverse):
+        '''Returns sorted names, reversed if asked with directories first'''
+        if not reverse:
+            return names
+        dirs = self._count_directories(names)
+        return names[dirs - 1::-1] + names[:dirs - 1:-1] if dirs else names[::-1]
+
+    def _count_directories(self, names):
+        '''Returns the number of directories at the front of sorted names'''
+        low, high = 0, len(names)
+        while low < high:
+            middle = (low + high) // 2
+            if names[middle].endswith('/'):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+class MappedFile():
+    '''A read-only memory map of a file shared by every request serving it.
+
+    The mapping is MAP_SHARED, so its pages are the kernel page cache and are
+    shared by all worker processes mapping the same file. Requests hold a
+    reference while they send from it; once the file changes the mapping is
+    retired and unmapped when the last request releases it.
+
+    Files should be updated by renaming a new file into place. Truncating a
+    mapped file in place makes reads past its new end fault.
+
+    Arguments:
+        fp (str): The path of the file to map.
+        st: The os.stat() result of the file.
+        etag_hash (bool): Use content_etag() rather than file_etag().
+    '''
+
+    def __init__(self, fp, st, etag_hash=False):
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        self.etag = file_etag(st)
+        self.refs = 0
+        self.retired = False
+        self.lock = threading.Lock()
+
+        # Empty files cannot be mapped
+        self.data = ''
+        with open(fp, 'rb') as fbody:
+            # st may be stale (eg: from a DocIndex); describe what is mapped
+            st = os.fstat(fbody.fileno())
+            self.mtime, self.size, self.etag = st.st_mtime, st.st_size, file_etag(st)
+            if self.size > 0:
+                self.data = mmap.mmap(fbody.fileno(), 0, access=mmap.ACCESS_READ)
+        if etag_hash:
+            self.etag = content_etag(self.data)
+
+    def is_current(self, st):
+        return self.mtime == st.st_mtime and self.size == st.st_size
+
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs == 0 and self.retired:
+                self._unmap()
+
+    def retire(self):
+        '''Unmap once no request is using the mapping any more'''
+        with self.lock:
+            self.retired = True
+            if self.refs == 0:
+                self._unmap()
+
+    def get_part(self, offset=0, count=None):
+        '''Returns an http.BufferBody sending from the mapping, holding a
+        reference to it until the body is sent'''
+        self.acquire()
+        return http.BufferBody(self.data, offset, count, on_close=self.release)
+
+    def _unmap(self):
+        if not isinstance(self.data, str):
+            self.data.close()
+        self.data = ''
+
+    def __len__(self):
+        return self.size
+
+class MappedFiles():
+    '''The memory maps of served files, keyed on their absolute path.
+
+    Arguments:
+        max_files (int): Mappings kept before the least recently used is
+            retired, bounding open file descriptors.
+        etag_hash (bool): Tag mappings with a hash of their contents.
+    '''
+
+    def __init__(self, max_files=1024, etag_hash=False):
+        self.max_files = max_files
+        self.etag_hash = etag_hash
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, fp, st=None):
+        '''Returns an acquired MappedFile for a regular file, mapping it again
+        if it has changed, or None. The caller must release() it. A known st
+        is trusted in place of calling os.stat().
+        '''
+        if st is None:
+            try:
+                st = os.stat(fp)
+            except OSError:
+                st = None
+
+        with self.lock:
+            mapped = self.files.pop(fp, None)
+            if st is None or not stat.S_ISREG(st.st_mode):
+                if mapped is not None:
+                    mapped.retire()
+                return None
+
+            if mapped is not None and not mapped.is_current(st):
+                mapped.retire()
+                mapped = None
+
+            if mapped is None:
+                try:
+                    mapped = MappedFile(fp, st, self.etag_hash)
+                except (IOError, OSError, ValueError):
+                    return None
+
+            self.files[fp] = mapped
+            while len(self.files) > self.max_files:
+                path, old = self.files.popitem(last=False)
+                old.retire()
+            return mapped.acquire()
+
+    def clear(self):
+        with self.lock:
+            for mapped in self.files.values():
+                mapped.retire()
+            self.files.clear()
+
+    def __len__(self):
+        return len(self.files)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import ConfigParser
+import re
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Server settings from a config file named with --config. Settings go in a
+# [server] section, keyed on the long command line flags without their
+# dashes. Flags given on the command line take precedence, and repeatable
+# flags add to the values of the file:
+#
+#   [server]
+#   listen = 127.0.0.1:8080 [::1]:8080
+#   workers = 4
+#   reuse-port = yes
+#   mime-type = .mjs=text/javascript .wasm=application/wasm
+
+SECTION = 'server'
+
+BOOLEANS = {'1':True, 'yes':True, 'true':True, 'on':True,
+    '0':False, 'no':False, 'false':False, 'off':False}
+
+def parse_address(value):
+    '''Returns the (host, port) of an address like 127.0.0.1:8080,
+    [::1]:8080, localhost:8080 or :8080 (every interface)'''
+    match = re.match(r'^(?:\[([0-9A-Za-z:.%]+)\]|([0-9A-Za-z.-]*)):(\d+)$', value.strip())
+    if match is None or int(match.group(3)) > 65535:
+        raise ValueError('expected HOST:PORT (eg: 127.0.0.1:8080 or [::1]:8080): %s' % value)
+    host = match.group(1) if match.group(1) is not None else match.group(2)
+    return host, int(match.group(3))
+
+def format_address(address):
+    '''Returns a (host, port) socket address as parse_address() reads it'''
+    host, port = address[:2]
+    if ':' in host:
+        return '[%s]:%d' %(host, port)
+    return '%s:%d' %(host, port)
+
+def read_file(path, parser):
+    '''Returns the settings of a config file as a dictionary of defaults for
+    an argparse parser, each converted like the flag it names'''
+    config = ConfigParser.RawConfigParser()
+    with open(path) as f:
+        config.readfp(f)
+    if not config.has_section(SECTION):
+        return {}
+
+    actions = dict((action.dest, action) for action in parser._actions
+        if action.option_strings)
+    settings = {}
+    for key, value in config.items(SECTION):
+        action = actions.get(key.replace('-', '_'))
+        if action is None or action.dest in ('config', 'help'):
+            raise ValueError('unknown setting: %s' % key)
+        settings[action.dest] = convert(action, value)
+    return settings
+
+def convert(action, value):
+    '''Convert a config file value like argparse converts the flag'''
+    if action.nargs == 0: # A switch such as --mmap
+        if value.lower() not in BOOLEANS:
+            raise ValueError('expected yes or no for %s: %s' %(action.dest, value))
+        return action.const if BOOLEANS[value.lower()] else action.default
+    if isinstance(action.default, list): # A repeatable flag
+        return [convert_one(action, item) for item in value.split()]
+    return convert_one(action, value)
+
+def convert_one(action, value):
+    if action.type is not None:
+        value = action.type(value)
+    if action.choices is not None and value not in action.choices:
+        raise ValueError('%s must be one of %s' %(action.dest, ', '.join(map(str, action.choices))))
+    return value
+
+def parse_args(parser, argv=None):
+    '''Parse command line arguments, with defaults from the config file
+    given with --config'''
+    args = parser.parse_args(argv)
+    if args.config is None:
+        return args
+    try:
+        parser.set_defaults(**read_file(args.config, parser))
+    except (IOError, ValueError, ConfigParser.Error) as e:
+        parser.error('%s: %s' %(args.config, e))
+    return parser.parse_args(argv)
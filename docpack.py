@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import cache
+import http
+import mime
+import mmap
+import os
+import stat
+import struct
+import sys
+import tempfile
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Packs a docroot into one read-only file that server.py serves from a
+# single memory map (see --pack). Deploy by building the pack next to the
+# old one, renaming it into place and sending the server SIGHUP.
+#
+# run: python docpack.py www www.pack [--compress]
+
+# The layout of a pack:
+#
+#   header   magic, version, entries, offset of the index, offset of strings
+#   bodies   each file's contents, starting on a page boundary
+#   strings  the path, content type and ETag of each entry, back to back
+#   index    one fixed size record per file or directory, sorted on path
+#
+# Paths are relative to the docroot and start with / (the docroot is /).
+HEADER = struct.Struct('=8sIIQQ')
+# kind, path, content type and ETag lengths, strings offset, body offset,
+# size, mtime
+RECORD = struct.Struct('=BHHHQQQd')
+MAGIC = 'WWWPACK1'
+VERSION = 1
+FILE, DIRECTORY = 0, 1
+
+# Bodies start on a page so each can be mapped and read on its own pages
+ALIGN = 4096
+
+# Suffixes of the precompressed copies the server looks for (see
+# RequestHandler.precompressed)
+SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+class PackedFile():
+    '''A file served from a pack. Has the interface of cache.CacheEntry.
+
+    Arguments:
+        data: The memory map of the pack.
+        offset (int): Where the file's body starts in data.
+        size (int): The length of the body.
+        mtime (float): The modification time of the file when packed.
+        ctype (str): The Content-Type of the file.
+        etag (str): The ETag of the file.
+    '''
+
+    def __init__(self, data, offset, size, mtime, ctype, etag):
+        self.data = data
+        self.offset = offset
+        self.size = size
+        self.length = size
+        self.mtime = mtime
+        self.ctype = ctype
+        self.etag = etag
+
+    def get_part(self, offset=0, count=None):
+        '''Returns an http.BufferBody sending from the pack's memory map'''
+        if count is None:
+            count = self.size - offset
+        return http.BufferBody(self.data, self.offset + offset, count)
+
+    def release(self):
+        # The map is closed once the last body sending from it is dropped
+        pass
+
+class DocPack():
+    '''A pack built by build(), mapped into memory.
+
+    Opening a pack reads only its header; lookups binary search the index in
+    the map, so startup does not depend on the number of files and serving
+    makes no filesystem calls. The pack must not be changed in place once
+    open; replace it by renaming a new one over it.
+
+    Arguments:
+        fp (str): The path of the pack.
+
+    Raises:
+        ValueError: The file is not a pack of this version.
+    '''
+
+    def __init__(self, fp):
+        self.fp = fp
+        with open(fp, 'rb') as fpack:
+            self.data = mmap.mmap(fpack.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            raise ValueError('%s is not a pack' % fp)
+        magic, version, self.count, self.index, self.strings = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d pack' %(fp, VERSION))
+
+    def _record(self, i):
+        '''Returns the record of the i'th entry in path order'''
+        return RECORD.unpack_from(self.data, self.index + i * RECORD.size)
+
+    def _find(self, path):
+        '''Returns the record of path, or None'''
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._record(middle)
+            start = self.strings + record[4]
+            found = data[start:start + record[1]]
+            if found == path:
+                return record
+            if found < path:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, path):
+        '''Returns a PackedFile of the file at path, or None'''
+        record = self._find(path)
+        if record is None or record[0] != FILE:
+            return None
+        kind, path_len, ctype_len, etag_len, strings, body, size, mtime = record
+        start = self.strings + strings + path_len
+        ctype = self.data[start:start + ctype_len]
+        etag = self.data[start + ctype_len:start + ctype_len + etag_len]
+        return PackedFile(self.data, body, size, mtime, ctype, etag)
+
+    def is_directory(self, path):
+        record = self._find(path)
+        return record is not None and record[0] == DIRECTORY
+
+    def get_mtime(self, path):
+        '''Returns the modification time of the directory at path when it
+        was packed, or None if it is not a directory'''
+        record = self._find(path)
+        return record[7] if record is not None and record[0] == DIRECTORY else None
+
+    def list_directory(self, path):
+        '''Returns the (name, is_dir) of every entry in the directory at
+        path, in path order. Its entries are next to each other in the index,
+        following the directory itself.'''
+        prefix = path.rstrip('/') + '/'
+        data = self.data
+        low, high = 0, self.count
+        while low < high: # The first path not before the prefix
+            middle = (low + high) // 2
+            record = self._record(middle)
+            start = self.strings + record[4]
+            if data[start:start + record[1]] < prefix:
+                low = middle + 1
+            else:
+                high = middle
+
+        found = []
+        for i in range(low, self.count):
+            record = self._record(i)
+            start = self.strings + record[4]
+            found_path = data[start:start + record[1]]
+            if not found_path.startswith(prefix):
+                break
+            name = found_path[len(prefix):]
+            if name and '/' not in name:
+                found.append((name, record[0] == DIRECTORY))
+        return found
+
+    def paths(self):
+        '''Returns the sorted paths of every file and directory'''
+        found = []
+        for i in range(self.count):
+            record = self._record(i)
+            start = self.strings + record[4]
+            found.append(self.data[start:start + record[1]])
+        return found
+
+    def __len__(self):
+        return self.count
+
+def walk(root):
+    '''Returns the (path, absolute path, os.stat() result) of every file
+    and directory under root, paths relative to it'''
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative = dirpath[len(root):] or '/'
+        found.append((relative, dirpath, os.stat(dirpath)))
+        for name in filenames:
+            fp = os.path.join(dirpath, name)
+            try:
+                st = os.stat(fp)
+            except OSError: # Removed during the walk or a broken link
+                continue
+            if stat.S_ISREG(st.st_mode):
+                found.append((os.path.join(relative, name), fp, st))
+    return found
+
+def build(root, target, compress=False, types=None):
+    '''Pack the docroot at root into target, replacing it atomically.
+
+    Arguments:
+        root (str): The docroot to pack.
+        target (str): The path of the pack to write.
+        compress (bool): Also pack compressed copies of text files (eg:
+            base.css.gz), unless the docroot already has them or they are no
+            smaller.
+        types (mime.MimeTypes): The media types of files, by default
+            mime.default_types().
+
+    Returns the number of entries packed.
+    '''
+    root = os.path.abspath(root)
+    types = types if types is not None else mime.default_types()
+    found = walk(root)
+    present = set(path for path, fp, st in found)
+
+    # (path, kind, content type, file, mtime, content coding or None). Bodies
+    # are read, and compressed, one at a time as the pack is written.
+    entries = []
+    for path, fp, st in found:
+        if stat.S_ISDIR(st.st_mode):
+            entries.append((path, DIRECTORY, '', None, st.st_mtime, None))
+            continue
+        mtype = types.get(fp)
+        entries.append((path, FILE, mtype.content_type, fp, st.st_mtime, None))
+        if not (compress and mtype.compressible):
+            continue
+        for coding, suffix in SUFFIXES:
+            if coding in cache.ENCODERS and path + suffix not in present:
+                entries.append((path + suffix, FILE, types.get(fp + suffix).content_type,
+                    fp, st.st_mtime, coding))
+    entries.sort(key=lambda entry: entry[0])
+
+    directory = os.path.dirname(os.path.abspath(target))
+    handle, temp = tempfile.mkstemp(prefix='.pack-', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write('\0' * ALIGN) # The header is written last
+            offset, strings, records = ALIGN, [], []
+            strings_size = 0
+            for path, kind, ctype, fp, mtime, coding in entries:
+                body = read_body(fp, coding) if kind == FILE else None
+                if body is None and kind == FILE: # Not worth compressing
+                    continue
+                etag = cache.content_etag(body) if body is not None else ''
+                size = 0
+                if body is not None:
+                    out.write(body)
+                    size = len(body)
+                    padding = -size % ALIGN
+                    out.write('\0' * padding)
+                records.append(RECORD.pack(kind, len(path), len(ctype), len(etag),
+                    strings_size, offset if body is not None else 0, size, mtime))
+                strings.append(path + ctype + etag)
+                strings_size += len(path) + len(ctype) + len(etag)
+                if body is not None:
+                    offset += size + padding
+
+            out.write(''.join(strings))
+            index = offset + strings_size
+            out.write(''.join(records))
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, len(records), index, offset))
+        os.chmod(temp, 0644)
+        os.rename(temp, target)
+    except:
+        os.remove(temp)
+        raise
+    return len(records)
+
+def read_body(fp, coding=None):
+    '''Returns the contents of the file at fp, or a copy compressed with
+    coding, None if that is no smaller'''
+    with open(fp, 'rb') as fbody:
+        body = fbody.read()
+    if coding is None:
+        return body
+    encoded = cache.ENCODERS[coding](body)
+    return encoded if len(encoded) < len(body) else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack a docroot for server.py --pack')
+    parser.add_argument('root', help='the docroot to pack')
+    parser.add_argument('target', help='the pack to write, replaced atomically')
+    parser.add_argument('--compress', action='store_true',
+        help='also pack compressed copies of text files')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error('%s is not a directory' % args.root)
+    count = build(args.root, args.target, args.compress)
+    print("Packed %d entries into %s (%d bytes)" %(count, args.target,
+        os.path.getsize(args.target)))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import binascii
+import cgi
+import collections
+import ctypes
+import ctypes.util
+import email.utils
+import errno
+import io
+import mime
+import operator
+import os
+import re
+import select
+import socket
+import sys
 import time
-from collections import OrderedDict
+import urllib
 
 # Copyright 2015 Michael Raypold
 #
@@ -37,10 +52,18 @@ class HTTPStatus():
 
     codes = {
         '200':'OK',
+        '206':'Partial Content',
         '301':'Moved Permanently',
+        '304':'Not Modified',
         '400':'Bad Request',
         '404':'Not Found',
-        '500':'Internal Server Error',}
+        '408':'Request Timeout',
+        '416':'Requested Range Not Satisfiable',
+        '429':'Too Many Requests',
+        '431':'Request Header Fields Too Large',
+        '500':'Internal Server Error',
+        '501':'Not Implemented',
+        '503':'Service Unavailable',}
 
     def __init__(self, protocol, status):
         status = self._to_str(status)
@@ -68,6 +91,45 @@ class HTTPStatus():
     def __str__(self):
         return self.get_hstatus()
 
+# Header lines that repeat across responses, built once each. Bounded so
+# unusual values cannot grow them without limit.
+_status_lines = {}
+_field_lines = {}
+_max_lines = 1024
+
+def status_line(protocol, status):
+    '''Returns the status line (eg: HTTP/1.1 200 OK), built once per
+    protocol and status'''
+    key = (protocol, status)
+    line = _status_lines.get(key)
+    if line is None:
+        line = HTTPStatus(protocol, status).get_hstatus()
+        if len(_status_lines) < _max_lines:
+            _status_lines[key] = line
+    return line
+
+def field_line(name, value):
+    '''Returns the header line name: value, built once per pair'''
+    key = (name, value)
+    line = _field_lines.get(key)
+    if line is None:
+        line = '%s: %s\r\n' %(name, value)
+        if len(_field_lines) < _max_lines:
+            _field_lines[key] = line
+    return line
+
+_date = (0, '')
+
+def date_line():
+    '''Returns the Date header line, formatted at most once a second'''
+    global _date
+    now = int(time.time())
+    second, line = _date
+    if second != now:
+        line = 'Date: %s\r\n' % http_date(now)
+        _date = (now, line)
+    return line
+
 class HTTPHeader():
     '''Builds an HTTP header response.
 
@@ -75,41 +137,106 @@ class HTTPHeader():
         Protocol: The HTTP protocol (eg: HTTP/1.1).
         Status: A valid HTTP status code (No checking is performed. eg: 200 OK).
         Type: Content type of the message (eg: text/html).
+        Length: The length of the message body, or None to leave
+            Content-Length out (eg: for a chunked body, see set_chunked()).
 
     Attributes:
-        header: an ordered dictionary containing required HTTP header lines.
+        header: a dictionary of header lines keyed on field, joined in the
+            order of fields. Unset fields are empty strings.
 
     See http://en.wikipedia.org/wiki/HTTP_message_body .
     '''
 
-    def __init__(self, protocol, status, ctype, length):
-        self.header = OrderedDict((
-            ('request_status',''),
-            ('date','Date: '),
-            ('server','Server: CMPUT 404 Webserver\r\n'),
-            ('content_type','Content-Type: '),
-            ('content_length','Content-Length: '),
-            ('blank','\r\n')))
+    fields = (
+        'request_status',
+        'date',
+        'server',
+        'content_type',
+        'content_length',
+        'transfer_encoding',
+        'accept_ranges',
+        'content_range',
+        'content_encoding',
+        'vary',
+        'etag',
+        'last_modified',
+        'location',
+        'connection',
+        'blank')
+
+    template = dict.fromkeys(fields, '')
+    template['server'] = 'Server: CMPUT 404 Webserver\r\n'
+    template['blank'] = '\r\n'
+
+    _values = operator.itemgetter(*fields)
 
+    def __init__(self, protocol, status, ctype, length):
+        self.header = self.template.copy()
         self.set_status(protocol, status)
         self.set_content_type(ctype)
         self.set_date()
         self.set_length(length)
 
     def set_status(self, protocol, status):
-        self.header['request_status'] = HTTPStatus(protocol, status).get_hstatus()
+        self.header['request_status'] = status_line(protocol, status)
 
     def set_content_type(self, ctype):
-        self.header['content_type'] = 'Content-Type: %s\r\n' %ctype
+        self.ctype = ctype
+        self.header['content_type'] = field_line('Content-Type', ctype)
 
     def set_date(self):
-        self.header['date'] = 'Date: %s\r\n' %time.strftime('%a, %d %b %Y %H:%M:%S %z')
+        self.header['date'] = date_line()
 
     def set_length(self, length):
-        self.header['content_length'] = 'Content-Length: %s\r\n' %str(length)
+        if length is None:
+            self.length = None
+            self.header['content_length'] = ''
+            return
+        self.length = int(length)
+        self.header['content_length'] = 'Content-Length: %d\r\n' %self.length
+
+    def set_chunked(self):
+        '''Send the body with the chunked transfer coding, in place of a
+        Content-Length'''
+        self.set_length(None)
+        self.header['transfer_encoding'] = 'Transfer-Encoding: chunked\r\n'
+
+    def set_accept_ranges(self, unit='bytes'):
+        self.header['accept_ranges'] = field_line('Accept-Ranges', unit)
+
+    def set_content_range(self, start, end, size):
+        '''Sets Content-Range for the inclusive byte range start to end, or
+        for an unsatisfiable range if start is None'''
+        if start is None:
+            self.header['content_range'] = 'Content-Range: bytes */%d\r\n' %size
+        else:
+            self.header['content_range'] = 'Content-Range: bytes %d-%d/%d\r\n' %(start, end, size)
+
+    def set_content_encoding(self, encoding):
+        self.header['content_encoding'] = field_line('Content-Encoding', encoding)
+
+    def set_vary(self, fields):
+        self.header['vary'] = field_line('Vary', fields)
+
+    def set_etag(self, etag):
+        self.header['etag'] = 'ETag: %s\r\n' %etag
+
+    def set_last_modified(self, timestamp):
+        self.header['last_modified'] = 'Last-Modified: %s\r\n' %http_date(timestamp)
+
+    def unset(self, key):
+        '''Leave the header line for key (eg: content_length) out entirely'''
+        self.header[key] = ''
+
+    def set_location(self, location):
+        self.header['location'] = 'Location: %s\r\n' %location
+
+    def set_connection(self, connection):
+        '''Sets the Connection header (eg: close or keep-alive)'''
+        self.header['connection'] = field_line('Connection', connection)
 
     def get_length(self):
-        return int(self.header.get('content_length').split()[1])
+        return self.length
 
     def get_protocol(self):
         return self.get_rstatus().split()[0]
@@ -118,16 +245,16 @@ class HTTPHeader():
         return self.header.get('request_status')
 
     def get_ctype(self):
-        return self.header.get('content_type').split()[1]
+        return self.ctype
 
     def _get_keys(self):
-        return self.header.keys()
+        return list(self.fields)
 
     def _get_values(self):
-        return self.header.values()
+        return list(self._values(self.header))
 
     def get_string(self):
-        return ''.join(self._get_values())
+        return ''.join(self._values(self.header))
 
     def __str__(self):
         return self.get_string()
@@ -139,60 +266,760 @@ class HTTPMessage():
         protocol (str): The HTTP protocol (eg: HTTP/1.1).
         status (str): A valid HTTP status code (No checking is performed. eg: 200 OK).
         fp: The filepath of the file to be included in the HTTP response.
+        body (str): The contents of fp if already in memory (eg: cached).
+        ctype (str): The content type of body, found from fp if not given.
+        stream (bool): Send fp straight from disk with get_parts() rather
+            than reading it into mbody.
+        chunks: An iterable of strings (eg: a generator) to stream as the
+            body in place of fp, see ChunkedBody. They are sent chunked to
+            HTTP/1.1 clients; others read until the connection is closed,
+            which is left to the caller. length is ignored.
 
     Attributes:
         mbody (str): The message body of an HTTP header.
+        fbody: The open FileBody to stream when stream is set, or the
+            ChunkedBody of chunks.
 
     The given filepath is assumed to be valid and should be checked prior to
     calling HTTPMessage().
     '''
 
-    def __init__(self, protocol, status, length, fp=None):
+    def __init__(self, protocol, status, length, fp=None, body=None, ctype=None, stream=False,
+            chunks=None):
         self.mbody = ''
-
-        if(fp is None):
+        self.fbody = None
+
+        if(chunks is not None):
+            self.header = HTTPHeader(protocol, status, ctype or 'text/html', None)
+            if(protocol == 'HTTP/1.1'):
+                self.header.set_chunked()
+            self.fbody = ChunkedBody(chunks, protocol == 'HTTP/1.1')
+        elif(fp is None):
             self.header = HTTPHeader(protocol, status, 'text/html', length)
-            self._create_404()
+            self._create_error(status if str(status) in HTMLErrorPage.errors else '404')
+        elif(body is not None):
+            self.header = HTTPHeader(protocol, status, ctype or self.get_ctype(fp), length)
+            self.mbody = body
+        elif(stream):
+            self.header = HTTPHeader(protocol, status, ctype or self.get_ctype(fp), length)
+            self._open_fbody(fp)
         else:
             self.header = HTTPHeader(protocol, status, self.get_ctype(fp), length)
             self._extract_mbody(fp)
 
     def get_ctype(self, fp):
-        if(fp.endswith('.html')):
-            return 'text/html'
-        elif(fp.endswith('.css')):
-            return 'text/css'
-        else:
-            return 'text/plain'
+        return mime.default_types().get(fp).content_type
 
     def _extract_mbody(self, fp):
         '''Extract file contents into the HTTPMessage'''
         try:
-            with open(fp, 'r') as fbody:
+            with open(fp, 'rb') as fbody:
                 self.mbody = fbody.read()
         except IOError: # File not accessile.
             self._create_404()
 
+    def _open_fbody(self, fp):
+        '''Open the file to be streamed, sizing the header from the open file'''
+        try:
+            self.fbody = FileBody(fp)
+            self.header.set_length(self.fbody.remaining)
+        except (IOError, OSError): # File not accessile.
+            self._create_404()
+
     def _create_404(self):
-        page = HTMLErrorPage('404')
-        self.mbody = page.get_page()
-        self.header.set_status(self.header.get_protocol(), '404')
-        self.header.set_length(str(page.get_byte_size()))
+        self._create_error('404')
+
+    def _create_error(self, code):
+        self.mbody = error_page(code)
+        self.header.set_status(self.header.get_protocol(), code)
+        self.header.set_length(len(self.mbody))
 
     def get_header(self):
         return self.header
 
     def get_message_body(self):
-        return self.mbody.encode('utf-8')
+        return to_bytes(self.mbody)
 
     def get_package(self):
         '''Combines the header and message for an outgoing HTTP response'''
-        result = self.header.get_string() + self.mbody
-        return result.encode('utf-8')
+        if self.fbody is not None:
+            return self.header.get_string() + self.fbody.read()
+        return self.header.get_string() + self.get_message_body()
+
+    def get_parts(self):
+        '''Returns the response as a list of strings and body objects (eg:
+        FileBody) to be written in order with send_parts()
+        '''
+        if self.fbody is not None:
+            return [self.header.get_string(), self.fbody]
+        return [self.header.get_string(), self.get_message_body()]
 
     def __str__(self):
         return self.get_package()
 
+def to_bytes(data):
+    '''Encode unicode text as UTF-8, leaving byte strings (eg: binary files)
+    untouched'''
+    return data.encode('utf-8') if isinstance(data, unicode) else data
+
+def _load_sendfile():
+    '''Returns a sendfile(out_fd, in_fd, offset, count) function, or None.
+
+    Python 2 has no os.sendfile, so on Linux the libc call is used through
+    ctypes. Anywhere else bodies are copied through a userspace buffer.
+    '''
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, 'sendfile64', None) or libc.sendfile
+    except (OSError, AttributeError):
+        return None
+
+    func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    func.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        offset = ctypes.c_int64(offset)
+        sent = func(out_fd, in_fd, ctypes.byref(offset), count)
+        if sent < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return sent
+
+    return sendfile
+
+_sendfile = _load_sendfile()
+
+# Most buffers gathered into one writev() call; Linux allows 1024
+IOV_MAX = 64
+
+# In-memory parts totalling no more than this are joined and sent with one
+# send() rather than gathered with writev(). Through ctypes a writev() costs
+# a few microseconds more than send(), which copying 64 KiB undercuts.
+JOIN_LIMIT = 64 * 1024
+
+def _load_writev():
+    '''Returns a writev(fd, buffers) function writing a list of strings and
+    buffer objects in one system call, or None.
+
+    Python 2 sockets have no sendmsg(), so the libc call is used through
+    ctypes. Each iovec points straight at the memory of its buffer, so
+    nothing is joined or copied before the kernel reads it.
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.writev
+        as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+    except (OSError, AttributeError):
+        return None
+
+    # A c_char_p field set to a str points at the string's own bytes
+    class iovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_char_p), ('iov_len', ctypes.c_size_t)]
+
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_int]
+    func.restype = ctypes.c_ssize_t
+    as_read_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(ctypes.c_char_p),
+        ctypes.POINTER(ctypes.c_ssize_t)]
+    as_read_buffer.restype = ctypes.c_int
+
+    def vector(data):
+        if isinstance(data, str):
+            return data, len(data)
+        address, length = ctypes.c_char_p(), ctypes.c_ssize_t()
+        as_read_buffer(data, ctypes.byref(address), ctypes.byref(length))
+        return address, length.value
+
+    def writev(fd, buffers):
+        vectors = (iovec * len(buffers))(*[vector(data) for data in buffers])
+        # buffers stays referenced until the call returns, keeping every
+        # address valid
+        sent = func(fd, vectors, len(buffers))
+        if sent < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return sent
+
+    return writev
+
+_writev = _load_writev()
+
+class FileBody():
+    '''A region of a file to be sent as a message body without reading it
+    into memory.
+
+    Bodies are written with sendfile() where available, copying straight
+    from the page cache to the socket. Otherwise they go through one reused
+    buffer, so memory use does not depend on the size of the file.
+
+    Arguments:
+        fp (str): The path of the file to send.
+        offset (int): The first byte of the file to send.
+        count (int): The number of bytes to send, or None for the rest.
+    '''
+
+    chunk = 64 * 1024
+
+    def __init__(self, fp, offset=0, count=None):
+        self.fbody = io.open(fp, 'rb')
+        size = os.fstat(self.fbody.fileno()).st_size
+        self.offset = offset
+        self.remaining = max(0, size - offset) if count is None else count
+        self.use_sendfile = _sendfile is not None
+        self.buffer = None
+
+    def send(self, sock):
+        '''Send the whole region on a blocking socket (or one with a timeout)'''
+        try:
+            while self.remaining > 0:
+                try:
+                    self.send_some(sock)
+                except socket.error as e:
+                    if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    _wait_writable(sock)
+        finally:
+            self.close()
+
+    def send_some(self, sock):
+        '''Send as much as the socket accepts without blocking.
+
+        Returns the number of bytes sent. Raises socket.error with EAGAIN if
+        the socket is full, or with EIO if the file has shrunk.
+        '''
+        if self.remaining <= 0:
+            return 0
+        if self.use_sendfile:
+            try:
+                sent = _sendfile(sock.fileno(), self.fbody.fileno(), self.offset,
+                    min(self.remaining, 0x7ffff000))
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise socket.error(e.errno, e.strerror)
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise socket.error(e.errno, e.strerror)
+                # This file or socket does not support sendfile
+                self.use_sendfile = False
+                return self.send_some(sock)
+            if sent == 0:
+                self._shrank()
+        else:
+            sent = self._send_buffered(sock)
+
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def _send_buffered(self, sock):
+        if self.buffer is None:
+            self.buffer = bytearray(self.chunk)
+        self.fbody.seek(self.offset)
+        length = self.fbody.readinto(self.buffer)
+        if not length:
+            self._shrank()
+        view = memoryview(self.buffer)[:min(length, self.remaining)]
+        return sock.send(view)
+
+    def _shrank(self):
+        '''The file ended before the region did, so the body cannot be as
+        long as the Content-Length already sent. Raise an error so the
+        connection is closed rather than reused by a client expecting more.'''
+        raise socket.error(errno.EIO, 'File shrank while being sent')
+
+    def read(self):
+        '''Returns the region as a string, for callers that need it in memory'''
+        try:
+            self.fbody.seek(self.offset)
+            return self.fbody.read(self.remaining)
+        finally:
+            self.close()
+
+    def close(self):
+        self.fbody.close()
+
+class BufferBody():
+    '''A message body sent straight out of an existing buffer, such as an
+    mmap, without copying it into a string.
+
+    Arguments:
+        data: Any object supporting the buffer interface.
+        offset (int): The first byte of data to send.
+        count (int): The number of bytes to send, or None for the rest.
+        on_close: Called once when the body is sent or abandoned, so the
+            owner of data knows it is no longer in use.
+    '''
+
+    def __init__(self, data, offset=0, count=None, on_close=None):
+        self.data = data
+        self.offset = offset
+        self.remaining = len(data) - offset if count is None else count
+        self.on_close = on_close
+
+    def send(self, sock):
+        try:
+            while self.remaining > 0:
+                self.send_some(sock)
+        finally:
+            self.close()
+
+    def send_some(self, sock):
+        if self.remaining <= 0:
+            return 0
+        return self.advance(sock.send(self.view()))
+
+    def view(self):
+        '''Returns a buffer of the bytes still to send, without copying them'''
+        return buffer(self.data, self.offset, self.remaining)
+
+    def advance(self, sent):
+        '''Mark sent bytes of the body as written, returning sent'''
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def read(self):
+        try:
+            return self.data[self.offset:self.offset + self.remaining]
+        finally:
+            self.close()
+
+    def close(self):
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close()
+
+class ChunkedBody():
+    '''A message body of unknown length taken from an iterable of strings,
+    such as a generator, and sent with the chunked transfer coding.
+
+    A chunk is only taken from the iterable once the one before it has been
+    written, so a slow client holds the producer back and no more than one
+    chunk is held in memory. The first chunk is taken straight away, while
+    a producer failing at once can still be answered with an error.
+
+    Arguments:
+        chunks: An iterable of strings. Empty strings are skipped, as an
+            empty chunk would end the body.
+        framed (bool): Frame each chunk with its size. Unframed bodies are
+            ended by closing the connection, as HTTP/1.0 expects.
+
+    Attributes:
+        remaining (int): Bytes of the current chunk still to send, 0 once
+            the whole body is sent.
+        sent (int): Bytes sent so far, framing included.
+    '''
+
+    def __init__(self, chunks, framed=True):
+        self.chunks = iter(chunks)
+        self.framed = framed
+        self.sent = 0
+        self.done = False
+        self._next()
+
+    def _next(self):
+        '''Take the next chunk, or the last-chunk once the iterable ends'''
+        self.buffers = []
+        if not self.done:
+            for chunk in self.chunks:
+                if chunk:
+                    chunk = to_bytes(chunk)
+                    self.buffers = ['%x\r\n' % len(chunk), chunk, '\r\n'] if self.framed else [chunk]
+                    break
+            else:
+                self.done = True
+                self.close()
+                if self.framed:
+                    self.buffers = ['0\r\n\r\n']
+        self.remaining = sum(len(data) for data in self.buffers)
+
+    def send(self, sock):
+        try:
+            while self.remaining > 0:
+                try:
+                    self.send_some(sock)
+                except socket.error as e:
+                    if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    _wait_writable(sock)
+        finally:
+            self.close()
+
+    def send_some(self, sock):
+        '''Write what the socket accepts of the current chunk, taking the
+        next once it is all written. Returns the number of bytes sent.'''
+        if self.remaining <= 0:
+            return 0
+        sent = _write_buffers(sock, self.buffers, self.remaining)
+        self.sent += sent
+        self.remaining -= sent
+        if self.remaining == 0:
+            self._next()
+            return sent
+
+        left = sent
+        while left >= len(self.buffers[0]):
+            left -= len(self.buffers.pop(0))
+        if left:
+            self.buffers[0] = buffer(self.buffers[0], left)
+        return sent
+
+    def read(self):
+        '''Returns the rest of the body as sent, framing included'''
+        data = []
+        try:
+            while self.remaining > 0:
+                data.extend(map(str, self.buffers))
+                self._next()
+        finally:
+            self.close()
+        return ''.join(data)
+
+    def close(self):
+        '''Stop taking chunks, letting a generator clean up (eg: if the
+        client went away)'''
+        close = getattr(self.chunks, 'close', None)
+        self.chunks = iter(())
+        if close is not None:
+            close()
+
+def in_memory(part):
+    '''Returns True if a response part is held in memory (a string, buffer
+    or BufferBody) and may be gathered with its neighbours into one write'''
+    return isinstance(part, (basestring, buffer, BufferBody))
+
+def send_some(sock, parts):
+    '''Send what the socket accepts of the response parts at the front of a
+    deque, without blocking.
+
+    The parts held in memory at the front go out together in one writev()
+    call, keeping the header and body as separate buffers rather than
+    joining them, unless they are small enough to join for less (see
+    JOIN_LIMIT). A file body at the front is sent on its own.
+
+    Parts sent in full are removed from the deque, closing bodies, and a
+    string sent in part is replaced by a buffer of the rest of it. Returns
+    True if everything that was tried got sent, so the socket may accept
+    more. Raises socket.error with EAGAIN if the socket is full.
+    '''
+    part = parts[0]
+    if not in_memory(part):
+        part.send_some(sock)
+        if part.remaining > 0:
+            return False
+        part.close()
+        parts.popleft()
+        return True
+
+    buffers, size = [], 0
+    for part in parts:
+        if len(buffers) == IOV_MAX or not in_memory(part):
+            break
+        buffers.append(part.view() if isinstance(part, BufferBody) else part)
+        size += len(buffers[-1])
+
+    sent = _write_buffers(sock, buffers, size)
+    for data in buffers:
+        part = parts[0]
+        if sent < len(data):
+            if isinstance(part, BufferBody):
+                part.advance(sent)
+            elif sent:
+                parts[0] = buffer(part, sent)
+            return False
+        sent -= len(data)
+        if isinstance(part, BufferBody):
+            part.advance(len(data))
+            part.close()
+        parts.popleft()
+    return True
+
+def _write_buffers(sock, buffers, size):
+    if len(buffers) == 1:
+        return sock.send(buffers[0])
+    if size <= JOIN_LIMIT:
+        return sock.send(''.join(map(str, buffers)))
+    if _writev is None:
+        return sock.send(buffers[0])
+    while True:
+        try:
+            return _writev(sock.fileno(), buffers)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise socket.error(e.errno, e.strerror)
+
+def send_parts(sock, parts):
+    '''Write response parts, strings and body objects such as FileBody, to
+    a blocking socket (or one with a timeout), see send_some()'''
+    pending = collections.deque(parts)
+    try:
+        while pending:
+            try:
+                send_some(sock, pending)
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                _wait_writable(sock)
+    finally:
+        for part in parts:
+            if not isinstance(part, (basestring, buffer)):
+                part.close()
+
+def _wait_writable(sock):
+    ready = select.select([], [sock], [], sock.gettimeout())[1]
+    if not ready:
+        raise socket.timeout('timed out')
+
+def http_date(timestamp):
+    '''Format a Unix timestamp as an HTTP-date (eg: for Last-Modified)'''
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def parse_http_date(value):
+    '''Returns the Unix timestamp of an HTTP-date, or None if malformed'''
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    try:
+        return email.utils.mktime_tz(parsed)
+    except (OverflowError, ValueError):
+        return None
+
+def etag_matches(value, etag):
+    '''Returns True if an If-None-Match value lists etag, or is *.
+
+    Uses the weak comparison of RFC 7232, ignoring any W/ prefix.
+    '''
+    if value.strip() == '*':
+        return True
+    strip = lambda tag: tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()
+    return strip(etag) in [strip(tag) for tag in value.split(',')]
+
+def parse_accept_encoding(value):
+    '''Returns a dictionary of the q-value of each coding in an
+    Accept-Encoding header value (eg: {'gzip': 1.0, 'br': 0.5})'''
+    codings = {}
+    for item in value.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, sep, number = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+def acceptable_encodings(value, available):
+    '''Returns the codings from available that an Accept-Encoding value
+    allows, best q-value first. Ties keep the order of available.'''
+    codings = parse_accept_encoding(value)
+    accepted = [(codings.get(coding, codings.get('*', 0.0)), i, coding)
+        for i, coding in enumerate(available)]
+    accepted.sort(key=lambda item: (-item[0], item[1]))
+    return [coding for q, i, coding in accepted if q > 0]
+
+def parse_range(value, size, max_ranges=16):
+    '''Parse a Range header value for a body of size bytes.
+
+    Returns a list of inclusive (start, end) byte positions, an empty list
+    if no range can be satisfied (416), or None if the header must be
+    ignored and the whole body sent: it is not a byte range, is malformed or
+    asks for more than max_ranges ranges.
+    '''
+    unit, sep, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not sep:
+        return None
+
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or last.isdigit()):
+            return None
+        if first and last and not (first.isdigit() and last.isdigit()):
+            return None
+
+        if not first:
+            # Suffix range: the final `last` bytes
+            start, end = max(0, size - int(last)), size - 1
+            if int(last) == 0:
+                continue
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+
+        if start < size:
+            ranges.append((start, end))
+    return ranges
+
+def multipart_ranges(ranges, size, ctype, get_part):
+    '''Build a multipart/byteranges body from several ranges.
+
+    Arguments:
+        ranges: Inclusive (start, end) byte positions from parse_range().
+        size (int): The size of the complete body.
+        ctype (str): The content type of the complete body.
+        get_part: Returns the response part for an (offset, count) region.
+
+    Returns the content type, length and parts of the multipart body.
+    '''
+    boundary = binascii.hexlify(os.urandom(12))
+    parts, length = [], 0
+    for start, end in ranges:
+        head = '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' %(
+            boundary, ctype, start, end, size)
+        parts.extend((head, get_part(start, end - start + 1)))
+        length += len(head) + end - start + 1
+
+    tail = '\r\n--%s--\r\n' % boundary
+    parts.append(tail)
+    return 'multipart/byteranges; boundary=%s' % boundary, length + len(tail), parts
+
+class HTTPParseError(Exception):
+    '''Raised for a request that cannot be parsed.
+
+    Attributes:
+        status (str): The HTTP status code to answer the request with.
+    '''
+
+    def __init__(self, message, status='400'):
+        Exception.__init__(self, message)
+        self.status = status
+
+class HTTPRequest():
+    '''A parsed HTTP request head.
+
+    Arguments:
+        method (str): The request method (eg: GET).
+        target (str): The request target as sent (eg: /deep/index.html?x=1).
+        protocol (str): The HTTP protocol (eg: HTTP/1.1).
+        headers (dict): Header values keyed on lower case field names.
+
+    Attributes:
+        path (str): The unquoted path of the target, without any query.
+        query (str): The query string of the target, if any.
+    '''
+
+    def __init__(self, method, target, protocol, headers):
+        self.method = method
+        self.target = target
+        self.protocol = protocol
+        self.headers = headers
+
+        path, sep, self.query = target.partition('?')
+        self.path = urllib.unquote(path)
+
+    def get_header(self, name, default=''):
+        return self.headers.get(name.lower(), default)
+
+    def __str__(self):
+        return '%s %s %s' %(self.method, self.target, self.protocol)
+
+class HTTPRequestParser():
+    '''Incrementally parses request heads out of the data read from a socket.
+
+    Data is appended to one reusable buffer with feed() and complete heads
+    are taken off the front of it with next_request(), so requests split
+    across packets and pipelined requests are both handled.
+
+    Arguments:
+        max_head (int): The largest request head, in bytes, that is accepted.
+        max_headers (int): The most header fields a request may have.
+    '''
+
+    request_line = re.compile(r'^([A-Z]+) (\S+) (HTTP/\d\.\d)$')
+    field_name = re.compile(r'^[!#$%&\'*+.^_`|~0-9A-Za-z-]+$')
+
+    def __init__(self, max_head=8192, max_headers=100):
+        self.max_head = max_head
+        self.max_headers = max_headers
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def pending(self):
+        '''Returns the number of buffered bytes not yet parsed'''
+        return len(self.buffer)
+
+    def has_request(self):
+        '''Returns True if next_request() has a head to return, or an error
+        to raise, without parsing it'''
+        return self._find_end()[0] >= 0 or len(self.buffer) > self.max_head
+
+    def next_request(self):
+        '''Remove the first complete request head from the buffer.
+
+        Returns an HTTPRequest, or None if more data is needed. Raises
+        HTTPParseError if the head is malformed or larger than max_head.
+        '''
+        # Empty lines before a request line are ignored (RFC 7230 3.5)
+        start = 0
+        while self.buffer[start:start + 1] in (b'\r', b'\n'):
+            start += 1
+        if start:
+            del self.buffer[:start]
+
+        end, length = self._find_end()
+        if end < 0:
+            if len(self.buffer) > self.max_head:
+                raise HTTPParseError('Request head too large', '431')
+            return None
+        if end > self.max_head:
+            raise HTTPParseError('Request head too large', '431')
+
+        head = str(self.buffer[:end])
+        del self.buffer[:end + length]
+        return self._parse(head)
+
+    def _find_end(self):
+        '''Returns the index and length of the blank line ending the head'''
+        crlf = self.buffer.find(b'\r\n\r\n')
+        lf = self.buffer.find(b'\n\n')
+        if lf >= 0 and (crlf < 0 or lf < crlf):
+            return lf, 2
+        return crlf, 4 if crlf >= 0 else 0
+
+    def _parse(self, head):
+        lines = head.split('\n')
+        match = self.request_line.match(lines[0].rstrip('\r'))
+        if match is None:
+            raise HTTPParseError('Malformed request line')
+
+        method, target, protocol = match.groups()
+        if not (target.startswith('/') or target == '*'):
+            raise HTTPParseError('Malformed request target')
+
+        if len(lines) - 1 > self.max_headers:
+            raise HTTPParseError('Too many header fields', '431')
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.rstrip('\r').partition(':')
+            if not sep or not self.field_name.match(name):
+                raise HTTPParseError('Malformed header field')
+            name, value = name.lower(), value.strip()
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+
+        request = HTTPRequest(method, target, protocol, headers)
+        if '\x00' in request.path:
+            raise HTTPParseError('Null byte in request path')
+        return request
+
 class HTMLPage():
     '''Simple HTML page builder
 
@@ -241,18 +1068,93 @@ class HTMLPage():
         self.contents['body'] += tags[0] + str(text) + tags[1] + '\n'
 
     def get_page(self):
-        page = self.get_doctype() + '\n'
-        page += '<html>\n'
-        page += '<head><title>' + self.get_title() + '</title></head>\n'
-        page += '<body>\n'
-        page += self.get_body()
-        page += '</body>\n'
-        page += '</html>'
-        return page
+        return ''.join((
+            self.get_doctype(), '\n',
+            '<html>\n',
+            '<head><title>', self.get_title(), '</title></head>\n',
+            '<body>\n',
+            self.get_body(),
+            '</body>\n',
+            '</html>'))
 
     def __str__(self):
         return self.get_page()
 
+class HTMLListingPage(HTMLPage):
+    '''A page of a directory listing, with links to sort it and to the
+    other pages.
+
+    Arguments:
+        location (str): The path of the directory as requested, ending in /.
+        entries: The names on this page in order, those of directories
+            ending with /.
+        sort (str): The order of the entries (name or type).
+        reverse (bool): The entries are in descending order.
+        page (int): The number of this page, from 1.
+        pages (int): The number of pages in the listing.
+    '''
+
+    def __init__(self, location, entries, sort='name', reverse=False, page=1, pages=1):
+        HTMLPage.__init__(self, 'Index of ' + cgi.escape(location))
+        self.add_heading(self.get_title(), 1)
+        self.add_paragraph('Sort by %s, %s' %(self._sort_link('name', 'name', sort, reverse),
+            self._sort_link('type', 'type', sort, reverse)))
+        self.entries = entries
+        self.parent = location != '/'
+        self.footer = ''
+        if pages > 1:
+            self.footer = '<p>%s</p>\n' % self._page_links(sort, reverse, page, pages)
+
+    def _query(self, sort, reverse, page=1):
+        query = '?sort=%s' % sort
+        if reverse:
+            query += '&amp;order=desc'
+        if page > 1:
+            query += '&amp;page=%d' % page
+        return query
+
+    def _sort_link(self, text, key, sort, reverse):
+        '''Sorting by the current key again flips the order'''
+        return '<a href="%s">%s</a>' %(self._query(key, key == sort and not reverse), text)
+
+    def _page_links(self, sort, reverse, page, pages):
+        links = []
+        if page > 1:
+            links.append('<a href="%s">Previous</a>' % self._query(sort, reverse, page - 1))
+        links.append('Page %d of %d' %(page, pages))
+        if page < pages:
+            links.append('<a href="%s">Next</a>' % self._query(sort, reverse, page + 1))
+        return ' '.join(links)
+
+    def _list_items(self, entries):
+        '''Returns entries as list items linking to them, directories with a
+        trailing /'''
+        return ''.join('<li><a href="%s">%s</a></li>\n' %(
+            urllib.quote(name), cgi.escape(name)) for name in entries)
+
+    def _list_start(self):
+        if self.parent:
+            return '<ul>\n<li><a href="../">../</a></li>\n'
+        return '<ul>\n'
+
+    def get_body(self):
+        return ''.join((self.contents['body'], self._list_start(),
+            self._list_items(self.entries), '</ul>\n', self.footer))
+
+    def get_chunks(self, batch=500):
+        '''Yields the page in pieces of batch entries, so a long listing is
+        sent as it is rendered rather than held whole in memory'''
+        yield ''.join((
+            self.get_doctype(), '\n',
+            '<html>\n',
+            '<head><title>', self.get_title(), '</title></head>\n',
+            '<body>\n',
+            self.contents['body'],
+            self._list_start()))
+        for i in range(0, len(self.entries), batch):
+            yield self._list_items(self.entries[i:i + batch])
+        yield ''.join(('</ul>\n', self.footer, '</body>\n', '</html>'))
+
 class HTMLErrorPage(HTMLPage):
     '''Creates an error page
 
@@ -274,7 +1176,13 @@ class HTMLErrorPage(HTMLPage):
     errors = {
         '400':'Bad Request',
         '404':'Not Found',
-        '500':'Internal Server Error',}
+        '408':'Request Timeout',
+        '416':'Requested Range Not Satisfiable',
+        '429':'Too Many Requests',
+        '431':'Request Header Fields Too Large',
+        '500':'Internal Server Error',
+        '501':'Not Implemented',
+        '503':'Service Unavailable',}
 
     code = '500'
 
@@ -310,3 +1218,82 @@ class HTMLErrorPage(HTMLPage):
 
     def __str__(self):
         return HTMLPage.__str__(self)
+
+# Error page bodies by status, rendered once each
+_error_pages = {}
+
+def error_page(code):
+    '''Returns the body of the built in HTMLErrorPage for code'''
+    code = str(code)
+    page = _error_pages.get(code)
+    if page is None:
+        page = _error_pages[code] = HTMLErrorPage(code).get_page()
+    return page
+
+class ErrorPages():
+    '''Complete error responses, header and body, rendered once.
+
+    Every combination of error, protocol and Connection value is built when
+    the server starts, leaving only the Date line to splice in per response.
+
+    Arguments:
+        template_dir (str): An optional directory of custom pages named for
+            their status (eg: 404.html) sent in place of the built in pages.
+
+    Attributes:
+        pages: A dictionary of custom page bodies keyed on status.
+        responses: A dictionary of (status line, rest of response) keyed on
+            (protocol, status, connection).
+    '''
+
+    protocols = ('HTTP/1.0', 'HTTP/1.1')
+    connections = ('close', 'keep-alive')
+
+    # Seconds clients turned away for load are asked to wait before retrying
+    retry_after = {'429':'1', '503':'1'}
+
+    def __init__(self, template_dir=None):
+        self.pages = {}
+        if template_dir is not None:
+            self._load_templates(template_dir)
+
+        self.responses = {}
+        for code in HTMLErrorPage.errors:
+            for protocol in self.protocols:
+                for connection in self.connections:
+                    self._render(protocol, code, connection)
+
+    def _load_templates(self, template_dir):
+        for code in HTMLErrorPage.errors:
+            try:
+                with open(os.path.join(template_dir, code + '.html'), 'rb') as page:
+                    self.pages[code] = page.read()
+            except IOError: # No custom page; use the built in one
+                pass
+
+    def _render(self, protocol, code, connection):
+        body = self.pages.get(code) or error_page(code)
+        header = HTTPHeader(protocol, code, 'text/html', len(body))
+        header.set_connection(connection)
+        values = header._get_values()
+        if code in self.retry_after: # Before the blank line ending the head
+            values.insert(-1, field_line('Retry-After', self.retry_after[code]))
+        response = (values[0], ''.join(values[2:]) + body)
+        self.responses[(protocol, code, connection)] = response
+        return response
+
+    def get(self, protocol, code, connection='close'):
+        '''Returns the complete response for an error code, answering with
+        a 500 for codes that have no page'''
+        return ''.join(self.get_parts(protocol, code, connection))
+
+    def get_parts(self, protocol, code, connection='close'):
+        '''Returns the response for an error code as parts for send_parts(),
+        sharing the prebuilt head and body rather than copying them'''
+        code = str(code)
+        if code not in HTMLErrorPage.errors:
+            code = '500'
+        response = self.responses.get((protocol, code, connection))
+        if response is None:
+            response = self._render(protocol, code, connection)
+        return [response[0], date_line(), response[1]]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+class ConnectionLimits():
+    '''Counts the connections open in one server process, in total and per
+    client address, so clients over the limits are turned away as soon as
+    they connect rather than tying up the server.
+
+    Arguments:
+        max_total (int): Connections open at once, 0 for no limit.
+        max_per_ip (int): Connections open at once from one address, 0 for
+            no limit.
+
+    Attributes:
+        open (int): Connections admitted and not yet released.
+        rejected: A dictionary of connections turned away keyed on status.
+    '''
+
+    def __init__(self, max_total=0, max_per_ip=0):
+        self.max_total = max_total
+        self.max_per_ip = max_per_ip
+        self.lock = threading.Lock()
+        self.open = 0
+        self.per_ip = {}
+        self.rejected = {}
+
+    def admit(self, ip):
+        '''Count a new connection from ip. Returns None if it may be served,
+        else the status to turn it away with: 503 when the server is full or
+        429 when ip already has max_per_ip connections open.'''
+        with self.lock:
+            if self.max_total and self.open >= self.max_total:
+                status = '503'
+            elif self.max_per_ip and self.per_ip.get(ip, 0) >= self.max_per_ip:
+                status = '429'
+            else:
+                self.open += 1
+                self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+                return None
+            self.rejected[status] = self.rejected.get(status, 0) + 1
+            return status
+
+    def release(self, ip):
+        '''Forget an admitted connection once it is closed'''
+        with self.lock:
+            self.open -= 1
+            count = self.per_ip[ip] - 1
+            if count:
+                self.per_ip[ip] = count
+            else:
+                del self.per_ip[ip]
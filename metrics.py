@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import http
+import os
+import threading
+import time
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Request counters and timings exposed in the Prometheus text format:
+# http://prometheus.io/docs/instrumenting/exposition_formats/
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Phases of serving a request, in order
+PHASES = ('parse', 'resolve', 'read', 'send', 'total')
+
+class Histogram():
+    '''Counts of observed values in fixed buckets, with their sum.
+
+    Arguments:
+        bounds: Sorted upper bounds of the buckets. Larger values are
+            counted in a final +Inf bucket.
+    '''
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        '''Returns (upper bound, count of values <= it) for every bucket'''
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+class Metrics():
+    '''Counters and latency histograms for one server process.
+
+    Everything is updated under one lock, taken once per observation.
+    Pre-forked workers each count their own requests, so /metrics shows the
+    worker that answered it, identified by its pid.
+
+    Attributes:
+        responses: A dictionary of responses sent keyed on status.
+        phases: A dictionary of Histogram keyed on phase (see PHASES).
+        bytes_sent (int): Bytes of responses handed to the kernel.
+        connections (int): Connections currently open.
+        accepted (int): Connections accepted since the server started.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.responses = {}
+        self.phases = dict((phase, Histogram()) for phase in PHASES)
+        self.bytes_sent = 0
+        self.connections = 0
+        self.accepted = 0
+
+    def observe(self, phase, seconds):
+        '''Record the time one request spent in a phase'''
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def response_sent(self, status, length, send, total):
+        '''Record a response of length bytes with a status (eg: 200), that
+        took send seconds to write and total seconds since it was parsed'''
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            self.bytes_sent += length
+            self.phases['send'].observe(send)
+            self.phases['total'].observe(total)
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.accepted += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections -= 1
+
+    def render(self, caches=(), rejected=None, log_dropped=None):
+        '''Returns the metrics in the Prometheus text format.
+
+        Arguments:
+            caches: (name, stats dictionary) pairs of the server's caches
+                (eg: from cache.LRUCache.stats()).
+            rejected: A dictionary of connections turned away keyed on
+                status (see limits.ConnectionLimits), or None if the server
+                has no connection limits.
+            log_dropped (int): Access log entries dropped because the log's
+                buffer was full (see accesslog.AccessLog), or None if the
+                server keeps no access log.
+        '''
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append('# HELP webserver_%s %s' %(name, help))
+            lines.append('# TYPE webserver_%s %s' %(name, kind))
+            for labels, value in samples:
+                lines.append('webserver_%s%s %s' %(name, labels, format_value(value)))
+
+        with self.lock:
+            metric('responses_total', 'counter', 'Responses sent by status.',
+                [('{status="%s"}' % status, count)
+                    for status, count in sorted(self.responses.items())])
+            metric('sent_bytes_total', 'counter', 'Bytes of responses sent.',
+                [('', self.bytes_sent)])
+            metric('connections', 'gauge', 'Connections currently open.',
+                [('', self.connections)])
+            metric('connections_total', 'counter', 'Connections accepted.',
+                [('', self.accepted)])
+            if rejected is not None:
+                metric('connections_rejected_total', 'counter',
+                    'Connections turned away by the connection limits by status.',
+                    [('{status="%s"}' % status, count)
+                        for status, count in sorted(rejected.items())])
+            if log_dropped is not None:
+                metric('access_log_dropped_total', 'counter',
+                    'Access log entries dropped because the buffer was full.',
+                    [('', log_dropped)])
+
+            samples = []
+            for phase in PHASES:
+                histogram = self.phases[phase]
+                for bound, count in histogram.cumulative():
+                    samples.append(('_bucket{phase="%s",le="%s"}' %(phase,
+                        format_value(bound)), count))
+                samples.append(('_sum{phase="%s"}' % phase, histogram.sum))
+                samples.append(('_count{phase="%s"}' % phase, histogram.count))
+            metric('request_duration_seconds', 'histogram',
+                'Seconds spent serving requests by phase.', samples)
+
+        for stat, kind in (('hits', 'counter'), ('misses', 'counter'),
+                ('evictions', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge'),
+                ('saved_bytes', 'gauge')):
+            metric('cache_%s%s' %(stat, '_total' if kind == 'counter' else ''), kind,
+                'Cache %s by cache.' % stat,
+                [('{cache="%s"}' % name, stats[stat]) for name, stats in caches if stat in stats])
+
+        metric('process_start_time_seconds', 'gauge', 'When the process started.',
+            [('{pid="%d"}' % os.getpid(), self.started)])
+        return '\n'.join(lines) + '\n'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def response_length(parts):
+    '''Returns the bytes in response parts, strings and body objects with
+    the remaining bytes they will send. Streamed bodies of unknown length
+    count for nothing; add streamed_length() once they are sent.'''
+    return sum(len(part) if isinstance(part, basestring) else
+        0 if isinstance(part, http.ChunkedBody) else part.remaining
+        for part in parts)
+
+def streamed_length(parts):
+    '''Returns the bytes sent by the streamed bodies among response parts'''
+    return sum(part.sent for part in parts if isinstance(part, http.ChunkedBody))
+
+def head_length(parts):
+    '''Returns the bytes of response parts up to the end of the head, which
+    may be split across several strings (eg: from http.ErrorPages.get_parts())'''
+    length = 0
+    for part in parts:
+        if not isinstance(part, basestring):
+            break
+        end = part.find('\r\n\r\n')
+        if end >= 0:
+            return length + end + 4
+        length += len(part)
+    return length
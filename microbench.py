@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Microbenchmarks for the hot paths of server.py and http.py, run without
+# any sockets.
+#
+# run: python microbench.py [name ...]
+
+import argparse
+import atexit
+import shutil
+import timeit
+from collections import OrderedDict
+
+import os
+import socket
+import tempfile
+
+import cache
+import docpack
+import http
+import mime
+import server
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(func):
+    '''Register a function returning a callable to time'''
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def runs(number):
+    '''Time a slow benchmark over at most number iterations'''
+    def limit(func):
+        func.number = number
+        return func
+    return limit
+
+BROWSER_REQUEST = (
+    'GET /deep/index.html HTTP/1.1\r\n'
+    'Host: 127.0.0.1:8080\r\n'
+    'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:38.0) Gecko/20100101 Firefox/38.0\r\n'
+    'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+    'Accept-Language: en-US,en;q=0.5\r\n'
+    'Accept-Encoding: gzip, deflate\r\n'
+    'Connection: keep-alive\r\n'
+    '\r\n')
+
+@benchmark
+def parse():
+    '''Parse a typical browser request head'''
+    parser = http.HTTPRequestParser()
+    def run():
+        parser.feed(BROWSER_REQUEST)
+        parser.next_request()
+    return run
+
+@benchmark
+def parse_pipelined():
+    '''Parse one of ten requests that arrived in the same read'''
+    parser = http.HTTPRequestParser()
+    data = BROWSER_REQUEST * 10
+    def run():
+        parser.feed(data)
+        for i in range(10):
+            parser.next_request()
+    return run, 10
+
+@benchmark
+def header():
+    '''Build and serialize the header of a typical 200 response'''
+    def run():
+        h = http.HTTPHeader('HTTP/1.1', '200', 'text/css', 4096)
+        h.set_accept_ranges()
+        h.set_etag('"2a1b-1000-5a3f1c2d8e9b0"')
+        h.set_last_modified(1430000000.25)
+        h.set_connection('keep-alive')
+        h.get_string()
+    return run
+
+@benchmark
+def header_error():
+    '''Build and serialize the header of a 404 response'''
+    def run():
+        http.HTTPHeader('HTTP/1.1', '404', 'text/html', 512).get_string()
+    return run
+
+@benchmark
+def not_found():
+    '''Build a complete 404 response from the prebuilt error pages'''
+    errors = http.ErrorPages()
+    def run():
+        errors.get('HTTP/1.1', '404', 'keep-alive')
+    return run
+
+def lookup(directory):
+    '''Resolve a request path the way RequestHandler.respond() does'''
+    def run():
+        path = directory.build_abspath(directory.trim_relative_root('/deep/index.html'))
+        if directory.exists(path):
+            directory.get_fsize(path)
+        elif directory.is_directory(path):
+            pass
+    return run
+
+@benchmark
+def resolve():
+    '''Find a file from the docroot index'''
+    return lookup(server.ServerDirectory(os.path.join(os.getcwd(), 'www'), index_interval=2))
+
+@benchmark
+def resolve_stat():
+    '''Find a file with stat calls, without an index'''
+    return lookup(server.ServerDirectory(os.path.join(os.getcwd(), 'www')))
+
+WWW = os.path.join(os.getcwd(), 'www')
+
+def packed_www():
+    '''Returns the path of a pack of www, built for these benchmarks'''
+    target = os.path.join(tempfile.gettempdir(), 'microbench-www.pack')
+    docpack.build(WWW, target)
+    return target
+
+@benchmark
+def startup_walk():
+    '''Walk the docroot into an index, as a server starts'''
+    def run():
+        cache.DocIndex(WWW, mime.default_types().get)
+    return run
+
+@benchmark
+def startup_pack():
+    '''Open a pack of the docroot, as a server started with --pack'''
+    target = packed_www()
+    def run():
+        docpack.DocPack(target)
+    return run
+
+def find(directory, handler):
+    '''Find /deep/index.html and its body the way RequestHandler does'''
+    path = directory.build_abspath('deep/index.html')
+    def run():
+        resource = handler._find_file(path)
+        resource.get_part()
+        resource.release()
+    return run
+
+class Handler(server.RequestHandler):
+    '''A RequestHandler without a connection, to call its methods'''
+    def __init__(self, directory):
+        self.server = argparse.Namespace(directory=directory, cache=None)
+
+@benchmark
+def find_disk():
+    '''Find and open a file on the live filesystem, without a cache'''
+    directory = server.ServerDirectory(WWW)
+    return find(directory, Handler(directory))
+
+@benchmark
+def find_indexed():
+    '''Find a file from the docroot index and open it on disk'''
+    directory = server.ServerDirectory(WWW, index_interval=2)
+    return find(directory, Handler(directory))
+
+@benchmark
+def find_packed():
+    '''Find a file and its body in a pack'''
+    directory = server.ServerDirectory(WWW, pack=packed_www())
+    return find(directory, Handler(directory))
+
+def cache_hit(files):
+    '''Find a cached file and its body the way RequestHandler does, and
+    send it, the body being a copy or a part of the cache's memory'''
+    fp = os.path.join(WWW, 'deep', 'index.html')
+    files.get(fp).release()
+    a, b = socket.socketpair()
+    def run():
+        entry = files.get(fp)
+        http.send_parts(a, [entry.get_part()])
+        entry.release()
+        b.recv(65536)
+    return run
+
+@benchmark
+def cache_private():
+    '''Send a hit from a cache of this process alone'''
+    return cache_hit(cache.FileCache(server.ServerDirectory(WWW)))
+
+@benchmark
+def cache_shared():
+    '''Send a hit from a cache shared by pre-forked workers'''
+    return cache_hit(cache.SharedFileCache(server.ServerDirectory(WWW), sharers=4))
+
+@benchmark
+def content_type():
+    '''Find the Content-Type of a file from the mime registry'''
+    types = mime.default_types()
+    def run():
+        types.get('/www/static/app.min.js').content_type
+    return run
+
+# Entries in the generated directory the listing benchmarks list
+LARGE_DIRECTORY = 100000
+_large = []
+
+def large_directory():
+    '''Returns the path of a directory of LARGE_DIRECTORY empty files and
+    directories, made the first time it is asked for'''
+    if not _large:
+        fp = tempfile.mkdtemp(prefix='microbench-')
+        atexit.register(shutil.rmtree, fp)
+        for i in range(LARGE_DIRECTORY):
+            if i % 100 == 0:
+                os.mkdir(os.path.join(fp, 'dir%06d' % i))
+            else:
+                open(os.path.join(fp, 'file%06d.txt' % i), 'w').close()
+        _large.append(fp)
+    return _large[0]
+
+@benchmark
+@runs(3)
+def listing_scandir():
+    '''List a large directory with the type of each entry, without stat'''
+    fp = large_directory()
+    def run():
+        cache.scandir(fp)
+    return run
+
+@benchmark
+@runs(3)
+def listing_stat():
+    '''List a large directory with listdir() and a stat of each entry'''
+    fp = large_directory()
+    def run():
+        [(name, os.path.isdir(os.path.join(fp, name))) for name in os.listdir(fp)]
+    return run
+
+@benchmark
+@runs(3)
+def listing_cold():
+    '''List, sort and render the first page of a large directory'''
+    fp = large_directory()
+    listings = cache.ListingCache(server.ServerDirectory(fp))
+    def run():
+        listings.clear()
+        listings.get(fp, '/large/')
+    return run
+
+@benchmark
+@runs(200)
+def listing_page():
+    '''Render a page of a large directory whose sorted entries are cached'''
+    fp = large_directory()
+    listings = cache.ListingCache(server.ServerDirectory(fp))
+    listings.get(fp, '/large/')
+    def run():
+        listings._invalidate((fp, '/large/', 'name', False, 50))
+        listings.get(fp, '/large/', page=50)
+    return run
+
+@benchmark
+def listing_cached():
+    '''Serve a page of a large directory listing from the cache'''
+    fp = large_directory()
+    listings = cache.ListingCache(server.ServerDirectory(fp))
+    listings.get(fp, '/large/')
+    def run():
+        listings.get(fp, '/large/')
+    return run
+
+# Bytes copied and strings allocated per response by the send benchmarks,
+# filled in as they are set up
+COPIES = OrderedDict()
+
+class CopyCounter():
+    '''Wraps a socket, counting the bytes handed to send() and writev() in
+    strings other than the response parts, ie: copies made of them'''
+
+    def __init__(self, sock, parts):
+        self.sock = sock
+        self.parts = parts
+        self.copied = 0
+        self.allocated = 0
+
+    def count(self, buffers):
+        for data in buffers:
+            if isinstance(data, str) and not any(data is part for part in self.parts):
+                self.copied += len(data)
+                self.allocated += 1
+
+    def send(self, data):
+        self.count([data])
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.count([data])
+        return self.sock.sendall(data)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def gettimeout(self):
+        return self.sock.gettimeout()
+
+def count_copies(send, header, body):
+    '''Returns the bytes copied and strings allocated sending one response'''
+    a, b = socket.socketpair()
+    for sock in (a, b):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+    counter = CopyCounter(a, (header, body))
+    writev = http._writev
+    if writev is not None:
+        http._writev = lambda fd, buffers: (counter.count(buffers), writev(fd, buffers))[1]
+    try:
+        send(counter, header, body)
+    finally:
+        http._writev = writev
+        a.close()
+        b.close()
+    return counter.copied, counter.allocated
+
+def sender(name, body_size, send):
+    '''Send a 200 response with a body of body_size bytes through a socket
+    pair with send(sock, header, body), reading it back each time'''
+    a, b = socket.socketpair()
+    for sock in (a, b):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    header = http.HTTPHeader('HTTP/1.1', '200', 'text/css', body_size).get_string()
+    body = os.urandom(body_size)
+    COPIES[name] = count_copies(send, header, body)
+
+    received = bytearray(len(header) + body_size)
+    view = memoryview(received)
+    def run():
+        send(a, header, body)
+        got = 0
+        while got < len(received):
+            got += b.recv_into(view[got:])
+    return run
+
+def send_joined(sock, header, body):
+    sock.sendall(header + body)
+
+def send_gathered(sock, header, body):
+    http.send_parts(sock, [header, body])
+
+@benchmark
+def send_small_joined():
+    '''Send a 1 KiB response joined into one string'''
+    return sender('send_small_joined', 1024, send_joined)
+
+@benchmark
+def send_small_gathered():
+    '''Send a 1 KiB response as header and body parts with send_parts()'''
+    return sender('send_small_gathered', 1024, send_gathered)
+
+@benchmark
+def send_large_joined():
+    '''Send a 256 KiB response joined into one string'''
+    return sender('send_large_joined', 256 * 1024, send_joined)
+
+@benchmark
+def send_large_gathered():
+    '''Send a 256 KiB response as header and body parts with send_parts()'''
+    return sender('send_large_gathered', 256 * 1024, send_gathered)
+
+def measure(setup, number):
+    '''Returns the seconds per operation of the callable built by setup'''
+    result = setup()
+    run, ops = result if isinstance(result, tuple) else (result, 1)
+    number = min(number, getattr(setup, 'number', number))
+    best = min(timeit.repeat(run, number=number, repeat=3))
+    return best / (number * ops)
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the webserver')
+    parser.add_argument('names', nargs='*', metavar='name',
+        help='benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--number', type=int, default=10000,
+        help='iterations per timing run')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark: %s' % ', '.join(unknown))
+
+    print("%-24s %12s %12s" %('benchmark', 'us/op', 'ops/s'))
+    for name in args.names or BENCHMARKS:
+        seconds = measure(BENCHMARKS[name], args.number)
+        print("%-24s %12.2f %12.0f" %(name, seconds * 1e6, 1 / seconds))
+
+    if COPIES:
+        print("\n%-24s %12s %12s" %('per response', 'bytes copied', 'strings'))
+        for name, (copied, allocated) in COPIES.items():
+            print("%-24s %12d %12d" %(name, copied, allocated))
+
+if __name__ == "__main__":
+    main()
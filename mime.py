@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Media types of served files, found from their extension.
+#
+# The format of mime.types is one type per line followed by its extensions:
+# http://manpages.debian.org/mime.types
+
+# Used when the system has no mime.types, and for anything it leaves out
+BUNDLED = {
+    'html':'text/html',
+    'htm':'text/html',
+    'css':'text/css',
+    'js':'text/javascript',
+    'mjs':'text/javascript',
+    'json':'application/json',
+    'map':'application/json',
+    'xml':'application/xml',
+    'txt':'text/plain',
+    'csv':'text/csv',
+    'md':'text/markdown',
+    'svg':'image/svg+xml',
+    'png':'image/png',
+    'jpg':'image/jpeg',
+    'jpeg':'image/jpeg',
+    'gif':'image/gif',
+    'webp':'image/webp',
+    'ico':'image/vnd.microsoft.icon',
+    'woff':'font/woff',
+    'woff2':'font/woff2',
+    'ttf':'font/ttf',
+    'otf':'font/otf',
+    'wasm':'application/wasm',
+    'pdf':'application/pdf',
+    'zip':'application/zip',
+    'gz':'application/gzip',
+    'mp4':'video/mp4',
+    'webm':'video/webm',
+    'mp3':'audio/mpeg',}
+
+# Types outside text/*, */*+json and */*+xml that are worth compressing
+COMPRESSIBLE = set((
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/wasm',
+    'application/vnd.ms-fontobject',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+    'image/bmp',
+    'font/ttf',
+    'font/otf',))
+
+# Types outside text/* whose contents are text in a charset
+TEXTUAL = set((
+    'application/javascript',
+    'application/json',
+    'application/xml',))
+
+class MimeType():
+    '''A media type and how files of that type are sent.
+
+    Arguments:
+        name (str): The media type (eg: text/html).
+        charset (str): The charset parameter sent with the type, or None.
+        compressible (bool): Worth sending with a content coding (eg: gzip).
+
+    Attributes:
+        content_type (str): The Content-Type value (eg: text/html; charset=utf-8).
+    '''
+
+    def __init__(self, name, charset=None, compressible=False):
+        self.name = name
+        self.charset = charset
+        self.compressible = compressible
+        if charset is None:
+            self.content_type = name
+        else:
+            self.content_type = '%s; charset=%s' %(name, charset)
+
+    def __str__(self):
+        return self.content_type
+
+class MimeTypes():
+    '''A registry of the media types of file extensions.
+
+    The bundled table is loaded first, then each mime.types file that exists,
+    so later files and add() override earlier mappings.
+
+    Arguments:
+        files (list): Paths of mime.types files to load.
+        charset (str): The charset sent with text types, or None.
+        default (str): The type of files with no known extension.
+
+    Attributes:
+        types: A dictionary of MimeType keyed on lower case extension.
+    '''
+
+    def __init__(self, files=('/etc/mime.types',), charset='utf-8',
+            default='application/octet-stream'):
+        self.charset = charset
+        self.types = {}
+        self.named = {}
+        for ext, name in BUNDLED.items():
+            self.add(ext, name)
+        for path in files:
+            self.load(path)
+        self.unknown = self.get_type(default)
+
+    def load(self, path):
+        '''Add the mappings of a mime.types file. Returns False if the file
+        cannot be read.'''
+        try:
+            with open(path) as types:
+                for line in types:
+                    fields = line.split('#', 1)[0].split()
+                    for ext in fields[1:]:
+                        self.add(ext, fields[0])
+        except IOError:
+            return False
+        return True
+
+    def add(self, ext, name):
+        '''Map an extension (eg: js or .js) to a media type'''
+        self.types[ext.lstrip('.').lower()] = self.get_type(name.lower())
+
+    def get_type(self, name):
+        '''Returns the shared MimeType for a media type name'''
+        mtype = self.named.get(name)
+        if mtype is None:
+            mtype = self.named[name] = MimeType(name,
+                self.charset if self._is_textual(name) else None,
+                self._is_compressible(name))
+        return mtype
+
+    def _is_textual(self, name):
+        return name.startswith('text/') or name in TEXTUAL
+
+    def _is_compressible(self, name):
+        return (name.startswith('text/') or name in COMPRESSIBLE
+            or name.endswith('+json') or name.endswith('+xml'))
+
+    def get(self, fp):
+        '''Returns the MimeType of a path from its extension'''
+        dot = fp.rfind('.')
+        if dot <= fp.rfind('/'):
+            return self.unknown
+        return self.types.get(fp[dot + 1:].lower(), self.unknown)
+
+    def guess_type(self, fp):
+        '''Returns the media type name of a path (eg: text/html)'''
+        return self.get(fp).name
+
+    def __len__(self):
+        return len(self.types)
+
+_default = None
+
+def default_types():
+    '''Returns the registry shared by everything not given its own'''
+    global _default
+    if _default is None:
+        _default = MimeTypes()
+    return _default
+
+def parse_override(value):
+    '''Returns the (extension, type) of an override like .js=text/javascript'''
+    match = re.match(r'^\.?([\w.+-]+)=([\w.+-]+/[\w.+-]+)$', value.strip())
+    if match is None:
+        raise ValueError('expected EXT=TYPE (eg: .js=text/javascript): %s' % value)
+    return match.group(1), match.group(2)
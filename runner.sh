@@ -7,5 +7,23 @@ python not-free-tests.py
 # python test-directory.py
 # python test-httpheader.py
 # python test-misc.py
+# python test-eventloop.py
+# python test-keepalive.py
+# python test-request.py
+# python test-cache.py
+# python test-sendfile.py
+# python test-range.py
+# python test-conditional.py
+# python test-compression.py
+# python test-mime.py
+# python test-metrics.py
+# python test-accesslog.py
+# python test-lifecycle.py
+# python test-config.py
+# python test-limits.py
+# python test-writev.py
+# python test-docpack.py
+# python test-chunked.py
+# python test-autoindex.py
 kill $ID
 #pkill -P $$
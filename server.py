@@ -1,9 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import Queue
 import SocketServer
+import accesslog
+import argparse
+import cache
+import collections
+import config
+import docpack
+import errno
+import fcntl
 import http
+import limits
+import metrics
+import mime
 import os
+import resource
+import select
+import signal
+import socket
+import stat
+import sys
+import threading
 import time
+import urlparse
 
 # Copyright 2013-2015 Abram Hindle, Eddie Antonio Santos, Michael Raypold
 #
@@ -48,52 +68,172 @@ class ServerDirectory():
 
     Arguments:
         root (str): The base directory of the web server
+        use_mmap (bool): Serve files from memory maps shared between
+            requests with get_mapped().
+        etag_hash (bool): Tag mapped files with a hash of their contents.
+        index_interval (float): Keep a cache.DocIndex of the root, walked
+            again every index_interval seconds. None looks every path up on
+            disk instead.
+        types (mime.MimeTypes): The media types of files, by default the
+            shared mime.default_types().
+        pack (str): Serve the docroot from this pack built by docpack.py
+            instead of from disk. The docroot itself is never read.
+        autoindex (bool): Directories without an index.html are listed, so
+            redirect to the directory itself rather than its index.
     '''
 
-    def __init__(self, root=os.getcwd()):
+    # Request paths resolved to absolute paths, kept by build_abspath()
+    max_resolved = 4096
+
+    def __init__(self, root=os.getcwd(), use_mmap=False, etag_hash=False,
+            index_interval=None, types=None, pack=None, autoindex=False):
         self.root = os.path.abspath(root)
+        self.autoindex = autoindex
+        self.types = types if types is not None else mime.default_types()
+        self.pack = docpack.DocPack(pack) if pack is not None else None
+        self.use_mmap = use_mmap and self.pack is None
+        self.mapped = cache.MappedFiles(etag_hash=etag_hash) if self.use_mmap else None
+        self.resolved = {}
+        self.index = None
+        if index_interval is not None and self.pack is None:
+            self.index = cache.DocIndex(self.root, self.get_ctype, index_interval)
 
     def get_root(self):
         return self.root
 
     def get_fsize(self, fp):
         '''Return the filesize in bytes, or -1 if the file doesn't exist'''
+        if self.pack is not None:
+            packed = self.get_packed(fp)
+            return -1 if packed is None else packed.size
+        if self.index is not None:
+            entry = self.index.get(fp)
+            return -1 if entry is None else entry.size
         return os.path.getsize(fp) if self.exists(fp) else -1
 
+    def get_entry(self, fp):
+        '''Returns the cache.IndexEntry of a regular file, or None. Only
+        available with an index.'''
+        return self.index.get(fp)
+
+    def get_packed(self, fp):
+        '''Returns the docpack.PackedFile of a regular file, or None. Only
+        available with a pack.'''
+        return self.pack.get(self._pack_path(fp))
+
+    def _pack_path(self, fp):
+        '''Returns the path of fp within the pack'''
+        return (fp[len(self.root):] or '/') if fp.startswith(self.root) else fp
+
+    def update_entry(self, fp):
+        '''Refresh the index entry of a file changed since the last walk'''
+        try:
+            self.index.update(fp, os.stat(fp))
+        except OSError:
+            pass
+
     def get_file(self, fp):
         '''Returns a string of the specified file'''
-        with open(fp, 'r') as fbody:
+        if self.pack is not None:
+            packed = self.get_packed(fp)
+            if packed is None:
+                raise IOError(errno.ENOENT, 'Not in the pack', fp)
+            return packed.get_part().read()
+        with open(fp, 'rb') as fbody:
             efile = fbody.read()
         return efile
 
+    def get_mapped(self, fp, st=None):
+        '''Returns an acquired cache.MappedFile of the specified file, or None.
+
+        Call release() on the result once finished with it.
+        '''
+        return self.mapped.get(fp, st) if self.use_mmap else None
+
     def get_encoded_file(self, fp):
-        '''Returns the specified file as an encoded string'''
-        return self.get_file(fp).encode('utf-8')
+        '''Returns the specified file as an encoded string.
+
+        Files are read as bytes, so they are already encoded as on disk.
+        '''
+        return self.get_file(fp)
 
     def exists(self, fp):
+        if self.pack is not None:
+            return self.get_packed(fp) is not None
+        if self.index is not None:
+            return self.index.get(fp) is not None
         return os.path.isfile(fp)
 
     def is_directory(self, fp):
-        return os.path.isdir(fp)
+        return self.get_redirect(fp) is not None
 
-    def get_ctype(self, fp):
-        if fp.endswith('.html'):
-            return 'text/html'
-        elif fp.endswith('.css'):
-            return 'text/css'
+    def get_redirect(self, fp):
+        '''Returns the Location to redirect a directory to, or None if fp is
+        not a directory'''
+        if self.pack is not None:
+            path = self._pack_path(fp.rstrip(os.sep) or os.sep)
+            location = self.append_index(path) if self.pack.is_directory(path) else None
+        elif self.index is not None:
+            location = self.index.get_redirect(fp.rstrip(os.sep) or os.sep)
+        elif not os.path.isdir(fp):
+            location = None
         else:
-            return 'text/plain'
+            location = self.append_index(self.remove_root(fp))
+
+        if location is not None and self.autoindex and not self.has_index(fp):
+            # Listed rather than served from an index.html
+            return location[:-len('index.html')]
+        return location
+
+    def get_listing_mtime(self, fp):
+        '''Returns the modification time of the directory at fp, or None
+        if it is not a directory'''
+        if self.pack is not None:
+            return self.pack.get_mtime(self._pack_path(fp.rstrip(os.sep) or os.sep))
+        try:
+            st = os.stat(fp)
+        except OSError:
+            return None
+        return st.st_mtime if stat.S_ISDIR(st.st_mode) else None
+
+    def list_directory(self, fp):
+        '''Returns the (name, is_dir) of every entry in the directory at fp.
+        Raises OSError if it cannot be listed.'''
+        if self.pack is not None:
+            return self.pack.list_directory(self._pack_path(fp.rstrip(os.sep) or os.sep))
+        return cache.scandir(fp)
+
+    def get_type(self, fp):
+        '''Returns the mime.MimeType of a file'''
+        return self.types.get(fp)
+
+    def get_ctype(self, fp):
+        return self.types.get(fp).name
+
+    def get_content_type(self, fp):
+        '''Returns the Content-Type of a file, with its charset if it is text'''
+        return self.types.get(fp).content_type
+
+    def is_compressible(self, fp):
+        '''Returns True if the file's type is worth compressing'''
+        return self.types.get(fp).compressible
 
     def append_index(self, fp):
         return os.path.join(fp, 'index.html')
 
     def has_index(self, fp):
         '''Returns true if a directory has an index.html that can be served'''
-        return self.exists(self.append_index(self, fp))
+        return self.exists(self.append_index(fp))
 
     def build_abspath(self, path):
-        path = os.path.normpath('/' + path).lstrip('/')
-        return os.path.join(self.root, path)
+        abspath = self.resolved.get(path)
+        if abspath is None:
+            abspath = os.path.join(self.root, os.path.normpath('/' + path).lstrip('/'))
+            # Emptied when full so scans of random paths cannot grow it forever
+            if len(self.resolved) >= self.max_resolved:
+                self.resolved.clear()
+            self.resolved[path] = abspath
+        return abspath
 
     def remove_root(self, path):
         '''Delete the directory root from the specified path.
@@ -115,49 +255,932 @@ class ServerDirectory():
     def __str__(self): # Not secure
         return self.root
 
+# The first socket passed by systemd socket activation:
+# http://www.freedesktop.org/software/systemd/man/sd_listen_fds.html
+LISTEN_FDS_START = 3
+
+def inherited_sockets(first_fd=LISTEN_FDS_START):
+    '''Returns the listening sockets passed to this process by systemd or
+    PyServer.spawn_successor(), an empty list if there are none.
+
+    Like sd_listen_fds(), the LISTEN_ variables are removed from the
+    environment so processes started later do not take them as their own.
+    '''
+    pid, count = os.environ.get('LISTEN_PID'), os.environ.get('LISTEN_FDS')
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(name, None)
+    if pid != str(os.getpid()) or not count:
+        return []
+
+    listeners = []
+    for fd in range(first_fd, first_fd + int(count)):
+        # fromfd() needs the family to decode addresses; ask the socket for it
+        probe = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+        family = probe.getsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_DOMAIN', 39))
+        probe.close()
+        listeners.append(socket.fromfd(fd, family, socket.SOCK_STREAM))
+        os.close(fd)
+    return listeners
+
+def max_fd():
+    '''Returns one more than the highest file descriptor a process may open'''
+    try:
+        return os.sysconf('SC_OPEN_MAX')
+    except (ValueError, OSError):
+        return 1024
+
+def raise_fd_limit():
+    '''Raise the soft limit on open file descriptors (RLIMIT_NOFILE) to the
+    hard limit, as every connection holds one and the soft limit is often
+    only 1024. Returns the new soft limit.'''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, resource.error):
+            pass
+    return soft
+
 class PyServer(SocketServer.TCPServer):
     '''Implements a simple server for HTTP/1.1 GET requests.
 
+    On its own it answers one connection at a time, blocking on each until
+    it closes. server.py runs it with ThreadPoolMixIn or as EventPyServer,
+    which read request heads without blocking (see get_server_class()).
+
     Arguments:
         Host (str): IP to server from.
         Port (int): endpoint connection for destination address
 
     '''
 
+    mode = 'single process'
+
+    # A single threaded server serves nobody else while a connection idles
+    keep_alive = False
+    keep_alive_timeout = 5
+    max_keep_alive_requests = 100
+
+    # Bytes of file contents kept in memory, 0 disables the cache
+    cache_size = 16 * 1024 * 1024
+    cache_max_file = 1024 * 1024
+
+    # Serve files from shared memory maps instead of the cache
+    use_mmap = False
+
+    # A pack built by docpack.py to serve instead of the docroot on disk
+    pack = None
+
+    # Keep one cache in memory shared by pre-forked workers, not one each
+    shared_cache = False
+
+    # Seconds between walks of the docroot index, None stats every request
+    index_interval = 2.0
+
+    # List directories without an index.html, a page of entries at a time
+    autoindex = False
+    listing_page_size = 1000
+    listing_cache_size = 16 * 1024 * 1024
+
+    # ETags from a hash of file contents rather than inode, size and mtime
+    etag_hash = False
+
+    # Directory of custom error pages named for their status (eg: 404.html)
+    error_dir = None
+
+    # Seconds a stopping server waits for responses in flight to be sent
+    drain_timeout = 10
+
+    # Seconds a client has to send a whole request head, however steadily
+    # it trickles bytes, before it is answered 408 Request Timeout. Clients
+    # that go quiet for keep_alive_timeout, reading or writing, are dropped.
+    header_timeout = 10
+    # Largest request head in bytes, answered 431 if exceeded
+    max_header_size = 8192
+    # Connections open at once in each process, in total (503 beyond) and
+    # from one client address (429 beyond); 0 for no limit
+    max_connections = 0
+    max_connections_per_ip = 0
+
+    # Count requests and time each phase of serving them, optionally
+    # answering GET metrics_path (eg: /metrics) with the counts
+    metrics_enabled = True
+    metrics_path = None
+
+    # File access logs are appended to (- for standard output), or None
+    access_log_path = None
+    access_log_format = 'combined'
+    access_log_buffer = 8192
+
+    # Extra mime.types files and extension=type pairs that take precedence
+    # over /etc/mime.types
+    mime_files = ()
+    mime_overrides = ()
+
+    # Content codings for text files, with compressed copies kept in memory
+    compression = True
+    compress_cache_size = 4 * 1024 * 1024
+    compress_min_size = 256
+
+    # Directory of the served files, None for www under the working directory
+    docroot = None
+
+    # Further (host, port) addresses served alongside the one given to the
+    # constructor (eg: ('::1', 8080))
+    also_listen = ()
+
+    # Listening socket options. The backlog holds connections not yet
+    # accepted; reuse_port gives each pre-forked worker its own socket so
+    # the kernel spreads connections evenly rather than waking every worker.
+    request_queue_size = 128
+    reuse_port = False
+    # Send responses as soon as they are written rather than waiting on the
+    # client's delayed ACK of the previous segment (Nagle's algorithm)
+    tcp_nodelay = True
+    # Seconds the kernel holds a connection until its request arrives, and
+    # the queue length of TCP Fast Open requests; 0 disables either
+    defer_accept = 0
+    fastopen = 0
+    # Socket buffer sizes in bytes, 0 for the kernel's defaults
+    recv_buffer = 0
+    send_buffer = 0
+
+    # Command line the settings came from, parsed again with its config
+    # file by reload(); None if the server was not started from one
+    argv = None
+
     def __init__(self, Host, Port):
-        SocketServer.TCPServer.allow_reuse_address = True
-        # Create the server, binding to localhost on port 8080
-        SocketServer.TCPServer.__init__(self, (HOST, PORT),RequestHandler)
+        # Serve on sockets passed by systemd or a previous server if there
+        # are any, else bind to Host on Port and any further addresses
+        SocketServer.TCPServer.__init__(self, (Host, Port), RequestHandler,
+            bind_and_activate=False)
+        self.socket.close()
+        self.addresses = [(Host, Port)] + list(self.also_listen)
+        self.sockets = inherited_sockets()
+        self.inherited = bool(self.sockets)
+        if not self.inherited:
+            self.sockets = [self.bind_listener(address) for address in self.addresses]
+        self.socket = self.sockets[0]
+        self.server_address = self.socket.getsockname()
+
+        self.stopping = False
+        self.reloading = False
+        self.handing_off = False
+        self.paused = False
+        self.listening = {}
+        self.handlers = set()
+        self.limits = None
+        if self.max_connections or self.max_connections_per_ip:
+            self.limits = limits.ConnectionLimits(self.max_connections,
+                self.max_connections_per_ip)
+        self.metrics = metrics.Metrics() if self.metrics_enabled else None
+        self.access_log = None
+        if self.access_log_path is not None:
+            self.access_log = accesslog.AccessLog(self.access_log_path,
+                self.access_log_format, self.access_log_buffer)
+        self.load()
+        self.print_server_stats()
+
+    def load(self):
+        '''Set up the docroot and the caches of what is served from it'''
+        if self.docroot is not None:
+            self.root = os.path.abspath(self.docroot)
+        else:
+            self.root = os.path.join(os.getcwd(), 'www')
+        self.directory = ServerDirectory(self.root, self.use_mmap, self.etag_hash,
+            self.index_interval, self.get_types(), self.pack, self.autoindex)
+        shared = getattr(self, 'cache', None)
+        self.cache = None
+        if self.pack is not None: # Already in memory
+            pass
+        elif self.cache_size > 0 and not self.use_mmap and self.shared_cache:
+            if isinstance(shared, cache.SharedFileCache):
+                # Made before the workers were forked, so keep using it
+                shared.clear()
+                shared.directory = self.directory
+                self.cache = shared
+            else:
+                self.cache = cache.SharedFileCache(self.directory, self.cache_size,
+                    self.cache_max_file, self.etag_hash, getattr(self, 'workers', 1))
+        elif self.cache_size > 0 and not self.use_mmap:
+            self.cache = cache.FileCache(self.directory, self.cache_size,
+                self.cache_max_file, etag_hash=self.etag_hash)
+        self.errors = http.ErrorPages(self.error_dir)
+        self.variants = None
+        if self.compression and self.compress_cache_size > 0:
+            self.variants = cache.VariantCache(self.compress_cache_size,
+                self.compress_min_size, self.cache_max_file)
+        self.listings = None
+        if self.autoindex:
+            self.listings = cache.ListingCache(self.directory, self.listing_cache_size,
+                self.listing_page_size)
+
+    def bind_listener(self, address):
+        '''Returns a socket listening on a (host, port) address, with this
+        server's socket options. Host names resolving to both IPv4 and IPv6
+        addresses are bound on IPv4; list both to serve both.'''
+        host, port = address
+        infos = socket.getaddrinfo(host or None, port, socket.AF_UNSPEC,
+            socket.SOCK_STREAM, 0, socket.AI_PASSIVE)
+        infos.sort(key=lambda info: info[0] == socket.AF_INET6)
+        family, sockaddr = infos[0][0], infos[0][4]
+
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                listener.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_REUSEPORT', 15), 1)
+            if family == socket.AF_INET6:
+                listener.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            # Accepted sockets inherit their buffer sizes from the listener
+            if self.recv_buffer:
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+            if self.send_buffer:
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+            listener.bind(sockaddr)
+            listener.listen(self.request_queue_size)
+            if self.defer_accept:
+                listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, self.defer_accept)
+            if self.fastopen:
+                listener.setsockopt(socket.IPPROTO_TCP, getattr(socket, 'TCP_FASTOPEN', 23),
+                    self.fastopen)
+        except:
+            listener.close()
+            raise
+        return listener
+
+    def get_request(self):
+        try:
+            request, client_address = self.accepting.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EMFILE, errno.ENFILE):
+                self.pause_accepting()
+            raise
+        if self.tcp_nodelay:
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return request, client_address
+
+    def server_close(self):
+        for listener in self.sockets:
+            listener.close()
+
+    def verify_request(self, request, client_address):
+        '''Admit a connection within the limits, else turn it away'''
+        if self.limits is None:
+            return True
+        status = self.limits.admit(client_address[0])
+        if status is None:
+            return True
+        self.reject(request, client_address, status)
+        return False
+
+    def reject(self, request, client_address, status):
+        '''Answer a connection turned away with an error response without
+        waiting on the client; the caller closes it'''
+        RejectedConnection(request, client_address, self).reject(status)
+
+    def handle_error(self, request, client_address):
+        '''Report an exception raised answering a client, unless it only
+        says the client went away mid-response'''
+        error = sys.exc_info()[1]
+        if isinstance(error, socket.error) and error.args[0] in (errno.EPIPE, errno.ECONNRESET):
+            return
+        SocketServer.TCPServer.handle_error(self, request, client_address)
+
+    def release(self, client_address):
+        '''Forget a connection admitted by verify_request() once it closes'''
+        if self.limits is not None:
+            self.limits.release(client_address[0])
+
+    def serve(self):
+        '''Activate the server. This keeps running until stop() is called or
+        the process gets SIGTERM or Ctrl-C, then returns once the responses
+        in flight have been sent.'''
+        self.install_signals()
+        self.start_background()
+        try:
+            self.serve_forever()
+            self.drain()
+        finally:
+            self.stop_background()
+
+    def serve_forever(self, poll_interval=0.5):
+        '''Accept connections until stop() is called, reloading and handing
+        off the listening socket between them when signals ask to'''
+        while not self.stopping:
+            try:
+                ready = select.select([] if self.paused else self.sockets, [], [],
+                    poll_interval)[0]
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                ready = []
+            self.resume_accepting()
+            for listener in ready:
+                self.accepting = listener
+                self._handle_request_noblock()
+            self._handle_signals()
+
+    def pause_accepting(self):
+        '''Stop polling the listening sockets while the process is out of
+        file descriptors (EMFILE or ENFILE). They stay readable, so polling
+        them would only spin the serving loop; new connections wait in the
+        backlog until resume_accepting() is called as a connection closes,
+        or a round of the serving loop later.'''
+        if not self.paused:
+            self.paused = True
+            for fd in self.listening:
+                self.poller.unregister(fd)
 
-        self.root = os.path.join(os.getcwd(), 'www')
-        self.directory = ServerDirectory(self.root)
-        self.print_server_stats(Host, Port)
+    def resume_accepting(self):
+        if self.paused:
+            self.paused = False
+            for fd in self.listening:
+                self.poller.register(fd, Poller.READ)
 
-        # Activate the server; this will keep running until you
-        # interrupt the program with Ctrl-C
-        self.serve_forever()
+    def _handle_signals(self):
+        if self.reloading:
+            self.reloading = False
+            self.reload()
+        if self.handing_off:
+            self.handing_off = False
+            self.spawn_successor()
+            self.stop()
 
-    def print_server_stats(self, host, port):
+    def stop(self):
+        '''Stop accepting connections. Safe to call from a signal handler or
+        another thread.'''
+        self.stopping = True
+
+    def drain(self):
+        '''Close the listening socket once serve_forever() has returned.
+        Connections waiting in the backlog are refused, unless another
+        process shares the socket (see spawn_successor()).'''
+        self.server_close()
+
+    def reload(self):
+        '''Pick up changes without dropping connections: read the config
+        file again, walk the docroot and start over with empty caches and
+        fresh error pages and mime types. Also reopens the access log.
+
+        Settings used only at startup (eg: listen, workers, access-log)
+        take effect once the server is restarted or replaced by
+        spawn_successor().
+        '''
+        if self.argv is not None:
+            try:
+                configure(self, config.parse_args(build_parser(), self.argv))
+            except SystemExit: # The error is printed; keep the current settings
+                pass
+        retired = self.directory.mapped
+        self.load()
+        if retired is not None:
+            retired.clear()
+        if self.access_log is not None:
+            self.access_log.reopen()
+
+    def spawn_successor(self):
+        '''Start a new server process with the same arguments, passing it
+        this server's listening sockets the way systemd socket activation
+        does. Connections arriving while one process stops and the other
+        starts wait in the shared backlog rather than being refused.
+
+        Returns the pid of the new process.
+        '''
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # Out of the way first, in case one already holds a target fd
+                count = len(self.sockets)
+                fds = [fcntl.fcntl(listener.fileno(), fcntl.F_DUPFD, LISTEN_FDS_START + count)
+                    for listener in self.sockets]
+                for i, fd in enumerate(fds):
+                    os.dup2(fd, LISTEN_FDS_START + i)
+                os.closerange(LISTEN_FDS_START + count, max_fd())
+                env = dict(os.environ, LISTEN_FDS=str(count), LISTEN_PID=str(os.getpid()))
+                os.execve(sys.executable, [sys.executable] + sys.argv, env)
+            finally:
+                os._exit(1)
+        return pid
+
+    def start_background(self):
+        '''Start the threads that work alongside requests in this process'''
+        if self.access_log is not None:
+            self.access_log.start()
+
+    def stop_background(self):
+        if self.access_log is not None:
+            self.access_log.close()
+
+    def install_signals(self):
+        '''Stop gracefully on SIGTERM and Ctrl-C, reload on SIGHUP (which
+        also reopens the access log, as log rotation expects) and hand the
+        listening socket to a new server on SIGUSR2'''
+        try:
+            signal.signal(signal.SIGTERM, self._stop_signal)
+            signal.signal(signal.SIGINT, self._stop_signal)
+            signal.signal(signal.SIGHUP, self._reload_signal)
+            signal.signal(signal.SIGUSR2, self._handoff_signal)
+        except ValueError: # Signals can only be handled in the main thread
+            pass
+
+    # Handlers only set flags; the serving loop acts on them between
+    # requests, when no lock is held
+    def _stop_signal(self, signum, frame):
+        self.stop()
+
+    def _reload_signal(self, signum, frame):
+        self.reloading = True
+
+    def _handoff_signal(self, signum, frame):
+        self.handing_off = True
+
+    def get_types(self):
+        '''Returns the mime.MimeTypes with this server's overrides applied'''
+        if not (self.mime_files or self.mime_overrides):
+            return mime.default_types()
+        types = mime.MimeTypes()
+        for path in self.mime_files:
+            types.load(path)
+        for ext, name in self.mime_overrides:
+            types.add(ext, name)
+        return types
+
+    def print_server_stats(self):
         print("-------------------------------------")
         print("CMPUT 410 Webserver")
-        print("Address: %s:%s" %(str(host), str(port)))
+        addresses = []
+        for listener in self.sockets:
+            if listener.getsockname() not in addresses:
+                addresses.append(listener.getsockname())
+        for address in addresses:
+            print("Address: %s" % config.format_address(address))
+        print("Mode: %s" % self.mode)
+        print("Keep-alive: %s" %('on' if self.keep_alive else 'off'))
         print("Current time: %s" % time.strftime('%a, %d %b %Y %H:%M:%S'))
         print("-------------------------------------")
 
+    def print_cache_stats(self):
+        '''Print the hit rate of this process's file cache, and the memory
+        saved when it is shared with other workers'''
+        if self.cache is None:
+            return
+        stats = self.cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        line = "Worker %d: cache hit rate %.1f%% of %d lookups" %(os.getpid(),
+            100.0 * stats['hits'] / lookups if lookups else 0.0, lookups)
+        if 'saved_bytes' in stats:
+            line += ", %d KiB shared saving %d KiB" %(stats['bytes'] // 1024,
+                stats['saved_bytes'] // 1024)
+        print(line)
+        sys.stdout.flush()
+
+class ThreadPoolMixIn():
+    '''Answers requests with a fixed pool of worker threads.
+
+    Unlike SocketServer.ThreadingMixIn, which starts a new thread for every
+    connection, at most `threads` requests are answered at once. The serving
+    thread reads request heads itself from non-blocking sockets and only
+    hands a connection to the pool once a complete head has arrived; after
+    answering, the connection comes back to it to wait for the next one.
+    Clients slow to send a request, and keep-alive connections idling
+    between requests, therefore never hold a pool thread.
+
+    Attributes:
+        threads (int): The number of worker threads in the pool.
+    '''
+
+    threads = 8
+    keep_alive = True
+
+    def serve_forever(self, poll_interval=0.5):
+        self.start_pool()
+        self.reading = {}
+        self.returned = collections.deque()
+        self.poller = Poller()
+        self.wakeup = os.pipe()
+        for fd in self.wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.poller.register(self.wakeup[0], Poller.READ)
+        self.listening = {}
+        self.paused = False
+        for listener in self.sockets:
+            # Another worker may take a connection first; accept() must not wait
+            listener.setblocking(0)
+            self.listening[listener.fileno()] = listener
+            self.poller.register(listener.fileno(), Poller.READ)
+        self.swept = time.time()
+
+        while not self.stopping:
+            self._poll(poll_interval)
+            self._handle_signals()
+        self.pause_accepting()
+        self.listening = {}
+
+    def start_pool(self):
+        self.pending = Queue.Queue()
+        self.pool = []
+        for i in range(self.threads):
+            worker = threading.Thread(target=self._pool_worker)
+            worker.daemon = True
+            worker.start()
+            self.pool.append(worker)
+
+    def _poll(self, timeout):
+        for fd, events in self.poller.poll(timeout):
+            if fd in self.listening:
+                self.accepting = self.listening[fd]
+                self._handle_request_noblock()
+            elif fd in self.reading:
+                self._read(self.reading[fd])
+            elif fd == self.wakeup[0]:
+                try:
+                    os.read(fd, 4096)
+                except OSError:
+                    pass
+
+        while self.returned:
+            self._wait(self.returned.popleft())
+
+        if time.time() - self.swept >= 1:
+            self.swept = time.time()
+            self._close_idle(self.swept)
+            self.resume_accepting()
+
+    def process_request(self, request, client_address):
+        '''Wait for the first request of a new connection'''
+        request.setblocking(0)
+        self._wait(PooledConnection(request, client_address, self))
+
+    def _wait(self, conn):
+        self.reading[conn.fileno] = conn
+        self.poller.register(conn.fileno, Poller.READ)
+
+    def _unwait(self, conn):
+        self.poller.unregister(conn.fileno)
+        del self.reading[conn.fileno]
+
+    def _read(self, conn):
+        '''Read from a waiting connection, handing it to the pool once a
+        complete request head has arrived'''
+        try:
+            received = conn.on_readable()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            received = False
+
+        if not received:
+            self._unwait(conn)
+            conn.close()
+        elif conn.parser.has_request():
+            self._unwait(conn)
+            self.pending.put(conn)
+
+    def _close_idle(self, now):
+        '''Close connections that have been quiet for keep_alive_timeout,
+        and have the pool answer those slower than header_timeout to send a
+        request with a 408'''
+        deadline = now - self.keep_alive_timeout
+        head_deadline = now - self.header_timeout
+        for conn in self.reading.values():
+            if conn.is_idle():
+                if conn.last_active < deadline:
+                    self._unwait(conn)
+                    conn.close()
+            elif conn.head_started < head_deadline:
+                self._unwait(conn)
+                conn.timed_out = True
+                self.pending.put(conn)
+
+    def drain(self):
+        '''Wait up to drain_timeout for the requests being read or answered.
+
+        Connections idling between requests are closed. Responses sent
+        meanwhile ask the client to close (see RequestHandler._keep_alive()).
+        '''
+        self.server_close()
+        deadline = time.time() + self.drain_timeout
+        while time.time() < deadline:
+            for conn in self.reading.values():
+                if conn.is_idle():
+                    self._unwait(conn)
+                    conn.close()
+            if not self.reading and not self.returned and not self.pending.unfinished_tasks:
+                break
+            self._poll(0.05)
+        for conn in self.reading.values():
+            self._unwait(conn)
+            conn.close()
+        # Stop the pool too, rather than leave it to interpreter shutdown
+        for worker in self.pool:
+            self.pending.put(None)
+        for worker in self.pool:
+            worker.join(max(0.1, deadline - time.time()))
+        for fd in self.wakeup:
+            os.close(fd)
+
+    def _pool_worker(self):
+        while True:
+            conn = self.pending.get()
+            if conn is None:
+                self.pending.task_done()
+                return
+            try:
+                if conn.serve():
+                    # Back to the serving thread to wait for the next request
+                    self.returned.append(conn)
+                    os.write(self.wakeup[1], 'x')
+                else:
+                    conn.close()
+            except:
+                self.handle_error(conn.request, conn.client_address)
+                conn.close()
+            finally:
+                self.pending.task_done()
+
+class PreForkMixIn():
+    '''Forks worker processes that all accept on the same listening socket.
+
+    The parent binds the socket, forks `workers` children and then only
+    waits on them. The kernel spreads incoming connections across the
+    children, so throughput scales with the number of cores.
+
+    With reuse_port every worker after the first gets sockets of its own,
+    bound to the same addresses, and the kernel hashes each connection to
+    one worker instead of waking them all to race for it. The parent keeps
+    every worker's sockets open and spawn_successor() passes them all on,
+    so connections queued on a worker's own socket when it stops are
+    accepted by the new worker that takes it over rather than reset.
+
+    Attributes:
+        workers (int): The number of worker processes to fork.
+    '''
+
+    workers = 2
+
+    def serve(self):
+        self.children = []
+        shared, spare = self._split_sockets(self.sockets)
+        groups = []
+        for i in range(self.workers):
+            if i > 0 and self._reuses_port(shared):
+                self.sockets = [self._reuse_socket(spare, listener) for listener in shared]
+            else:
+                self.sockets = shared
+            if i == self.workers - 1: # Any left over are accepted on too
+                self.sockets = self.sockets + [listener for listeners in spare.values()
+                    for listener in listeners]
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(groups)
+            groups.append(self.sockets)
+            self.children.append(pid)
+
+        # Only workers accept, but all are kept open to be handed off
+        self.sockets = []
+        for listeners in groups:
+            self.sockets.extend(listener for listener in listeners
+                if listener not in self.sockets)
+
+        signal.signal(signal.SIGTERM, self._stop_signal)
+        signal.signal(signal.SIGINT, self._stop_signal)
+        signal.signal(signal.SIGHUP, self._forward_signal)
+        signal.signal(signal.SIGUSR2, self._handoff_signal)
+        deadline = None
+        try:
+            while self.children:
+                if self.handing_off:
+                    self.handing_off = False
+                    self.spawn_successor()
+                    self.stop()
+                if self.stopping and deadline is None:
+                    # Workers drain on their own; kill them if they overrun
+                    self._forward_signal(signal.SIGTERM, None)
+                    deadline = time.time() + self.drain_timeout + 1
+                if deadline is not None and time.time() > deadline:
+                    break
+                self._reap(deadline is not None)
+        finally:
+            self._stop_workers()
+            self.server_close()
+
+    def _run_worker(self, others):
+        '''Serve in a forked worker on its own sockets, closing the lists of
+        others belonging to the workers forked before it'''
+        for listeners in others:
+            for listener in listeners:
+                if listener not in self.sockets:
+                    listener.close()
+        # Exit through the finally below so buffered log entries are written
+        try:
+            self.install_signals()
+            signal.signal(signal.SIGUSR2, signal.SIG_IGN) # Only the parent hands off
+            self.start_background()
+            self.serve_forever()
+            self.drain()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_background()
+            self.print_cache_stats()
+            os._exit(0)
+
+    def _split_sockets(self, listeners):
+        '''Returns the first listening socket of each address, and a
+        dictionary of lists of the further ones keyed on address. Those are
+        the reuse_port sockets of the workers of a previous server, passed
+        on by spawn_successor().'''
+        shared, spare = [], {}
+        for listener in listeners:
+            address = listener.getsockname()
+            if any(found.getsockname() == address for found in shared):
+                spare.setdefault(address, []).append(listener)
+            else:
+                shared.append(listener)
+        return shared, spare
+
+    def _reuse_socket(self, spare, listener):
+        '''Returns a socket bound to the address of listener for a worker of
+        its own, one inherited from spare if there are any left'''
+        address = listener.getsockname()
+        if spare.get(address):
+            return spare[address].pop(0)
+        return self.bind_listener(address[:2])
+
+    def _reuses_port(self, listeners):
+        if not self.reuse_port:
+            return False
+        # Sockets passed by systemd may not allow binding beside them
+        option = getattr(socket, 'SO_REUSEPORT', 15)
+        return all(listener.getsockopt(socket.SOL_SOCKET, option) for listener in listeners)
+
+    def _reap(self, polling):
+        '''Wait for a worker to exit, or only check for one if polling'''
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG if polling else 0)
+        except OSError as e:
+            if e.errno == errno.EINTR: # Interrupted by a signal
+                return
+            if e.errno == errno.ECHILD:
+                self.children = []
+                return
+            raise
+        if pid == 0:
+            time.sleep(0.1)
+        elif pid in self.children:
+            self.children.remove(pid)
+
+    def _forward_signal(self, signum, frame):
+        for pid in self.children:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def _stop_workers(self):
+        '''Kill workers that are still running'''
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children = []
+
 class RequestHandler(SocketServer.BaseRequestHandler):
     '''
     Handles basic HTTP/1.1 requests.
 
-    Overrides SocketServer.TCPServer handle() method.
+    Overrides SocketServer.TCPServer handle() method. Connections are kept
+    alive between requests unless the client (or HTTP/1.0) asks otherwise,
+    and pipelined requests are answered in the order they arrive.
     '''
 
-    # References the server directory initiated in PyServer.
+    def setup(self):
+        self.served = 0
+        self.waiting = False
+        self.server.handlers.add(self)
+        if self.server.metrics is not None:
+            self.server.metrics.connection_opened()
+
+    def finish(self):
+        self.server.handlers.discard(self)
+        self.server.release(self.client_address)
+        if self.server.metrics is not None:
+            self.server.metrics.connection_closed()
+
     def handle(self):
-        self.head = self._extract_head(self.request.recv(1024).strip())
+        self.parser = http.HTTPRequestParser(self.server.max_header_size)
+        self.close_connection = False
+        self.head_started = time.time()
+        self.request.settimeout(self.server.keep_alive_timeout)
+
+        while not self.close_connection:
+            response = self._next_response()
+            if response is None:
+                if not self._receive():
+                    return
+            else:
+                self._send(response)
+                self.head_started = time.time()
+
+    def _send(self, response):
+        if self.server.metrics is None and self.server.access_log is None:
+            http.send_parts(self.request, response)
+            return
+
+        length = metrics.response_length(response)
+        began = time.time()
+        http.send_parts(self.request, response)
+        self._response_sent(response, length, began)
+
+    def _response_sent(self, response, length, began):
+        '''Count and log a response of length bytes, began being sent at began'''
+        length += metrics.streamed_length(response)
+        # Status lines start with a protocol of 8 characters (eg: HTTP/1.1)
+        status = response[0][9:12]
+        if self.server.metrics is not None:
+            now = time.time()
+            self.server.metrics.response_sent(status, length, now - began, now - self.parsed)
+        if self.server.access_log is not None:
+            body = length - metrics.head_length(response)
+            self.server.access_log.log(self.client_address[0], self.current, status, body)
 
+    def _receive(self):
+        '''Read more request data, returning False once the client is gone'''
+        # Between requests of a persistent connection
+        idle = self.waiting = self.served > 0 and not self.parser.pending()
+        if idle and self.server.stopping:
+            return False
+        if not idle and time.time() - self.head_started > self.server.header_timeout:
+            return self._time_out()
+        try:
+            data = self.request.recv(65536)
+        except socket.timeout:
+            return idle or self._time_out()
+        finally:
+            self.waiting = False
+        if idle:
+            self.head_started = time.time()
+        self.parser.feed(data)
+        return bool(data)
+
+    def _time_out(self):
+        '''Answer a client too slow to send its request with a 408,
+        returning False as the connection is then closed'''
+        self.parsed = time.time()
+        self.current = None
+        try:
+            self._send(self._build_error('408'))
+        except socket.error:
+            pass
+        return False
+
+    def close_if_idle(self):
+        '''Wake a connection waiting for its next request so it closes.
+        Called from another thread while the server is stopping.'''
+        if self.waiting:
+            try:
+                self.request.shutdown(socket.SHUT_RD)
+            except socket.error:
+                pass
+
+    def _next_response(self):
+        '''Returns the response parts for the next buffered request, or None
+        if no complete request has been received yet
+        '''
+        stats = self.server.metrics
+        began = time.time() if stats is not None else 0
+        try:
+            request = self.parser.next_request()
+        except http.HTTPParseError as e:
+            self.parsed = began
+            self.current = None
+            self.close_connection = True
+            return self._build_error(e.status)
+
+        if request is None:
+            return None
+        self.current = request
+        if stats is not None:
+            self.parsed = time.time()
+            stats.observe('parse', self.parsed - began)
+        return self.respond(request)
+
+    # References the server directory initiated in PyServer.
+    def respond(self, request):
+        '''Returns the HTTP response to a parsed HTTPRequest as a list of
+        parts for http.send_parts()
+
+        Cached files are answered from memory; anything else is streamed from
+        disk so large files never have to fit in memory.
+        '''
         directory = self.server.directory
+        stats = self.server.metrics
 
-        rtype, path, protocol = self._split_request(self.head)
+        rtype, path, protocol = request.method, request.path, request.protocol
 
         # Prevent malicous directory traversal
         path = directory.append_index(path) if self._serve_index(path) else path
@@ -167,46 +1190,287 @@ class RequestHandler(SocketServer.BaseRequestHandler):
         # print("Got a %(r)s request for %(p)s" %{'r':rtype, 'p':directory.remove_root(path)})
 
         get = self._is_get(rtype)
-        servable = directory.exists(path)
+
+        self.served += 1
+        self.close_connection = not self._keep_alive(get, request)
+        connection = 'close' if self.close_connection else 'keep-alive'
+
+        if get and stats is not None and request.path == self.server.metrics_path:
+            return self._respond_metrics(protocol, connection)
+
+        resource = self._find_file(path) if get else None
+        if stats is not None:
+            resolved = time.time()
+            stats.observe('resolve', resolved - self.parsed)
+
+        if resource is not None:
+            try:
+                response = self._respond_file(request, path, resource, connection)
+                if stats is not None:
+                    stats.observe('read', time.time() - resolved)
+                return response
+            except IOError: # File removed since it was found
+                pass
+            finally:
+                resource.release()
 
         # Serve a redirect for directory not ending with /
-        if directory.is_directory(path) and get:
-            self.request.sendall(self._build_redirect(path, directory))
-            return
+        location = directory.get_redirect(path) if get else None
+        if location is not None:
+            return self._build_redirect(location, protocol, connection)
 
-        clength = self.server.directory.get_fsize(path)
+        if get and self.server.listings is not None and self._serve_index(request.path):
+            response = self._respond_listing(request, os.path.dirname(path), connection)
+            if response is not None:
+                return response
 
-        if get and servable:
-            m = http.HTTPMessage(protocol, '200', clength, path)
-            self.request.sendall(m.get_package())
-        elif get and not servable:
-            m = http.HTTPMessage(protocol, '404', clength, None)
-            self.request.sendall(m.get_package())
-        else:
-            self.request.sendall('HTTP/1.1 501 Not Implemented\r\n\r\n')
+        return self.server.errors.get_parts(protocol, '404' if get else '501', connection)
 
-    def _build_redirect(self, fp, directory):
-        fp = directory.remove_root(fp)
-        fp = directory.append_index(fp)
-        return "HTTP/1.1 301 Moved Permanently\r\nLocation: " + fp + '\r\n'
+    def _respond_listing(self, request, path, connection):
+        '''Returns the response listing the directory at path, or None if
+        there is no such directory or page of it.
 
-    def _serve_index(self, fp):
-        '''Returns True if directory ends with / and an index must be served'''
-        return True if fp.strip().endswith('/') else False
+        The query may ask for a sort order (sort=name or sort=type), for it
+        to be reversed (order=desc) and for a page of a long listing (page).
+        '''
+        query = urlparse.parse_qs(request.query)
+        sort = query.get('sort', ['name'])[-1]
+        if sort not in cache.ListingCache.sorts:
+            sort = 'name'
+        reverse = query.get('order', ['asc'])[-1] == 'desc'
+        try:
+            page = int(query.get('page', ['1'])[-1])
+        except ValueError:
+            page = 1
+
+        listings = self.server.listings
+        if listings.page_size == 0:
+            found = listings.stream(path, request.path, sort, reverse)
+            if found is None:
+                return None
+            mtime, chunks = found
+            return self._respond_chunks(request, '200', chunks,
+                'text/html; charset=utf-8', connection, mtime)
 
-    def _extract_head(self, request):
-        '''Extract first line from received request'''
-        return request.splitlines()[0]
+        listing = listings.get(path, request.path, sort, reverse, page)
+        if listing is None:
+            return None
+        header = http.HTTPHeader(request.protocol, '200', 'text/html; charset=utf-8', listing.length)
+        header.set_last_modified(listing.mtime)
+        header.set_connection(connection)
+        return [header.get_string(), listing.body]
 
-    def _split_request(self, request):
-        '''Returns the type (eg GET), file requested and http protocol
+    def _respond_metrics(self, protocol, connection):
+        '''Returns the server's metrics in the Prometheus text format'''
+        caches = [(name, found.stats()) for name, found in
+            (('files', self.server.cache), ('compressed', self.server.variants),
+                ('listings', self.server.listings))
+            if found is not None]
+        mapped = self.server.directory.mapped
+        if mapped is not None:
+            caches.append(('mapped', {'entries':len(mapped)}))
 
-        If the request is malformed eg: GET /file.html other.html HTTP/1.1,
-        return best guess.
+        limits = self.server.limits
+        rejected = dict(limits.rejected) if limits is not None else None
+        log = self.server.access_log
+        body = self.server.metrics.render(caches, rejected,
+            log.dropped if log is not None else None)
+        header = http.HTTPHeader(protocol, '200', metrics.CONTENT_TYPE, len(body))
+        header.set_connection(connection)
+        return [header.get_string(), body]
+
+    def _find_file(self, path):
+        '''Returns the regular file at path from the pack if serving one,
+        otherwise from a memory map, the cache or the disk, in that order of
+        preference, or None
         '''
-        # TODO see issues.md issue # 1
-        result = request.split()
-        return result if len(result) == 3 else (result[0], result[1], result[-1])
+        directory = self.server.directory
+        if directory.pack is not None:
+            return directory.get_packed(path)
+        st = None
+        if directory.index is not None:
+            entry = directory.get_entry(path)
+            if entry is None:
+                return None
+            st = entry.st
+
+        resource = directory.get_mapped(path, st)
+        if resource is None and self.server.cache is not None:
+            resource = self.server.cache.get(path, st)
+        if resource is None:
+            # Opening the file costs more than checking the index is current
+            resource = cache.DiskFile.open(path)
+        if resource is not None and st is not None and (
+                resource.mtime != st.st_mtime or resource.size != st.st_size):
+            directory.update_entry(path)
+        return resource
+
+    # Files next to the original holding precompressed copies
+    precompressed = (('br', '.br'), ('gzip', '.gz'))
+
+    def _respond_file(self, request, path, resource, connection):
+        '''Returns the response parts sending resource, compressed if it is
+        text and the client accepts a content coding
+        '''
+        mtype = self.server.directory.get_type(path)
+        ctype = mtype.content_type
+        if not (self.server.compression and mtype.compressible):
+            return self._respond_resource(request, resource, ctype, connection)
+
+        variant, coding = self._get_encoded(request, path, resource)
+        try:
+            return self._respond_resource(request, variant or resource, ctype,
+                connection, coding, vary=True)
+        finally:
+            if variant is not None:
+                variant.release()
+
+    def _get_encoded(self, request, path, resource):
+        '''Returns a compressed copy of resource and its coding, or (None, None)
+
+        A precompressed sibling (eg: base.css.gz) at least as new as the file
+        is preferred; otherwise the file is compressed and the copy cached.
+        '''
+        accept = request.get_header('accept-encoding')
+        if not accept:
+            return None, None
+
+        for coding in http.acceptable_encodings(accept, [c for c, suffix in self.precompressed]):
+            sibling = self._find_file(path + dict(self.precompressed)[coding])
+            if sibling is not None:
+                if sibling.mtime >= resource.mtime:
+                    return sibling, coding
+                sibling.release()
+
+            if self.server.variants is not None:
+                variant = self.server.variants.get(path, coding, resource)
+                if variant is not None:
+                    return variant, coding
+        return None, None
+
+    def _respond_resource(self, request, resource, ctype, connection, coding=None, vary=False):
+        '''Returns the response parts sending resource, or the ranges of it
+        the client asked for
+        '''
+        size = resource.size
+
+        if self._not_modified(request, resource):
+            header = http.HTTPHeader(request.protocol, '304', ctype, 0)
+            header.unset('content_type')
+            header.unset('content_length')
+            header.set_etag(resource.etag)
+            header.set_last_modified(resource.mtime)
+            if vary:
+                header.set_vary('Accept-Encoding')
+            header.set_connection(connection)
+            return [header.get_string()]
+
+        ranges = self._get_ranges(request, resource)
+        if ranges == []:
+            m = http.HTTPMessage(request.protocol, '416', 0, None)
+            m.get_header().set_content_range(None, None, size)
+            m.get_header().set_connection(connection)
+            return m.get_parts()
+
+        header = http.HTTPHeader(request.protocol, '200', ctype, size)
+        header.set_accept_ranges()
+        if coding is not None:
+            header.set_content_encoding(coding)
+        if vary:
+            header.set_vary('Accept-Encoding')
+        header.set_etag(resource.etag)
+        header.set_last_modified(resource.mtime)
+        header.set_connection(connection)
+
+        if ranges is None:
+            return [header.get_string(), resource.get_part()]
+
+        header.set_status(request.protocol, '206')
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            header.set_content_range(start, end, size)
+            header.set_length(end - start + 1)
+            return [header.get_string(), resource.get_part(start, end - start + 1)]
+
+        mtype, length, parts = http.multipart_ranges(ranges, size, ctype, resource.get_part)
+        header.set_content_type(mtype)
+        header.set_length(length)
+        return [header.get_string()] + parts
+
+    def _respond_chunks(self, request, status, chunks, ctype, connection, mtime=None):
+        '''Returns the response parts streaming the strings of chunks (eg: a
+        generator) as they are produced, see http.ChunkedBody.
+
+        HTTP/1.0 clients cannot read a chunked body, so theirs ends when
+        the connection is closed.
+        '''
+        if request.protocol != 'HTTP/1.1':
+            self.close_connection = True
+            connection = 'close'
+        m = http.HTTPMessage(request.protocol, status, None, ctype=ctype, chunks=chunks)
+        header = m.get_header()
+        if mtime is not None:
+            header.set_last_modified(mtime)
+        header.set_connection(connection)
+        return m.get_parts()
+
+    def _get_ranges(self, request, resource):
+        '''Returns the byte ranges requested with Range, see http.parse_range
+
+        A Range is ignored if If-Range names a different version of the file.
+        '''
+        value = request.get_header('range')
+        if not value:
+            return None
+
+        if_range = request.get_header('if-range')
+        if if_range and if_range not in (resource.etag, http.http_date(resource.mtime)):
+            return None
+        return http.parse_range(value, resource.size)
+
+    def _not_modified(self, request, resource):
+        '''Returns True if the client's copy is current and a 304 will do
+
+        If-None-Match takes precedence; If-Modified-Since is only used when
+        it is absent (RFC 7232 section 6).
+        '''
+        if_none_match = request.get_header('if-none-match')
+        if if_none_match:
+            return http.etag_matches(if_none_match, resource.etag)
+
+        since = http.parse_http_date(request.get_header('if-modified-since'))
+        return since is not None and int(resource.mtime) <= since
+
+    def _keep_alive(self, get, request):
+        '''Returns True if the connection may be reused after this response
+
+        HTTP/1.1 connections persist unless the client sends Connection:
+        close, HTTP/1.0 ones only with Connection: keep-alive. Requests other
+        than GET may carry a body we do not read, so they always close.
+        '''
+        if not (get and self.server.keep_alive) or self.server.stopping:
+            return False
+        if self.served >= self.server.max_keep_alive_requests:
+            return False
+
+        connection = request.get_header('connection').lower()
+        if request.protocol == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+    def _build_error(self, status, protocol='HTTP/1.1'):
+        '''Returns an error response that closes the connection'''
+        return self.server.errors.get_parts(protocol, status, 'close')
+
+    def _build_redirect(self, location, protocol='HTTP/1.1', connection='close'):
+        header = http.HTTPHeader(protocol, '301', 'text/html', 0)
+        header.set_location(location)
+        header.set_connection(connection)
+        return [header.get_string()]
+
+    def _serve_index(self, fp):
+        '''Returns True if directory ends with / and an index must be served'''
+        return True if fp.strip().endswith('/') else False
 
     def _is_get(self, request_type):
         return request_type.strip() == 'GET'
@@ -214,7 +1478,508 @@ class RequestHandler(SocketServer.BaseRequestHandler):
     def _is_HTTP(self, protocol):
         return protocol.strip() == 'HTTP/1.1'
 
+class Poller():
+    '''Readiness notification using epoll where available, else poll.
+
+    Both expose the same register/modify/unregister interface and share the
+    READ/WRITE event bits; only the poll() timeout units differ.
+    '''
+
+    READ = select.POLLIN | select.POLLPRI
+    WRITE = select.POLLOUT
+    ERROR = select.POLLERR | select.POLLHUP
+
+    def __init__(self):
+        self.epoll = hasattr(select, 'epoll')
+        self.poller = select.epoll() if self.epoll else select.poll()
+
+    def register(self, fd, events):
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        '''Returns (fd, events) pairs, waiting at most timeout seconds'''
+        try:
+            if self.epoll:
+                return self.poller.poll(timeout)
+            return self.poller.poll(timeout * 1000)
+        except (IOError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+class EventPyServer(PyServer):
+    '''Serves every connection from one thread with an epoll event loop.
+
+    Sockets are non-blocking and each connection only holds its unparsed
+    input and unsent output, so thousands of idle or slow clients cost
+    memory rather than threads and never stall other clients.
+    '''
+
+    mode = 'event loop'
+    keep_alive = True
+
+    def serve_forever(self, poll_interval=0.5):
+        self.connections = {}
+        self.poller = Poller()
+        self.listening = {}
+        self.paused = False
+        for listener in self.sockets:
+            listener.setblocking(0)
+            self.listening[listener.fileno()] = listener
+            self.poller.register(listener.fileno(), Poller.READ)
+        self.swept = time.time()
+
+        while not self.stopping:
+            self._poll(poll_interval)
+            self._handle_signals()
+        self.pause_accepting()
+        self.listening = {}
+
+    def _poll(self, timeout):
+        for fd, events in self.poller.poll(timeout):
+            if fd in self.listening:
+                self._accept(self.listening[fd])
+            elif fd in self.connections:
+                self._service(self.connections[fd], events)
+
+        if time.time() - self.swept >= 1:
+            self.swept = time.time()
+            self._close_idle(self.swept)
+            self.resume_accepting()
+
+    def drain(self):
+        '''Finish the responses being written for up to drain_timeout,
+        closing connections as they go idle'''
+        self.server_close()
+        deadline = time.time() + self.drain_timeout
+        while self.connections and time.time() < deadline:
+            for conn in self.connections.values():
+                if conn.is_idle():
+                    self._close(conn)
+            self._poll(0.05)
+        for conn in self.connections.values():
+            self._close(conn)
+
+    def _accept(self, listener):
+        '''Accept every pending connection on a listening socket'''
+        while True:
+            try:
+                request, client_address = listener.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if e.args[0] in (errno.EMFILE, errno.ENFILE):
+                    self.pause_accepting()
+                    return
+                if e.args[0] == errno.ECONNABORTED:
+                    continue
+                raise
+
+            if not self.verify_request(request, client_address):
+                self.shutdown_request(request)
+                continue
+            request.setblocking(0)
+            if self.tcp_nodelay:
+                request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.metrics is not None:
+                self.metrics.connection_opened()
+            conn = EventConnection(request, client_address, self)
+            self.connections[request.fileno()] = conn
+            self.poller.register(request.fileno(), Poller.READ)
+
+    def _service(self, conn, events):
+        try:
+            if events & Poller.READ:
+                conn.on_readable()
+            if events & Poller.WRITE:
+                conn.on_writable()
+            if events & Poller.ERROR and not events & Poller.READ:
+                conn.closed = True
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                conn.closed = True
+        except:
+            self.handle_error(conn.request, conn.client_address)
+            conn.closed = True
+
+        if conn.closed:
+            self._close(conn)
+        else:
+            self.poller.modify(conn.fileno, conn.get_events())
+
+    def _close_idle(self, now):
+        '''Close connections that have been quiet for keep_alive_timeout,
+        and answer those slower than header_timeout to send a request with
+        a 408'''
+        deadline = now - self.keep_alive_timeout
+        head_deadline = now - self.header_timeout
+        for conn in self.connections.values():
+            if conn.wparts or conn.is_idle():
+                if conn.last_active < deadline:
+                    self._close(conn)
+            elif conn.head_started < head_deadline and not conn.close_connection:
+                conn.time_out()
+                self.poller.modify(conn.fileno, conn.get_events())
+
+    def _close(self, conn):
+        self.poller.unregister(conn.fileno)
+        del self.connections[conn.fileno]
+        conn.close()
+        self.shutdown_request(conn.request)
+        self.release(conn.client_address)
+        if self.metrics is not None:
+            self.metrics.connection_closed()
+        self.resume_accepting()
+
+class EventConnection(RequestHandler):
+    '''A non-blocking connection driven by EventPyServer.
+
+    Reuses the request parsing and response building of RequestHandler but
+    does not call handle(); the event loop feeds it data as it arrives.
+    Pipelined requests are answered one at a time, and no more input is
+    read while a response is still being written. File bodies are sent a
+    socket buffer at a time as the socket becomes writable.
+    '''
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.fileno = request.fileno()
+        self.parser = http.HTTPRequestParser(server.max_header_size)
+        self.wparts = collections.deque()
+        self.sending = None
+        self.served = 0
+        self.close_connection = False
+        self.closed = False
+        self.last_active = self.head_started = time.time()
+
+    def get_events(self):
+        return Poller.WRITE if self.wparts else Poller.READ
+
+    def is_idle(self):
+        '''Returns True between the requests of a persistent connection'''
+        return self.served > 0 and not self.wparts and not self.parser.pending()
+
+    def on_readable(self):
+        data = self.request.recv(65536)
+        if not data:
+            self.closed = True
+            return
+
+        self.last_active = time.time()
+        if self.is_idle():
+            self.head_started = self.last_active
+        self.parser.feed(data)
+        if not self.wparts:
+            self.on_writable()
+
+    def time_out(self):
+        '''Queue a 408 for a client too slow to send its request'''
+        self.parsed = time.time()
+        self.current = None
+        self.close_connection = True
+        response = self._build_error('408')
+        if self.server.metrics is not None or self.server.access_log is not None:
+            self.sending = (response, metrics.response_length(response), self.parsed)
+        self.wparts.extend(response)
+
+    def on_writable(self):
+        '''Flush pending output, then answer the next buffered request'''
+        while True:
+            while self.wparts:
+                self.last_active = time.time()
+                if not http.send_some(self.request, self.wparts):
+                    return
+                if not self.wparts: # The time for the next request starts now
+                    self.head_started = self.last_active
+
+            if self.sending is not None:
+                self._response_sent(*self.sending)
+                self.sending = None
+
+            if self.close_connection:
+                self.closed = True
+                return
+
+            response = self._next_response()
+            if response is None:
+                return
+            if self.server.metrics is not None or self.server.access_log is not None:
+                self.sending = (response, metrics.response_length(response), time.time())
+            self.wparts.extend(response)
+
+    def close(self):
+        '''Release any files still waiting to be sent'''
+        for part in self.wparts:
+            if not isinstance(part, (basestring, buffer)):
+                part.close()
+        self.wparts.clear()
+
+class PooledConnection(RequestHandler):
+    '''A connection of a ThreadPoolMixIn server.
+
+    Like EventConnection it reuses the request parsing and response building
+    of RequestHandler without calling handle(). The serving thread feeds it
+    data with on_readable() and a pool thread answers what has arrived with
+    serve().
+    '''
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.fileno = request.fileno()
+        self.parser = http.HTTPRequestParser(server.max_header_size)
+        self.close_connection = False
+        self.timed_out = False
+        self.last_active = self.head_started = time.time()
+        self.setup()
+
+    def is_idle(self):
+        '''Returns True between the requests of a persistent connection'''
+        return self.served > 0 and not self.parser.pending()
+
+    def on_readable(self):
+        '''Read what the client has sent, returning False once it is gone'''
+        data = self.request.recv(65536)
+        if not data:
+            return False
+        self.last_active = time.time()
+        if self.is_idle():
+            self.head_started = self.last_active
+        self.parser.feed(data)
+        return True
+
+    def serve(self):
+        '''Answer every complete request received, returning True if the
+        connection should wait for another'''
+        self.request.settimeout(self.server.keep_alive_timeout)
+        if self.timed_out:
+            return self._time_out()
+
+        while not self.close_connection:
+            response = self._next_response()
+            if response is None:
+                self.request.setblocking(0)
+                return True
+            self._send(response)
+            self.head_started = time.time()
+        return False
+
+    def close(self):
+        self.finish()
+        self.server.shutdown_request(self.request)
+
+class RejectedConnection(RequestHandler):
+    '''A connection turned away by the server's connection limits.
+
+    The error response goes out through RequestHandler._send(), so it is
+    counted and logged like any other, but the client is never waited on:
+    the response is written once to the non-blocking socket or not at all.
+    '''
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+
+    def reject(self, status):
+        '''Answer with status (eg: 503) and no request, as none was read'''
+        self.parsed = time.time()
+        self.current = None
+        try:
+            self.request.setblocking(0)
+            try:
+                # Unread request data would make closing reset the connection
+                self.request.recv(self.server.max_header_size)
+            except socket.error:
+                pass
+            self._send(self._build_error(status))
+        except socket.error:
+            pass
+
+class ThreadedPyServer(ThreadPoolMixIn, PyServer):
+    mode = 'thread pool'
+
+class PreForkThreadedPyServer(PreForkMixIn, ThreadPoolMixIn, PyServer):
+    mode = 'pre-forked workers with thread pools'
+
+class PreForkEventPyServer(PreForkMixIn, EventPyServer):
+    mode = 'pre-forked workers with event loops'
+
+def get_server_class(workers=1, threads=1, event_loop=False):
+    '''Returns the PyServer variant for the requested concurrency mode.
+
+    Without an event loop, requests are answered by a pool of threads, if
+    only one: a client slow to send its request, or idling between them,
+    must not hold up every other client.
+    '''
+    if event_loop:
+        server_class = PreForkEventPyServer if workers > 1 else EventPyServer
+    elif workers > 1:
+        server_class = PreForkThreadedPyServer
+    else:
+        server_class = ThreadedPyServer
+
+    server_class.workers = workers
+    server_class.threads = threads
+    return server_class
+
+def build_parser():
+    '''Returns the command line parser, whose flags are also the settings
+    of config files (see config.py)'''
+    parser = argparse.ArgumentParser(description='CMPUT 404 Webserver')
+    parser.add_argument('--config', metavar='FILE',
+        help='read settings from the [server] section of FILE; flags take precedence')
+    parser.add_argument('--listen', action='append', default=[], metavar='HOST:PORT',
+        type=config.parse_address,
+        help='address to serve, eg: 127.0.0.1:8080, [::1]:8080 or :8080 for '
+            'every interface (repeatable, default localhost:8080)')
+    parser.add_argument('--backlog', type=int, default=PyServer.request_queue_size,
+        help='connections the kernel queues before they are accepted')
+    parser.add_argument('--reuse-port', action='store_true',
+        help='give each worker its own listening socket (SO_REUSEPORT)')
+    parser.add_argument('--no-tcp-nodelay', action='store_true',
+        help='let the kernel hold small writes until earlier ones are ACKed (no TCP_NODELAY)')
+    parser.add_argument('--defer-accept', type=int, default=PyServer.defer_accept,
+        metavar='SECONDS', help='accept connections once their request arrives (TCP_DEFER_ACCEPT)')
+    parser.add_argument('--fastopen', type=int, default=PyServer.fastopen, metavar='QUEUE',
+        help='accept requests in the SYN from returning clients (TCP_FASTOPEN)')
+    parser.add_argument('--recv-buffer', type=int, default=PyServer.recv_buffer,
+        help='bytes of SO_RCVBUF for connections, 0 for the kernel default')
+    parser.add_argument('--send-buffer', type=int, default=PyServer.send_buffer,
+        help='bytes of SO_SNDBUF for connections, 0 for the kernel default')
+    parser.add_argument('--header-timeout', type=float, default=PyServer.header_timeout,
+        help='seconds a client has to send a request head before a 408')
+    parser.add_argument('--max-header-size', type=int, default=PyServer.max_header_size,
+        help='largest request head in bytes before a 431')
+    parser.add_argument('--max-connections', type=int, default=PyServer.max_connections,
+        help='connections open at once in each worker before a 503, 0 for no limit')
+    parser.add_argument('--max-connections-per-ip', type=int,
+        default=PyServer.max_connections_per_ip,
+        help='connections open at once from one address before a 429, 0 for no limit')
+    parser.add_argument('--docroot', metavar='DIR',
+        help='directory of the served files (default: www under the working directory)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of pre-forked worker processes')
+    parser.add_argument('--threads', type=int, default=1,
+        help='number of threads answering requests in each worker')
+    parser.add_argument('--event-loop', action='store_true',
+        help='serve all connections of a worker from one epoll event loop')
+    parser.add_argument('--no-keep-alive', action='store_true',
+        help='close every connection after one response')
+    parser.add_argument('--keep-alive-timeout', type=float,
+        default=PyServer.keep_alive_timeout,
+        help='seconds an idle persistent connection is kept open')
+    parser.add_argument('--max-requests', type=int,
+        default=PyServer.max_keep_alive_requests,
+        help='requests served on one connection before it is closed')
+    parser.add_argument('--cache-size', type=int,
+        default=PyServer.cache_size // 1024,
+        help='KiB of file contents cached in memory, 0 to disable')
+    parser.add_argument('--cache-max-file', type=int,
+        default=PyServer.cache_max_file // 1024,
+        help='largest file in KiB that is cached')
+    parser.add_argument('--pack', metavar='FILE',
+        help='serve the docroot from a pack built by docpack.py')
+    parser.add_argument('--autoindex', action='store_true',
+        help='list the contents of directories without an index.html')
+    parser.add_argument('--autoindex-page-size', type=int, default=PyServer.listing_page_size,
+        help='entries on each page of a directory listing, 0 to stream a directory on one page')
+    parser.add_argument('--shared-cache', action='store_true',
+        help='keep one file cache in shared memory for all pre-forked workers, not one each')
+    parser.add_argument('--mmap', action='store_true',
+        help='serve files from memory maps shared by all requests and workers')
+    parser.add_argument('--no-compression', action='store_true',
+        help='never send text files with a content coding such as gzip')
+    parser.add_argument('--compress-cache-size', type=int,
+        default=PyServer.compress_cache_size // 1024,
+        help='KiB of compressed copies of files kept in memory')
+    parser.add_argument('--index-interval', type=float, default=PyServer.index_interval,
+        help='seconds between walks of the docroot index')
+    parser.add_argument('--no-index', action='store_true',
+        help='look every request up on disk rather than in the docroot index')
+    parser.add_argument('--etag-hash', action='store_true',
+        help='build ETags of cached and mapped files from a hash of their contents')
+    parser.add_argument('--no-metrics', action='store_true',
+        help='do not count requests or time them')
+    parser.add_argument('--metrics-path', metavar='PATH',
+        help='answer GET PATH (eg: /metrics) with metrics in the Prometheus text format')
+    parser.add_argument('--access-log', metavar='FILE',
+        help='append access logs to FILE, or - for standard output')
+    parser.add_argument('--access-log-format', choices=sorted(accesslog.FORMATS),
+        default=PyServer.access_log_format)
+    parser.add_argument('--access-log-buffer', type=int, default=PyServer.access_log_buffer,
+        help='log entries buffered before new ones are dropped')
+    parser.add_argument('--mime-types', action='append', default=[], metavar='FILE',
+        help='extra mime.types file read after /etc/mime.types (repeatable)')
+    parser.add_argument('--mime-type', action='append', default=[], metavar='EXT=TYPE',
+        type=mime.parse_override,
+        help='serve files with an extension as a type, eg: .mjs=text/javascript (repeatable)')
+    parser.add_argument('--error-dir',
+        help='directory of custom error pages named for their status (eg: 404.html)')
+    return parser
+
+def configure(target, args):
+    '''Apply parsed settings to a PyServer class, or to a running server on
+    reload'''
+    target.keep_alive = not args.no_keep_alive
+    target.keep_alive_timeout = args.keep_alive_timeout
+    target.max_keep_alive_requests = args.max_requests
+    target.cache_size = args.cache_size * 1024
+    target.cache_max_file = args.cache_max_file * 1024
+    target.use_mmap = args.mmap
+    target.shared_cache = args.shared_cache and args.workers > 1
+    target.etag_hash = args.etag_hash
+    target.index_interval = None if args.no_index else args.index_interval
+    target.error_dir = args.error_dir
+    target.metrics_enabled = not args.no_metrics
+    target.access_log_path = args.access_log
+    target.access_log_format = args.access_log_format
+    target.access_log_buffer = args.access_log_buffer
+    target.metrics_path = args.metrics_path
+    target.mime_files = args.mime_types
+    target.mime_overrides = args.mime_type
+    target.compression = not args.no_compression
+    target.compress_cache_size = args.compress_cache_size * 1024
+    target.header_timeout = args.header_timeout
+    target.max_header_size = args.max_header_size
+    target.max_connections = args.max_connections
+    target.max_connections_per_ip = args.max_connections_per_ip
+    target.docroot = args.docroot
+    target.pack = args.pack
+    target.autoindex = args.autoindex
+    target.listing_page_size = args.autoindex_page_size
+    target.also_listen = args.listen[1:]
+    target.request_queue_size = args.backlog
+    target.reuse_port = args.reuse_port
+    target.tcp_nodelay = not args.no_tcp_nodelay
+    target.defer_accept = args.defer_accept
+    target.fastopen = args.fastopen
+    target.recv_buffer = args.recv_buffer
+    target.send_buffer = args.send_buffer
+
 if __name__ == "__main__":
-    HOST, PORT = "localhost", 8080
+    parser = build_parser()
+    args = config.parse_args(parser)
+
+    if args.event_loop and args.threads > 1:
+        parser.error('--threads cannot be combined with --event-loop')
+    if not args.listen:
+        args.listen = [('localhost', 8080)]
+
+    server_class = get_server_class(args.workers, args.threads, args.event_loop)
+    configure(server_class, args)
+    server_class.argv = sys.argv[1:]
+    raise_fd_limit()
 
-    server = PyServer(HOST, PORT)
+    HOST, PORT = args.listen[0]
+    server = server_class(HOST, PORT)
+    server.serve()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import accesslog
+import http
+import os
+import server
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+PORT = 8097
+
+def parse(data):
+    parser = http.HTTPRequestParser()
+    parser.feed(data)
+    return parser.next_request()
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.fp = os.path.join(os.getcwd(), 'test-access.log')
+
+    def tearDown(self):
+        for fp in (self.fp, self.fp + '.1'):
+            if os.path.exists(fp):
+                os.remove(fp)
+
+    def read(self):
+        with open(self.fp) as log:
+            return log.read()
+
+    def test_combined(self):
+        log = accesslog.AccessLog(self.fp)
+        request = parse('GET /a.html?x=1 HTTP/1.1\r\nReferer: http://r/\r\nUser-Agent: say "hi"\r\n\r\n')
+        log.log('10.0.0.1', request, '200', 42)
+        log.log('10.0.0.2', None, '400', 0)
+        log.close()
+
+        lines = self.read().splitlines()
+        self.assertTrue(lines[0].startswith('10.0.0.1 - - ['), 'Bad host field')
+        self.assertTrue(lines[0].endswith('] "GET /a.html?x=1 HTTP/1.1" 200 42 "http://r/" "say \\"hi\\""'),
+            'Bad combined entry %s' % lines[0])
+        self.assertTrue(lines[1].endswith('] "-" 400 - "-" "-"'), 'Bad entry for an unparsed request')
+
+    def test_common(self):
+        log = accesslog.AccessLog(self.fp, 'common')
+        log.log('10.0.0.1', parse('GET / HTTP/1.0\r\n\r\n'), '404', 113)
+        log.close()
+        self.assertTrue(self.read().endswith('] "GET / HTTP/1.0" 404 113\n'), 'Bad common entry')
+
+    def test_log_time(self):
+        self.assertTrue(accesslog.log_time(971182536) == '10/Oct/2000:12:55:36 +0000', 'Bad log time')
+
+    def test_drops(self):
+        log = accesslog.AccessLog(self.fp, max_entries=2)
+        for i in range(5):
+            log.log('10.0.0.1', None, '400', 0)
+        log.close()
+        self.assertTrue(log.dropped == 3 and log.written == 2, 'Full buffer should drop new entries')
+
+    def test_background_flush(self):
+        log = accesslog.AccessLog(self.fp, flush_interval=0.05)
+        log.start()
+        log.log('10.0.0.1', None, '400', 0)
+        time.sleep(0.3)
+        self.assertTrue(self.read().count('\n') == 1, 'Entry not written by the writer thread')
+        log.close()
+
+    def test_reopen(self):
+        log = accesslog.AccessLog(self.fp)
+        log.log('10.0.0.1', None, '400', 0)
+        log.flush()
+        os.rename(self.fp, self.fp + '.1')
+        log.reopen()
+        log.log('10.0.0.2', None, '400', 0)
+        log.close()
+        self.assertTrue(self.read().startswith('10.0.0.2 '), 'Log not reopened after rotation')
+
+class LoggedServer(server.ThreadedPyServer):
+    access_log_path = os.path.join(os.getcwd(), 'test-server-access.log')
+    metrics_path = '/metrics'
+
+class TestServerLog(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.httpd = LoggedServer(HOST, PORT)
+        self.thread = threading.Thread(target=self.httpd.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        # Stop before exiting so the log writer is not cut off mid-flush
+        self.httpd.stop()
+        self.thread.join(3)
+        os.remove(LoggedServer.access_log_path)
+
+    def test_requests_logged(self):
+        sock = socket.create_connection((HOST, PORT), 3)
+        try:
+            sock.sendall('GET /base.css HTTP/1.1\r\n\r\nGET /missing HTTP/1.1\r\nConnection: close\r\n\r\n')
+            while sock.recv(65536):
+                pass
+        finally:
+            sock.close()
+        time.sleep(1.5)
+
+        with open(LoggedServer.access_log_path) as log:
+            lines = log.read().splitlines()
+        size = os.path.getsize(os.path.join('www', 'base.css'))
+        self.assertTrue(lines[-2].endswith('"GET /base.css HTTP/1.1" 200 %d "-" "-"' % size), 'Bad entry %s' % lines[-2])
+        self.assertTrue(' 404 ' in lines[-1], 'Pipelined request not logged')
+        self.assertTrue(' 404 %d ' % len(http.error_page('404')) in lines[-1],
+            'Error logged with the length of its head %s' % lines[-1])
+
+    def test_dropped_exported(self):
+        self.httpd.access_log.dropped = 7
+        sock = socket.create_connection((HOST, PORT), 3)
+        try:
+            sock.sendall('GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n')
+            text = sock.makefile('rb').read()
+        finally:
+            sock.close()
+        self.assertTrue('webserver_access_log_dropped_total 7\n' in text, 'Dropped entries not exported')
+
+if __name__ == '__main__':
+    unittest.main()
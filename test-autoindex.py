@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import cache
+import docpack
+import server
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+HOST = "127.0.0.1"
+PORT = 8125
+STREAM_PORT = 8132
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.names = ['b.txt', 'a.css', 'c.html', 'd.txt', '<e>.txt']
+        for name in self.names:
+            open(os.path.join(self.root, name), 'w').close()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        self.directory = server.ServerDirectory(self.root)
+        self.listings = cache.ListingCache(self.directory, page_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def links(self, entry):
+        '''Returns the link targets in a rendered listing'''
+        return [line.split('"')[1] for line in entry.body.split('\n') if line.startswith('<li>')]
+
+    def test_fallback(self):
+        '''Without getdents() entries are found with listdir() and stat()'''
+        getdents = cache._getdents
+        cache._getdents = None
+        try:
+            found = sorted(cache.scandir(self.root))
+        finally:
+            cache._getdents = getdents
+        self.assertTrue(found == sorted(cache.scandir(self.root)), "Listings differ")
+
+    def test_pages(self):
+        pages = [self.links(self.listings.get(self.root, '/list/', page=page)) for page in (1, 2, 3)]
+        self.assertTrue(pages == [['../', 'sub/', '%3Ce%3E.txt'], ['../', 'a.css', 'b.txt'],
+            ['../', 'c.html', 'd.txt']], "Bad pages %r" % pages)
+        self.assertTrue(self.listings.get(self.root, '/list/', page=4) is None, "Page past the end")
+        self.assertTrue(self.listings.get(self.root, '/list/', page=0) is None, "Page before the start")
+        self.assertTrue('&lt;e&gt;.txt' in self.listings.get(self.root, '/list/').body, "Name not escaped")
+
+    def test_sort(self):
+        by_type = self.links(self.listings.get(self.root, '/', 'type', page=2))
+        self.assertTrue(by_type == ['c.html', '%3Ce%3E.txt'], "Not sorted by type %r" % by_type)
+        reverse = self.links(self.listings.get(self.root, '/', 'name', True))
+        self.assertTrue(reverse == ['sub/', 'd.txt'], "Not reversed %r" % reverse)
+
+    def test_cached(self):
+        first = self.listings.get(self.root, '/')
+        self.assertTrue(self.listings.get(self.root, '/') is first, "Listing rendered again")
+        self.assertTrue(self.listings.hits == 1, "Hit not counted")
+
+    def test_location(self):
+        '''A directory requested at two locations is rendered for each'''
+        first = self.listings.get(self.root, '/lst/')
+        second = self.listings.get(self.root, '/lst//')
+        self.assertTrue('<title>Index of /lst/</title>' in first.body, "Bad title")
+        self.assertTrue('<title>Index of /lst//</title>' in second.body,
+            "Page of another location served")
+        self.assertTrue(self.listings.get(self.root, '/lst/') is first, "Listing rendered again")
+
+    def test_invalidated(self):
+        self.assertTrue(self.links(self.listings.get(self.root, '/', page=3)) == ['c.html', 'd.txt'])
+        open(os.path.join(self.root, '0.txt'), 'w').close()
+        # Some filesystems keep mtimes to the second
+        os.utime(self.root, (time.time() + 10, time.time() + 10))
+        self.assertTrue(self.links(self.listings.get(self.root, '/', page=3)) == ['b.txt', 'c.html'],
+            "Changed directory not listed again")
+
+    def test_stream(self):
+        '''The whole listing on one page, the same entries as the pages'''
+        mtime, chunks = self.listings.stream(self.root, '/list/', reverse=True)
+        chunks = list(chunks)
+        self.assertTrue(mtime == self.directory.get_listing_mtime(self.root), "Bad mtime")
+        page = cache.ListingEntry(''.join(chunks), mtime)
+        self.assertTrue(self.links(page) == ['../', 'sub/', 'd.txt', 'c.html', 'b.txt', 'a.css',
+            '%3Ce%3E.txt'], "Bad listing %r" % self.links(page))
+        self.assertTrue(page.body.endswith('</ul>\n</body>\n</html>'), "Page not closed")
+        self.assertTrue('Page ' not in page.body, "Single page has page links")
+        self.assertTrue(self.listings.stream(os.path.join(self.root, 'a.css'), '/a.css/') is None,
+            "File listed")
+
+    def test_not_a_directory(self):
+        self.assertTrue(self.listings.get(os.path.join(self.root, 'a.css'), '/a.css/') is None,
+            "File listed")
+        self.assertTrue(self.listings.get(os.path.join(self.root, 'missing'), '/missing/') is None,
+            "Missing directory listed")
+
+    def test_pack(self):
+        target = os.path.join(tempfile.mkdtemp(), 'www.pack')
+        try:
+            docpack.build(self.root, target)
+            directory = server.ServerDirectory(self.root, pack=target, autoindex=True)
+            self.assertTrue(sorted(directory.list_directory(self.root)) ==
+                sorted(cache.scandir(self.root)), "Pack lists differently")
+            self.assertTrue(directory.list_directory(os.path.join(self.root, 'sub')) == [], "Empty directory")
+            self.assertTrue(directory.get_listing_mtime(os.path.join(self.root, 'a.css')) is None,
+                "File taken for a directory")
+            self.assertTrue(directory.get_redirect(os.path.join(self.root, 'sub')) == '/sub/', "Bad redirect")
+        finally:
+            shutil.rmtree(os.path.dirname(target))
+
+def fetch(path, port=PORT, protocol='HTTP/1.1'):
+    '''Request path and return the (status line, headers, body)'''
+    sock = socket.create_connection((HOST, port), 3)
+    try:
+        sock.sendall('GET %s %s\r\nConnection: close\r\n\r\n' %(path, protocol))
+        response = sock.makefile('rb').read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    return lines[0], dict(line.split(': ', 1) for line in lines[1:]), body
+
+class TestAutoindexServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.listed = os.path.join(os.getcwd(), 'www', 'testlisted')
+        os.mkdir(self.listed)
+        for i in range(5):
+            open(os.path.join(self.listed, 'file%d.txt' % i), 'w').close()
+        class ListingServer(server.ThreadedPyServer):
+            autoindex = True
+            listing_page_size = 3
+        self.httpd = ListingServer(HOST, PORT)
+        self.thread = threading.Thread(target=self.httpd.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.3)
+
+    @classmethod
+    def tearDownClass(self):
+        self.httpd.stop()
+        self.thread.join(3)
+        shutil.rmtree(self.listed)
+
+    def test_redirect(self):
+        status, fields, body = fetch('/testlisted')
+        self.assertTrue(status == 'HTTP/1.1 301 Moved Permanently', "Not redirected")
+        self.assertTrue(fields['Location'].endswith('/testlisted/'), "Redirected to a missing index")
+
+    def test_listing(self):
+        status, fields, body = fetch('/testlisted/?page=2&order=desc')
+        self.assertTrue(status == 'HTTP/1.1 200 OK', "Bad status %s" % status)
+        self.assertTrue(int(fields['Content-Length']) == len(body), "Bad Content-Length")
+        self.assertTrue('file1.txt' in body and 'file0.txt' in body and 'file2.txt' not in body,
+            "Bad page")
+        self.assertTrue(fetch('/testlisted/?page=3')[0] == 'HTTP/1.1 404 Not Found', "Page past the end")
+        self.assertTrue(fetch('/testlisted/?page=x')[0] == 'HTTP/1.1 200 OK', "Bad page number refused")
+
+    def test_index_preferred(self):
+        status, fields, body = fetch('/deep/')
+        with open(os.path.join('www', 'deep', 'index.html')) as fp:
+            self.assertTrue(body == fp.read(), "index.html not served")
+
+    def test_missing(self):
+        self.assertTrue(fetch('/nothere/')[0] == 'HTTP/1.1 404 Not Found', "Missing directory listed")
+
+def decode_chunked(data):
+    '''Returns the body of a chunked message body'''
+    body = []
+    while True:
+        line, data = data.split('\r\n', 1)
+        size = int(line, 16)
+        if size == 0:
+            return ''.join(body)
+        body.append(data[:size])
+        data = data[size + 2:]
+
+class TestStreamedListing(unittest.TestCase):
+    '''With a page size of 0 a directory is listed on one page, sent chunked
+    to HTTP/1.1 clients as it is rendered'''
+
+    @classmethod
+    def setUpClass(self):
+        self.listed = os.path.join(os.getcwd(), 'www', 'teststreamed')
+        os.mkdir(self.listed)
+        self.names = ['file%04d.txt' % i for i in range(1200)]
+        for name in self.names:
+            open(os.path.join(self.listed, name), 'w').close()
+        class StreamingServer(server.ThreadedPyServer):
+            autoindex = True
+            listing_page_size = 0
+        self.httpd = StreamingServer(HOST, STREAM_PORT)
+        self.thread = threading.Thread(target=self.httpd.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.3)
+
+    @classmethod
+    def tearDownClass(self):
+        self.httpd.stop()
+        self.thread.join(3)
+        shutil.rmtree(self.listed)
+
+    def links(self, body):
+        return [line.split('"')[1] for line in body.split('\n') if line.startswith('<li>')]
+
+    def test_chunked(self):
+        status, fields, body = fetch('/teststreamed/', STREAM_PORT)
+        self.assertTrue(status == 'HTTP/1.1 200 OK', "Bad status %s" % status)
+        self.assertTrue(fields.get('Transfer-Encoding') == 'chunked', "Not chunked")
+        self.assertTrue('Content-Length' not in fields, "Has a length")
+        self.assertTrue('Last-Modified' in fields, "No Last-Modified")
+        body = decode_chunked(body)
+        self.assertTrue(self.links(body) == ['../'] + self.names, "Bad listing")
+        self.assertTrue(body.endswith('</html>'), "Page cut short")
+
+    def test_http10(self):
+        status, fields, body = fetch('/teststreamed/?order=desc', STREAM_PORT, 'HTTP/1.0')
+        self.assertTrue(status == 'HTTP/1.0 200 OK', "Bad status %s" % status)
+        self.assertTrue('Transfer-Encoding' not in fields, "HTTP/1.0 sent chunks")
+        self.assertTrue(fields.get('Connection') == 'close', "Body end not marked by closing")
+        self.assertTrue(self.links(body) == ['../'] + self.names[::-1], "Bad listing")
+
+    def test_missing(self):
+        self.assertTrue(fetch('/nothere/', STREAM_PORT)[0] == 'HTTP/1.1 404 Not Found',
+            "Missing directory listed")
+
+if __name__ == '__main__':
+    unittest.main()
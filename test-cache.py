@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import cache
+import http
+import server
+import os
+import shutil
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        '''Create a test directory with a few files'''
+        self.testroot = os.path.join(os.getcwd(), 'testcache')
+        os.mkdir(self.testroot)
+        self.files = {}
+        for name, size in (('a.html', 100), ('b.css', 100), ('c.html', 100), ('big.html', 1000)):
+            self.files[name] = os.path.join(self.testroot, name)
+            self.write(name, 'x' * size)
+
+        self.directory = server.ServerDirectory(self.testroot)
+        self.c = cache.FileCache(self.directory, max_bytes=250, max_file=500)
+
+    def body(self, entry):
+        '''Returns the body of an entry, releasing it'''
+        part = entry.get_part()
+        entry.release()
+        return part if isinstance(part, basestring) else part.read()
+
+    def write(self, name, contents, mtime=None):
+        with open(self.files[name], 'w') as fp:
+            fp.write(contents)
+        if mtime is not None:
+            os.utime(self.files[name], (mtime, mtime))
+
+    def test_miss_then_hit(self):
+        first = self.c.get(self.files['a.html'])
+        second = self.c.get(self.files['a.html'])
+        self.assertTrue(first is second, "Second get should be served from the cache")
+        self.assertTrue((self.c.misses, self.c.hits) == (1, 1), "Counters not updated")
+
+    def test_entry_metadata(self):
+        entry = self.c.get(self.files['b.css'])
+        self.assertTrue(entry.ctype == 'text/css', "Content type not cached")
+        self.assertTrue(entry.length == 100 and self.body(entry) == 'x' * 100, "Body not cached")
+
+    def test_lru_eviction(self):
+        for name in ('a.html', 'b.css', 'a.html', 'c.html'):
+            self.c.get(self.files[name])
+        self.assertTrue(self.c.evictions == 1, "Least recently used entry not evicted")
+        self.assertTrue(self.files['b.css'] not in self.c.entries, "Wrong entry evicted")
+        self.assertTrue(self.c.size <= 250, "Cache exceeded its byte limit")
+
+    def test_mtime_invalidation(self):
+        self.write('a.html', 'old', mtime=1000)
+        self.assertTrue(self.body(self.c.get(self.files['a.html'])) == 'old', "File not read")
+        self.write('a.html', 'new', mtime=2000)
+        self.assertTrue(self.body(self.c.get(self.files['a.html'])) == 'new', "Changed file not reloaded")
+        self.assertTrue(self.c.invalidations == 1, "Invalidation not counted")
+
+    def test_deleted_file(self):
+        self.c.get(self.files['a.html'])
+        os.remove(self.files['a.html'])
+        self.assertTrue(self.c.get(self.files['a.html']) is None, "Deleted file still served")
+
+    def test_not_cacheable(self):
+        self.assertTrue(self.c.get(self.files['big.html']) is None, "Oversized file should not be cached")
+        self.assertTrue(self.c.get(self.testroot) is None, "Directories should not be cached")
+        self.assertTrue(self.c.get(os.path.join(self.testroot, 'missing')) is None, "Missing file cached")
+
+    def tearDown(self):
+        shutil.rmtree(self.testroot)
+
+class TestSharedFileCache(TestFileCache):
+    def setUp(self):
+        TestFileCache.setUp(self)
+        self.c = cache.SharedFileCache(self.directory, max_bytes=4096,
+            max_file=500, sharers=4)
+
+    def test_miss_then_hit(self):
+        first = self.c.get(self.files['a.html'])
+        second = self.c.get(self.files['a.html'])
+        self.assertTrue(first.etag == second.etag, "ETag not cached")
+        self.assertTrue(self.body(first) == self.body(second) == 'x' * 100, "Body not cached")
+        self.assertTrue((self.c.misses, self.c.hits) == (1, 1), "Counters not updated")
+
+    def test_zero_copy(self):
+        '''Hits are sent out of the shared map, not copies of it'''
+        self.c.get(self.files['a.html']).release()
+        entry = self.c.get(self.files['a.html'])
+        part = entry.get_part(10, 20)
+        entry.release()
+        self.assertTrue(isinstance(part, http.BufferBody) and part.data is self.c.map,
+            "Body copied out of the map")
+        self.assertTrue(part.read() == 'x' * 20, "Wrong part of the body")
+        self.assertTrue(self.c.header.unpack_from(self.c.map, 0)[7:] == (0, 0), "Entry still pinned")
+
+    def fill(self, names):
+        for name in names:
+            self.c.get(self.files[name]).release()
+
+    def test_lru_eviction(self):
+        '''Once both halves are full, the older one is emptied and filled'''
+        for name in ('a.html', 'b.css', 'c.html'):
+            self.write(name, name[0] * 2000)
+        self.c = cache.SharedFileCache(self.directory, max_bytes=8192, max_file=4096)
+        self.fill(('a.html', 'b.css', 'c.html'))
+        self.assertTrue(self.c.evictions == 1, "Older half not emptied")
+        self.assertTrue(len(self.c) == 2, "Wrong entries left after emptying")
+        self.assertTrue(self.body(self.c.get(self.files['c.html'])) == 'c' * 2000, "Last file not kept")
+        self.assertTrue(self.c.get(self.files['b.css']) is not None and self.c.hits == 2,
+            "File in the other half dropped")
+        self.assertTrue(self.c.stats()['bytes'] <= 8192, "Cache exceeded its byte limit")
+
+    def test_pinned_half_kept(self):
+        '''A body being sent is not overwritten, however full the cache'''
+        for name in ('a.html', 'b.css', 'c.html', 'big.html'):
+            self.write(name, name[0] * 2000)
+        self.c = cache.SharedFileCache(self.directory, max_bytes=8192, max_file=4096)
+        self.fill(('a.html',))
+        entry = self.c.get(self.files['a.html'])
+        part = entry.get_part()
+        entry.release()
+        self.fill(('b.css', 'c.html', 'big.html'))
+        self.assertTrue(part.read() == 'a' * 2000, "Body overwritten while being sent")
+        self.assertTrue(self.c.get(self.files['a.html']) is not None and self.c.hits == 2,
+            "Entry being sent dropped")
+        self.assertTrue(self.c.header.unpack_from(self.c.map, 0)[7:] == (1, 0), "Pins miscounted")
+
+    def test_mtime_invalidation(self):
+        self.write('a.html', 'old', mtime=1000)
+        self.assertTrue(self.body(self.c.get(self.files['a.html'])) == 'old', "File not read")
+        self.write('a.html', 'new', mtime=2000)
+        self.assertTrue(self.body(self.c.get(self.files['a.html'])) == 'new', "Changed file not reloaded")
+        self.assertTrue(self.body(self.c.get(self.files['a.html'])) == 'new', "Old body still cached")
+        self.assertTrue(len(self.c) == 1, "Changed file stored twice")
+
+    def test_shared_between_processes(self):
+        '''A file read by one process is a hit in another'''
+        pid = os.fork()
+        if pid == 0:
+            self.c.get(self.files['a.html']).release()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        entry = self.c.get(self.files['a.html'])
+        self.assertTrue(self.body(entry) == 'x' * 100, "Body not shared")
+        self.assertTrue((self.c.misses, self.c.hits) == (0, 1), "Not a hit in the other process")
+
+    def test_saved_bytes(self):
+        self.c.get(self.files['a.html'])
+        stats = self.c.stats()
+        self.assertTrue(stats['entries'] == 1 and stats['bytes'] > 100, "Entry not counted")
+        self.assertTrue(stats['saved_bytes'] == stats['bytes'] * 3, "Memory saved miscounted")
+
+    def test_torn_read(self):
+        '''A slot being written is a miss, not a corrupted body'''
+        self.c.get(self.files['a.html'])
+        key = hash(self.files['a.html'])
+        at = self.c.table + (key % self.c.slots) * self.c.slot.size
+        fields = list(self.c.slot.unpack_from(self.c.map, at))
+        fields[0] += 1
+        self.c.slot.pack_into(self.c.map, at, *fields)
+        self.assertTrue(self.c._find(self.files['a.html'], key) is None, "Read a slot being written")
+
+if __name__ == '__main__':
+    unittest.main()
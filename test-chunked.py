@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import collections
+import errno
+import http
+import server
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+def decode_chunked(data):
+    '''Returns the body of a chunked message body and what follows it'''
+    body = []
+    while True:
+        line, data = data.split('\r\n', 1)
+        size = int(line, 16)
+        if size == 0:
+            assert data.startswith('\r\n'), "No CRLF after the last-chunk"
+            return ''.join(body), data[2:]
+        body.append(data[:size])
+        assert data[size:size + 2] == '\r\n', "Chunk not followed by CRLF"
+        data = data[size + 2:]
+
+def read_all(sock):
+    data = []
+    chunk = sock.recv(65536)
+    while chunk:
+        data.append(chunk)
+        chunk = sock.recv(65536)
+    return ''.join(data)
+
+class Producer():
+    '''A generator of count chunks of size bytes that records how many it
+    has produced and whether it was closed'''
+
+    def __init__(self, count, size=64 * 1024):
+        self.count = count
+        self.size = size
+        self.produced = 0
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for i in range(self.count):
+                self.produced += 1
+                yield chr(ord('a') + i % 26) * self.size
+        finally:
+            self.closed = True
+
+    def body(self):
+        return ''.join(chr(ord('a') + i % 26) * self.size for i in range(self.count))
+
+class TestChunkedBody(unittest.TestCase):
+    def test_header_without_length(self):
+        header = http.HTTPHeader('HTTP/1.1', '200', 'text/plain', None)
+        self.assertTrue('Content-Length' not in header.get_string(), "Content-Length sent")
+        header.set_length(5)
+        header.set_chunked()
+        self.assertTrue('Content-Length' not in header.get_string(), "Content-Length kept")
+        self.assertTrue('Transfer-Encoding: chunked\r\n' in header.get_string(), "Not chunked")
+
+    def test_framing(self):
+        body = http.ChunkedBody(iter(['hello', '', u'w\xf6rld']))
+        self.assertTrue(body.read() == '5\r\nhello\r\n6\r\nw\xc3\xb6rld\r\n0\r\n\r\n', "Bad framing")
+
+    def test_unframed(self):
+        self.assertTrue(http.ChunkedBody(['a', 'b'], framed=False).read() == 'ab', "Body framed")
+
+    def test_empty(self):
+        self.assertTrue(http.ChunkedBody([]).read() == '0\r\n\r\n', "No last-chunk")
+
+    def test_large_stream(self):
+        producer = Producer(300)
+        a, b = socket.socketpair()
+        parts = http.HTTPMessage('HTTP/1.1', '200', None, chunks=producer).get_parts()
+        sender = threading.Thread(target=lambda: (http.send_parts(a, parts), a.close()))
+        sender.start()
+        try:
+            data = read_all(b)
+        finally:
+            sender.join()
+            b.close()
+        head, chunked = data.split('\r\n\r\n', 1)
+        body, rest = decode_chunked(chunked)
+        self.assertTrue(body == producer.body() and rest == '', "Streamed body corrupted")
+        self.assertTrue(producer.closed, "Generator not finished")
+
+    def test_backpressure(self):
+        '''Chunks are only produced as fast as the client reads them'''
+        producer = Producer(1000, 16 * 1024)
+        a, b = socket.socketpair()
+        a.setblocking(0)
+        try:
+            parts = collections.deque([http.ChunkedBody(producer)])
+            try:
+                while parts:
+                    http.send_some(a, parts)
+            except socket.error as e:
+                self.assertTrue(e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK), "Unexpected error")
+            written = parts[0].sent
+            self.assertTrue(producer.produced < 1000, "Producer ran ahead of the socket")
+            self.assertTrue(producer.produced <= written // producer.size + 2,
+                "More than one chunk held back: %d produced, %d bytes sent" %(producer.produced, written))
+        finally:
+            a.close()
+            b.close()
+
+    def test_early_disconnect(self):
+        '''A client going away stops the producer and closes it'''
+        producer = Producer(1000)
+        a, b = socket.socketpair()
+        b.close()
+        self.assertRaises(socket.error, http.send_parts, a, [http.ChunkedBody(producer)])
+        a.close()
+        self.assertTrue(producer.closed, "Generator not closed")
+        self.assertTrue(producer.produced < 1000, "Generator ran to the end")
+
+def streaming_respond(respond):
+    '''Wrap RequestHandler.respond to stream /stream from the producer on
+    the class of the server'''
+    def wrapper(self, request):
+        if request.path == '/stream':
+            self.close_connection = not self._keep_alive(True, request)
+            connection = 'close' if self.close_connection else 'keep-alive'
+            producer = self.server.producer = Producer(self.server.chunks)
+            return self._respond_chunks(request, '200', producer, 'text/plain', connection)
+        return respond(self, request)
+    return wrapper
+
+class TestStreamingServer(unittest.TestCase):
+    server_class = server.ThreadedPyServer
+    port = 8123
+
+    @classmethod
+    def setUpClass(self):
+        self.respond = server.RequestHandler.respond
+        server.RequestHandler.respond = streaming_respond(self.respond)
+        self.httpd = self.server_class(HOST, self.port)
+        self.httpd.chunks = 160 # 10 MiB
+        self.thread = threading.Thread(target=self.httpd.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.3)
+
+    @classmethod
+    def tearDownClass(self):
+        self.httpd.stop()
+        self.thread.join(3)
+        server.RequestHandler.respond = self.respond
+
+    def request(self, sock, protocol='HTTP/1.1'):
+        sock.sendall('GET /stream %s\r\nHost: %s\r\n\r\n' %(protocol, HOST))
+
+    def test_large_stream_then_keep_alive(self):
+        sock = socket.create_connection((HOST, self.port), 5)
+        try:
+            self.request(sock)
+            reader = sock.makefile('rb')
+            head = []
+            while not head or head[-1] != '\r\n':
+                head.append(reader.readline())
+            self.assertTrue('Transfer-Encoding: chunked\r\n' in head, "Not chunked")
+            self.assertTrue(not any(line.startswith('Content-Length') for line in head), "Has a length")
+            body = []
+            while True:
+                size = int(reader.readline(), 16)
+                if size == 0:
+                    reader.readline()
+                    break
+                body.append(reader.read(size))
+                reader.readline()
+            self.assertTrue(''.join(body) == Producer(self.httpd.chunks).body(), "Body corrupted")
+
+            sock.sendall('GET /base.css HTTP/1.1\r\nHost: %s\r\n\r\n' % HOST)
+            self.assertTrue(reader.readline() == 'HTTP/1.1 200 OK\r\n', "Connection not reusable")
+        finally:
+            sock.close()
+
+    def test_http10_stream(self):
+        sock = socket.create_connection((HOST, self.port), 5)
+        try:
+            self.request(sock, 'HTTP/1.0')
+            head, body = read_all(sock).split('\r\n\r\n', 1)
+        finally:
+            sock.close()
+        self.assertTrue('Transfer-Encoding' not in head, "HTTP/1.0 sent chunks")
+        self.assertTrue('Connection: close' in head, "Body end not marked by closing")
+        self.assertTrue(body == Producer(self.httpd.chunks).body(), "Body corrupted")
+
+    def test_early_disconnect(self):
+        sock = socket.create_connection((HOST, self.port), 5)
+        self.request(sock)
+        sock.recv(65536)
+        sock.close()
+        deadline = time.time() + 5
+        while not self.httpd.producer.closed and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(self.httpd.producer.closed, "Producer not closed")
+        self.assertTrue(self.httpd.producer.produced < self.httpd.chunks, "Producer ran to the end")
+
+class TestStreamingEventLoop(TestStreamingServer):
+    server_class = server.EventPyServer
+    port = 8124
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import cache
+import http
+import server
+import os
+import socket
+import threading
+import time
+import zlib
+
+HOST = "127.0.0.1"
+PORT = 8093
+
+BODY = 'body { color: black; }\n' * 200
+
+def fake_stat(size):
+    '''A stat result for a regular file of size bytes'''
+    return os.stat_result((0o100644, 1, 0, 1, 0, 0, size, 1000, 1000, 1000))
+
+class TestNegotiation(unittest.TestCase):
+    def test_acceptable_encodings(self):
+        available = ['br', 'gzip']
+        self.assertTrue(http.acceptable_encodings('gzip', available) == ['gzip'], 'Only gzip accepted')
+        self.assertTrue(http.acceptable_encodings('gzip, br', available) == ['br', 'gzip'], 'Ties keep server order')
+        self.assertTrue(http.acceptable_encodings('br;q=0.5, gzip', available) == ['gzip', 'br'], 'Higher q first')
+        self.assertTrue(http.acceptable_encodings('*, gzip;q=0', available) == ['br'], 'q=0 refuses a coding')
+        self.assertTrue(http.acceptable_encodings('identity', available) == [], 'Nothing acceptable')
+
+    def test_variant_cache(self):
+        source = cache.CacheEntry(BODY, 'text/css', fake_stat(len(BODY)))
+        variants = cache.VariantCache()
+        entry = variants.get('/x.css', 'gzip', source)
+        self.assertTrue(zlib.decompress(entry.body, 16 + zlib.MAX_WBITS) == BODY, 'Bad gzip body')
+        self.assertTrue(entry.etag != source.etag, 'Variant needs its own ETag')
+        self.assertTrue(variants.get('/x.css', 'gzip', source) is entry, 'Variant not cached')
+        self.assertTrue(variants.hits == 1 and variants.misses == 1, 'Bad counters')
+
+        small = cache.CacheEntry('tiny', 'text/css', fake_stat(4))
+        self.assertTrue(variants.get('/y.css', 'gzip', small) is None, 'Tiny files not worth compressing')
+
+def fetch(path, headers=''):
+    '''Request path and return the (status line, headers, body)'''
+    sock = socket.create_connection((HOST, PORT), 3)
+    try:
+        sock.sendall('GET %s HTTP/1.1\r\nConnection: close\r\n%s\r\n' %(path, headers))
+        response = sock.makefile('rb').read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    return lines[0], dict(line.split(': ', 1) for line in lines[1:]), body
+
+# The precompressed file is touched during the tests, which the docroot index
+# would only notice on its next walk
+class UnindexedServer(server.ThreadedPyServer):
+    index_interval = None
+
+class TestCompression(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        www = os.path.join(os.getcwd(), 'www')
+        self.files = [os.path.join(www, name) for name in
+            ('testcomp.css', 'testpre.css', 'testpre.css.gz')]
+        with open(self.files[0], 'w') as fp:
+            fp.write(BODY)
+        with open(self.files[1], 'w') as fp:
+            fp.write(BODY)
+        with open(self.files[2], 'wb') as fp:
+            fp.write(cache.gzip_compress('precompressed'))
+
+        thread = threading.Thread(target=UnindexedServer(HOST, PORT).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    def test_gzip(self):
+        status, fields, body = fetch('/testcomp.css', 'Accept-Encoding: gzip, deflate\r\n')
+        self.assertTrue(status == 'HTTP/1.1 200 OK', 'Bad status %s' % status)
+        self.assertTrue(fields['Content-Encoding'] == 'gzip', 'Response not compressed')
+        self.assertTrue(fields['Vary'] == 'Accept-Encoding', 'Missing Vary')
+        self.assertTrue(int(fields['Content-Length']) == len(body) < len(BODY), 'Bad Content-Length')
+        self.assertTrue(zlib.decompress(body, 16 + zlib.MAX_WBITS) == BODY, 'Bad gzip body')
+
+    def test_identity(self):
+        status, fields, body = fetch('/testcomp.css')
+        self.assertTrue(body == BODY, 'Uncompressed body expected')
+        self.assertTrue('Content-Encoding' not in fields, 'Coding sent without Accept-Encoding')
+        self.assertTrue(fields['Vary'] == 'Accept-Encoding', 'Vary needed for caches')
+
+        status, fields, body = fetch('/testcomp.css', 'Accept-Encoding: gzip;q=0\r\n')
+        self.assertTrue('Content-Encoding' not in fields, 'q=0 must refuse gzip')
+
+    def test_variant_etag(self):
+        plain = fetch('/testcomp.css')[1]['ETag']
+        etag = fetch('/testcomp.css', 'Accept-Encoding: gzip\r\n')[1]['ETag']
+        self.assertTrue(plain != etag, 'Compressed response needs its own ETag')
+
+        status, fields, body = fetch('/testcomp.css',
+            'Accept-Encoding: gzip\r\nIf-None-Match: %s\r\n' % etag)
+        self.assertTrue(status == 'HTTP/1.1 304 Not Modified', 'Variant ETag should revalidate')
+        self.assertTrue(fields['Vary'] == 'Accept-Encoding', '304 should repeat Vary')
+
+    def test_precompressed(self):
+        status, fields, body = fetch('/testpre.css', 'Accept-Encoding: gzip\r\n')
+        self.assertTrue(fields['Content-Encoding'] == 'gzip', 'Sibling not used')
+        self.assertTrue(zlib.decompress(body, 16 + zlib.MAX_WBITS) == 'precompressed', 'Sibling body not sent')
+
+    def test_stale_precompressed(self):
+        os.utime(self.files[2], (1000000000, 1000000000))
+        try:
+            status, fields, body = fetch('/testpre.css', 'Accept-Encoding: gzip\r\n')
+            self.assertTrue(zlib.decompress(body, 16 + zlib.MAX_WBITS) == BODY, 'Stale sibling sent')
+        finally:
+            os.utime(self.files[2], None)
+
+    @classmethod
+    def tearDownClass(self):
+        for fp in self.files:
+            os.remove(fp)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import http
+import server
+import os
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+class TestValidators(unittest.TestCase):
+    def test_etag_matches(self):
+        self.assertTrue(http.etag_matches('"a", "b"', '"b"'), 'ETag in list should match')
+        self.assertTrue(http.etag_matches('W/"a"', '"a"'), 'Weak comparison should ignore W/')
+        self.assertTrue(http.etag_matches('*', '"a"'), '* should match any ETag')
+        self.assertFalse(http.etag_matches('"a"', '"b"'), 'Different ETags should not match')
+
+    def test_http_date(self):
+        date = http.http_date(784111777)
+        self.assertTrue(date == 'Sun, 06 Nov 1994 08:49:37 GMT', 'Bad HTTP-date %s' % date)
+        self.assertTrue(http.parse_http_date(date) == 784111777, 'HTTP-date not parsed')
+        self.assertTrue(http.parse_http_date('yesterday') is None, 'Malformed date should be None')
+
+def fetch(port, headers=''):
+    '''Request the test file and return the (status line, headers, body)'''
+    sock = socket.create_connection((HOST, port), 3)
+    try:
+        sock.sendall('GET /testcond.html HTTP/1.1\r\nConnection: close\r\n%s\r\n' % headers)
+        response = sock.makefile('rb').read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    return lines[0], dict(line.split(': ', 1) for line in lines[1:]), body
+
+class ConditionalTests():
+    '''Mixed into a TestCase with a port a server is listening on'''
+
+    @classmethod
+    def setUpClass(self):
+        self.fp = os.path.join(os.getcwd(), 'www', 'testcond.html')
+        self.write('<html>one</html>', 1000000000)
+        thread = threading.Thread(target=self.server_class(HOST, self.port).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    @classmethod
+    def write(self, contents, mtime):
+        '''Replace the test file by renaming, as a deploy would'''
+        with open(self.fp + '.new', 'w') as fp:
+            fp.write(contents)
+        os.utime(self.fp + '.new', (mtime, mtime))
+        os.rename(self.fp + '.new', self.fp)
+
+    def test_validators_sent(self):
+        status, fields, body = fetch(self.port)
+        self.assertTrue(fields['ETag'].startswith('"'), 'No ETag sent')
+        self.assertTrue(fields['Last-Modified'] == http.http_date(os.stat(self.fp).st_mtime), 'Bad Last-Modified')
+
+    def test_if_none_match(self):
+        etag = fetch(self.port)[1]['ETag']
+        status, fields, body = fetch(self.port, 'If-None-Match: %s\r\n' % etag)
+        self.assertTrue(status == 'HTTP/1.1 304 Not Modified', 'Matching ETag should be a 304')
+        self.assertTrue(body == '' and 'Content-Length' not in fields, '304 must not have a body')
+        self.assertTrue(fields['ETag'] == etag, '304 should repeat the ETag')
+
+        status, fields, body = fetch(self.port, 'If-None-Match: "other"\r\n')
+        self.assertTrue(status == 'HTTP/1.1 200 OK', 'Different ETag should be a 200')
+
+    def test_if_modified_since(self):
+        last_modified = fetch(self.port)[1]['Last-Modified']
+        status, fields, body = fetch(self.port, 'If-Modified-Since: %s\r\n' % last_modified)
+        self.assertTrue(status == 'HTTP/1.1 304 Not Modified', 'Unmodified file should be a 304')
+
+        old = http.http_date(os.stat(self.fp).st_mtime - 60)
+        status, fields, body = fetch(self.port, 'If-Modified-Since: %s\r\n' % old)
+        self.assertTrue(status == 'HTTP/1.1 200 OK', 'Modified file should be a 200')
+
+    def test_if_none_match_precedence(self):
+        last_modified = fetch(self.port)[1]['Last-Modified']
+        status, fields, body = fetch(self.port,
+            'If-None-Match: "other"\r\nIf-Modified-Since: %s\r\n' % last_modified)
+        self.assertTrue(status == 'HTTP/1.1 200 OK', 'If-Modified-Since must be ignored with If-None-Match')
+
+    def test_revalidate_changed_file(self):
+        etag = fetch(self.port)[1]['ETag']
+        self.write('<html>two</html>!', 2000000000)
+        try:
+            status, fields, body = fetch(self.port, 'If-None-Match: %s\r\n' % etag)
+            self.assertTrue(status == 'HTTP/1.1 200 OK' and body == '<html>two</html>!', 'Changed file not sent')
+            self.assertTrue(fields['ETag'] != etag, 'ETag did not change with the file')
+        finally:
+            self.write('<html>one</html>', 1000000000)
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.fp)
+
+# The test file is replaced during the tests, which the docroot index would
+# only notice on its next walk
+class CachedServer(server.ThreadedPyServer):
+    index_interval = None
+
+class MappedServer(CachedServer):
+    use_mmap = True
+
+class DiskServer(CachedServer):
+    cache_size = 0
+
+class HashServer(CachedServer):
+    etag_hash = True
+
+class TestCachedConditional(ConditionalTests, unittest.TestCase):
+    port = 8089
+    server_class = CachedServer
+
+class TestMappedConditional(ConditionalTests, unittest.TestCase):
+    port = 8090
+    server_class = MappedServer
+
+class TestDiskConditional(ConditionalTests, unittest.TestCase):
+    port = 8091
+    server_class = DiskServer
+
+class TestHashConditional(ConditionalTests, unittest.TestCase):
+    port = 8092
+    server_class = HashServer
+
+if __name__ == '__main__':
+    unittest.main()
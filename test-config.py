@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import StringIO
+import config
+import os
+import server
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+def start(httpd):
+    thread = threading.Thread(target=httpd.serve)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.3)
+    return thread
+
+def stop(httpd, thread):
+    '''Stop a server started with start() and wait for it to finish'''
+    httpd.stop()
+    thread.join(3)
+
+def get(address, path, family=socket.AF_INET, sock=None):
+    '''Returns the status line of GET path, on sock if given'''
+    if sock is None:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(3)
+        sock.connect(address)
+    sock.sendall('GET %s HTTP/1.1\r\n\r\n' % path)
+    rfile = sock.makefile('rb', 0)
+    status = rfile.readline()
+    length = 0
+    line = rfile.readline()
+    while line.strip():
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':')[1])
+        line = rfile.readline()
+    rfile.read(length)
+    return status.strip()
+
+def has_ipv6():
+    try:
+        probe = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        probe.bind(('::1', 0))
+        probe.close()
+        return True
+    except socket.error:
+        return False
+
+class TestAddress(unittest.TestCase):
+    def test_parse(self):
+        self.assertTrue(config.parse_address('127.0.0.1:8080') == ('127.0.0.1', 8080))
+        self.assertTrue(config.parse_address('localhost:80') == ('localhost', 80))
+        self.assertTrue(config.parse_address('[::1]:8080') == ('::1', 8080))
+        self.assertTrue(config.parse_address(':8080') == ('', 8080))
+
+    def test_invalid(self):
+        for value in ('8080', '127.0.0.1', '::1:8080', 'localhost:99999', 'a b:80'):
+            self.assertRaises(ValueError, config.parse_address, value)
+
+    def test_format(self):
+        self.assertTrue(config.format_address(('::1', 8080, 0, 0)) == '[::1]:8080')
+        self.assertTrue(config.format_address(('127.0.0.1', 8080)) == '127.0.0.1:8080')
+
+class TestConfigFile(unittest.TestCase):
+    def setUp(self):
+        handle, self.fp = tempfile.mkstemp(suffix='.ini')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.fp)
+
+    def parse(self, settings, *argv):
+        with open(self.fp, 'w') as f:
+            f.write('[server]\n' + settings)
+        return config.parse_args(server.build_parser(), ['--config', self.fp] + list(argv))
+
+    def test_settings(self):
+        args = self.parse('workers = 4\nreuse-port = yes\nlisten = 127.0.0.1:81 [::1]:81\n'
+            'mime_type = .mjs=text/javascript\n')
+        self.assertTrue(args.workers == 4 and args.reuse_port)
+        self.assertTrue(args.listen == [('127.0.0.1', 81), ('::1', 81)], args.listen)
+        self.assertTrue(args.mime_type == [('mjs', 'text/javascript')])
+
+    def test_flags_take_precedence(self):
+        args = self.parse('workers = 4\nbacklog = 64\n', '--workers', '2')
+        self.assertTrue(args.workers == 2 and args.backlog == 64)
+
+    def test_invalid(self):
+        stderr, sys.stderr = sys.stderr, StringIO.StringIO() # Quiet the usage errors
+        try:
+            for settings in ('no-such-setting = 1\n', 'workers = many\n', 'mmap = maybe\n',
+                    'access-log-format = xml\n'):
+                self.assertRaises(SystemExit, self.parse, settings)
+        finally:
+            sys.stderr = stderr
+
+    def test_configure(self):
+        args = self.parse('docroot = /srv/www\nno-tcp-nodelay = yes\nthreads = 4\n')
+        class Configured(server.PyServer):
+            pass
+        server.configure(Configured, args)
+        self.assertTrue(Configured.docroot == '/srv/www')
+        self.assertFalse(Configured.tcp_nodelay)
+        self.assertTrue(Configured.keep_alive, "Thread pools keep connections alive")
+        self.assertFalse(server.PyServer.docroot, "Configured the wrong class")
+
+class TestListeners(unittest.TestCase):
+    def test_several_addresses(self):
+        second = ('::1', 8102) if has_ipv6() else (HOST, 8103)
+        class TwoAddressServer(server.ThreadedPyServer):
+            also_listen = (second,)
+        httpd = TwoAddressServer(HOST, 8102)
+        thread = start(httpd)
+        try:
+            self.assertTrue(get((HOST, 8102), '/') == 'HTTP/1.1 200 OK')
+            family = socket.AF_INET6 if ':' in second[0] else socket.AF_INET
+            self.assertTrue(get(second, '/', family) == 'HTTP/1.1 200 OK', "Second address not served")
+        finally:
+            stop(httpd, thread)
+
+    def test_no_delayed_ack_stall(self):
+        '''Responses on a persistent connection do not wait ~40ms each for
+        the client to ACK the previous segment'''
+        httpd = server.ThreadedPyServer(HOST, 8104)
+        thread = start(httpd)
+        sock = socket.create_connection((HOST, 8104), 3)
+        try:
+            get(None, '/base.css', sock=sock)
+            began = time.time()
+            for i in range(10):
+                get(None, '/base.css', sock=sock)
+            elapsed = time.time() - began
+        finally:
+            sock.close()
+            stop(httpd, thread)
+        self.assertTrue(elapsed < 0.2, "10 requests took %.3fs" % elapsed)
+
+    def test_docroot(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'hello.txt'), 'w') as f:
+                f.write('hello')
+            class RootedServer(server.PyServer):
+                docroot = root
+            httpd = RootedServer(HOST, 8105)
+            thread = start(httpd)
+            try:
+                self.assertTrue(get((HOST, 8105), '/hello.txt') == 'HTTP/1.1 200 OK')
+                self.assertTrue(get((HOST, 8105), '/base.css') == 'HTTP/1.1 404 Not Found')
+            finally:
+                stop(httpd, thread)
+        finally:
+            shutil.rmtree(root)
+
+if __name__ == '__main__':
+    unittest.main()
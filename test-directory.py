@@ -17,8 +17,11 @@
 #
 
 import unittest
+import cache
 import server
 import os
+import threading
+import time
 
 class TestDirectory(unittest.TestCase):
     @classmethod
@@ -66,6 +69,122 @@ class TestDirectory(unittest.TestCase):
     def test_get_file(self):
         self.assertTrue(self.d.get_file('testdir/hello.html') == "<HTML></HTML>", "Did not return the correct file")
 
+    def test_get_mapped(self):
+        d = server.ServerDirectory(self.testroot, use_mmap=True)
+        mapped = d.get_mapped(self.filename)
+        self.assertTrue(mapped.data[:] == "<HTML></HTML>", "Mapped contents do not match the file")
+        self.assertTrue(d.get_mapped(self.filename) is mapped, "Unchanged file should share its mapping")
+        self.assertTrue(mapped.refs == 2, "Mapping not reference counted")
+        mapped.release()
+        mapped.release()
+
+    def test_remap_changed_file(self):
+        d = server.ServerDirectory(self.testroot, use_mmap=True)
+        old = d.get_mapped(self.subfilename)
+
+        # Replace the file by renaming, as a deploy would
+        with open(self.subfilename + '.new', 'w') as fp:
+            fp.write("<HTML><BODY></BODY></HTML>")
+        os.rename(self.subfilename + '.new', self.subfilename)
+
+        new = d.get_mapped(self.subfilename)
+        self.assertTrue(new is not old and len(new) == 26, "Changed file was not mapped again")
+        self.assertTrue(old.data[:] == "<HTML></HTML>", "Retired mapping unmapped while in use")
+        old.release()
+        self.assertTrue(old.data == '', "Retired mapping not unmapped after release")
+        new.release()
+
+    def test_mapped_not_file(self):
+        d = server.ServerDirectory(self.testroot, use_mmap=True)
+        self.assertTrue(d.get_mapped(self.testsubdir) is None, "Directories cannot be mapped")
+        self.assertTrue(self.d.get_mapped(self.filename) is None, "mmap disabled by default")
+
+    def test_index(self):
+        d = server.ServerDirectory(self.testroot, index_interval=60)
+        entry = d.get_entry(self.filename)
+        self.assertTrue(entry.size == 13 and entry.ctype == 'text/html', "Index entry does not match the file")
+        self.assertTrue(d.exists(self.filename) and d.get_fsize(self.filename) == 13, "Indexed file not found")
+        self.assertFalse(d.exists(self.testsubdir), "Directories are not files")
+        self.assertTrue(d.get_redirect(self.testsubdir) == '/subdir/index.html', "Bad directory redirect")
+        self.assertTrue(d.get_redirect(self.testroot + '/') == '/index.html', "Bad root redirect")
+        self.assertTrue(d.get_redirect(self.filename) is None, "Files are not redirected")
+
+    def test_index_traversal(self):
+        d = server.ServerDirectory(self.testroot, index_interval=60)
+        traversed = d.build_abspath('../testdir/../../' + os.path.basename(__file__))
+        self.assertFalse(d.exists(traversed), "Files outside the root must not be found")
+        self.assertTrue(d.get_entry(os.path.abspath(__file__)) is None, "Only files under the root are indexed")
+
+    def test_index_rescan(self):
+        d = server.ServerDirectory(self.testroot, index_interval=60)
+        added = os.path.join(self.testroot, 'added.html')
+        with open(added, 'w') as fp:
+            fp.write("<HTML>")
+        try:
+            self.assertFalse(d.exists(added), "Index walked again before its interval")
+            walkers = []
+            rescan = d.index.rescan
+            d.index.rescan = lambda: (walkers.append(threading.current_thread()), rescan())
+            d.index.scanned -= 60
+            d.exists(added)
+            time.sleep(0.5)
+            self.assertTrue(walkers and threading.current_thread() not in walkers,
+                "Lookup walked the docroot itself")
+            self.assertTrue(d.exists(added), "New file not found once the interval passed")
+        finally:
+            os.remove(added)
+        d.index.rescan()
+        self.assertFalse(d.exists(added), "Removed file still indexed")
+
+    def test_index_stale_entry(self):
+        '''A file rewritten since the walk is sent whole, framed by its new size'''
+        d = server.ServerDirectory(self.testroot, index_interval=60)
+        changed = os.path.join(self.testroot, 'changed.txt')
+        with open(changed, 'w') as fp:
+            fp.write("old")
+        d.index.rescan()
+        try:
+            with open(changed, 'w') as fp:
+                fp.write("a longer new body")
+            st = d.get_entry(changed).st
+            files = cache.FileCache(d)
+            entry = files.get(changed, st)
+            self.assertTrue(entry.size == len(entry.body) == 17, "Cached size not that of the body read")
+            disk = cache.DiskFile(changed, st)
+            self.assertTrue(len(disk.get_part().read()) == disk.size == 3, "Disk body longer than its framed size")
+            d.update_entry(changed)
+            self.assertTrue(d.get_fsize(changed) == 17, "Stale index entry not updated")
+        finally:
+            os.remove(changed)
+
+    def test_has_index(self):
+        index = os.path.join(self.testsubdir, 'index.html')
+        self.assertFalse(self.d.has_index(self.testsubdir), "Directory has no index.html")
+        with open(index, 'w') as fp:
+            fp.write("<HTML></HTML>")
+        try:
+            self.assertTrue(self.d.has_index(self.testsubdir), "index.html not found")
+        finally:
+            os.remove(index)
+
+    def test_autoindex_redirect(self):
+        '''Directories without an index.html redirect to themselves to be listed'''
+        for interval in (None, 60):
+            d = server.ServerDirectory(self.testroot, index_interval=interval, autoindex=True)
+            self.assertTrue(d.get_redirect(self.testsubdir) == '/subdir/', "Not redirected to the listing")
+            self.assertTrue(d.get_redirect(self.testroot + '/') == '/', "Bad root redirect")
+
+    def test_scandir(self):
+        link = os.path.join(self.testroot, 'link')
+        os.symlink(self.testsubdir, link)
+        try:
+            found = sorted(cache.scandir(self.testroot))
+            self.assertTrue(found == [('hello.html', False), ('link', True), ('subdir', True)],
+                "Bad listing %r" % found)
+        finally:
+            os.remove(link)
+        self.assertRaises(OSError, cache.scandir, self.filename)
+
     @classmethod
     def tearDownClass(self):
         '''Remove test directory and file'''
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import cache
+import docpack
+import server
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import zlib
+
+HOST = "127.0.0.1"
+PORT = 8122
+
+CSS = 'body { color: black; }\n' * 200
+
+class TestDocPack(unittest.TestCase):
+    def setUp(self):
+        '''Pack a small docroot'''
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'deep'))
+        self.files = {'/index.html':'<html></html>', '/base.css':CSS,
+            '/deep/index.html':'deep', '/deep/empty.txt':''}
+        for path, contents in self.files.items():
+            with open(self.root + path, 'w') as fp:
+                fp.write(contents)
+        self.target = os.path.join(self.root, 'www.pack')
+        docpack.build(self.root, self.target, compress=True)
+        self.pack = docpack.DocPack(self.target)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_files(self):
+        for path, contents in self.files.items():
+            packed = self.pack.get(path)
+            self.assertTrue(packed.size == len(contents), "Bad size of %s" % path)
+            self.assertTrue(packed.get_part().read() == contents, "Bad body of %s" % path)
+        self.assertTrue(self.pack.get('/base.css').ctype == 'text/css; charset=utf-8',
+            "Content type not packed")
+        self.assertTrue(self.pack.get('/base.css').etag == cache.content_etag(CSS), "ETag not packed")
+
+    def test_sorted_index(self):
+        paths = self.pack.paths()
+        self.assertTrue(paths == sorted(paths), "Index not sorted")
+        self.assertTrue('/' in paths and '/deep' in paths, "Directories not packed")
+
+    def test_page_aligned(self):
+        for path in self.files:
+            if self.files[path]:
+                self.assertTrue(self.pack.get(path).offset % docpack.ALIGN == 0,
+                    "%s not on a page boundary" % path)
+
+    def test_missing(self):
+        for path in ('/missing', '/deep/', '/deep', '/base', '/zzz', ''):
+            self.assertTrue(self.pack.get(path) is None, "%s should not be a file" % path)
+        self.assertTrue(self.pack.is_directory('/deep'), "Directory not found")
+        self.assertTrue(not self.pack.is_directory('/base.css'), "File taken for a directory")
+
+    def test_compressed(self):
+        packed = self.pack.get('/base.css.gz')
+        self.assertTrue(zlib.decompress(packed.get_part().read(), 16 + zlib.MAX_WBITS) == CSS,
+            "Bad compressed copy")
+        self.assertTrue(packed.mtime == self.pack.get('/base.css').mtime, "Copy older than the file")
+        self.assertTrue(self.pack.get('/index.html.gz') is None, "Copy larger than the file packed")
+
+    def test_count(self):
+        '''Copies not worth compressing are left out of the count too'''
+        count = docpack.build(self.root, self.target, compress=True)
+        self.assertTrue(count == len(docpack.DocPack(self.target)), "Entries miscounted")
+
+    def test_replace(self):
+        '''A pack rebuilt over an open one leaves the open one readable'''
+        with open(self.root + '/base.css', 'w') as fp:
+            fp.write('new')
+        docpack.build(self.root, self.target)
+        self.assertTrue(self.pack.get('/base.css').get_part().read() == CSS, "Open pack changed")
+        self.assertTrue(docpack.DocPack(self.target).get('/base.css').size == 3, "Pack not replaced")
+
+    def test_not_a_pack(self):
+        self.assertRaises(ValueError, docpack.DocPack, self.root + '/base.css')
+
+    def test_directory(self):
+        directory = server.ServerDirectory(self.root, pack=self.target)
+        self.assertTrue(directory.index is None, "Docroot walked with a pack")
+        self.assertTrue(directory.exists(self.root + '/base.css'), "Packed file not found")
+        self.assertTrue(directory.get_fsize(self.root + '/base.css') == len(CSS), "Bad size")
+        self.assertTrue(not directory.exists(self.root + '/deep'), "Directory taken for a file")
+        self.assertTrue(directory.get_redirect(self.root + '/deep') == '/deep/index.html', "Bad redirect")
+        self.assertTrue(directory.get_redirect(self.root + '/') == '/index.html', "Bad root redirect")
+        self.assertTrue(directory.get_redirect(self.root + '/base.css') is None, "File redirected")
+
+def fetch(path, headers=''):
+    '''Request path and return the (status line, headers, body)'''
+    sock = socket.create_connection((HOST, PORT), 3)
+    try:
+        sock.sendall('GET %s HTTP/1.1\r\nConnection: close\r\n%s\r\n' %(path, headers))
+        response = sock.makefile('rb').read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    return lines[0], dict(line.split(': ', 1) for line in lines[1:]), body
+
+class TestPackedServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.target = os.path.join(tempfile.mkdtemp(), 'www.pack')
+        docpack.build(os.path.join(os.getcwd(), 'www'), self.target, compress=True)
+        class PackedServer(server.ThreadedPyServer):
+            pack = self.target
+        self.httpd = PackedServer(HOST, PORT)
+        self.thread = threading.Thread(target=self.httpd.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.3)
+
+    @classmethod
+    def tearDownClass(self):
+        self.httpd.stop()
+        self.thread.join(3)
+        shutil.rmtree(os.path.dirname(self.target))
+
+    def test_file(self):
+        with open(os.path.join('www', 'base.css')) as fp:
+            expected = fp.read()
+        status, fields, body = fetch('/base.css')
+        self.assertTrue(status == 'HTTP/1.1 200 OK', "Bad status %s" % status)
+        self.assertTrue(body == expected and int(fields['Content-Length']) == len(body), "Bad body")
+
+    def test_range(self):
+        status, fields, body = fetch('/index.html', 'Range: bytes=0-4\r\n')
+        self.assertTrue(status == 'HTTP/1.1 206 Partial Content' and body == '<!DOC', "Bad range")
+
+    def test_precompressed(self):
+        status, fields, body = fetch('/index.html', 'Accept-Encoding: gzip\r\n')
+        self.assertTrue(fields.get('Content-Encoding') == 'gzip', "Packed copy not sent")
+        with open(os.path.join('www', 'index.html')) as fp:
+            self.assertTrue(zlib.decompress(body, 16 + zlib.MAX_WBITS) == fp.read(), "Bad body")
+
+    def test_redirect_and_missing(self):
+        self.assertTrue(fetch('/deep')[1]['Location'].endswith('/deep/index.html'), "Not redirected")
+        self.assertTrue(fetch('/nothere.html')[0] == 'HTTP/1.1 404 Not Found', "Missing file found")
+
+if __name__ == '__main__':
+    unittest.main()
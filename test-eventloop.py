@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import os
+import resource
+import server
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib2
+
+HOST, PORT = "127.0.0.1", 8081
+BASEURL = "http://%s:%d" %(HOST, PORT)
+
+class TestEventLoop(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        '''Run an EventPyServer in the background for all tests'''
+        self.thread = threading.Thread(target=server.EventPyServer(HOST, PORT).serve)
+        self.thread.daemon = True
+        self.thread.start()
+        time.sleep(0.5)
+
+    def test_get_index(self):
+        req = urllib2.urlopen(BASEURL + "/index.html", None, 3)
+        self.assertTrue(req.getcode() == 200, "200 OK Not FOUND!")
+        self.assertTrue(req.info().gettype() == "text/html", "Bad mimetype for html!")
+
+    def test_get_404(self):
+        try:
+            urllib2.urlopen(BASEURL + "/not-found", None, 3)
+            self.assertTrue(False, "Should have thrown an HTTP Error!")
+        except urllib2.HTTPError as e:
+            self.assertTrue(e.getcode() == 404, "404 Not FOUND! %d" % e.getcode())
+
+    def test_idle_clients_do_not_block(self):
+        '''Connections that never send a request must not stall other clients'''
+        idle = [socket.create_connection((HOST, PORT)) for i in range(50)]
+        try:
+            req = urllib2.urlopen(BASEURL + "/", None, 3)
+            self.assertTrue(req.getcode() == 200, "Idle clients blocked the server")
+        finally:
+            for sock in idle:
+                sock.close()
+
+    def test_split_request(self):
+        '''A request arriving in several packets is answered once complete'''
+        sock = socket.create_connection((HOST, PORT))
+        try:
+            sock.sendall('GET /base.css HT')
+            time.sleep(0.1)
+            sock.sendall('TP/1.1\r\nHost: localhost\r\n\r\n')
+            response = sock.makefile().read()
+        finally:
+            sock.close()
+        self.assertTrue(response.startswith('HTTP/1.1 200 OK'), "Split request was not served")
+
+def cpu_seconds(pid):
+    '''Returns the CPU time a process has used so far, from /proc'''
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+class OutOfDescriptorsTests():
+    '''Mixed into a TestCase with the flags of a serving mode and a free port'''
+
+    def start(self):
+        def limit(): # Hard limit too, so the server cannot raise it
+            resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen([sys.executable, 'server.py',
+                '--listen', '%s:%d' %(HOST, self.port)] + self.flags,
+                preexec_fn=limit, stdout=devnull)
+        for i in range(50):
+            try:
+                socket.create_connection((HOST, self.port)).close()
+                return
+            except socket.error:
+                time.sleep(0.1)
+
+    def test_no_spin(self):
+        '''Out of file descriptors, the server stops polling its listening
+        socket rather than spinning on it, and accepts again as soon as
+        connections close'''
+        self.start()
+        clients = []
+        try:
+            clients = [socket.create_connection((HOST, self.port), 3) for i in range(80)]
+            time.sleep(0.5)
+            before = cpu_seconds(self.process.pid)
+            time.sleep(1)
+            used = cpu_seconds(self.process.pid) - before
+            self.assertTrue(used < 0.2, "Used %.2fs of CPU out of descriptors" % used)
+
+            for sock in clients:
+                sock.close()
+            clients = []
+            req = urllib2.urlopen('http://%s:%d/' %(HOST, self.port), None, 3)
+            self.assertTrue(req.getcode() == 200, "Not accepting once descriptors were freed")
+        finally:
+            for sock in clients:
+                sock.close()
+            self.process.kill()
+            self.process.wait()
+
+class TestEventLoopOutOfDescriptors(OutOfDescriptorsTests, unittest.TestCase):
+    flags = ['--event-loop']
+    port = 8126
+
+class TestThreadPoolOutOfDescriptors(OutOfDescriptorsTests, unittest.TestCase):
+    flags = ['--threads', '2']
+    port = 8127
+
+if __name__ == '__main__':
+    unittest.main()
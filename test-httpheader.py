@@ -86,6 +86,46 @@ class TestHTTP(unittest.TestCase):
         s = http.HTTPStatus('HTTP/1.1', '999')
         self.assertTrue(s.get_hstatus() == 'HTTP/1.1 500 Internal Server Error\r\n', 'New status line should have 500 status code')
 
+    def test_header_string(self):
+        header = http.HTTPHeader('HTTP/1.1', '200', 'text/css', 12)
+        header.set_connection('close')
+        lines = header.get_string().split('\r\n')
+        self.assertTrue(lines[0] == 'HTTP/1.1 200 OK', 'Status line must come first')
+        self.assertTrue(lines[1].startswith('Date: ') and lines[1].endswith(' GMT'), 'Date must be an HTTP-date')
+        self.assertTrue('Content-Length: 12' in lines and 'Connection: close' in lines, 'Missing header lines')
+        self.assertTrue(header.get_string().endswith('\r\n\r\n'), 'Header must end with a blank line')
+        self.assertTrue(header.get_length() == 12 and header.get_ctype() == 'text/css', 'Bad getters')
+
+    def test_lines_reused(self):
+        self.assertTrue(http.status_line('HTTP/1.1', '404') is http.status_line('HTTP/1.1', '404'), 'Status line not reused')
+        self.assertTrue(http.field_line('Vary', 'Accept-Encoding') == 'Vary: Accept-Encoding\r\n', 'Bad header line')
+
+    def test_error_pages(self):
+        errors = http.ErrorPages()
+        response = errors.get('HTTP/1.1', '404', 'keep-alive')
+        head, body = response.split('\r\n\r\n', 1)
+        self.assertTrue(head.startswith('HTTP/1.1 404 Not Found\r\nDate: '), 'Bad status or Date line')
+        self.assertTrue('Connection: keep-alive' in head, 'Connection not set')
+        self.assertTrue(body == http.HTMLErrorPage('404').get_page(), 'Body should be the built in page')
+        self.assertTrue('Content-Length: %d' % len(body) in head, 'Bad Content-Length')
+
+        response = errors.get('HTTP/1.0', '999')
+        self.assertTrue(response.startswith('HTTP/1.0 500 Internal Server Error\r\n'), 'Unknown codes should be a 500')
+
+    def test_custom_error_pages(self):
+        template_dir = os.path.join(self.root, 'testerrors')
+        os.mkdir(template_dir)
+        try:
+            with open(os.path.join(template_dir, '404.html'), 'w') as fp:
+                fp.write('<p>Nothing here</p>')
+            errors = http.ErrorPages(template_dir)
+        finally:
+            os.remove(os.path.join(template_dir, '404.html'))
+            os.rmdir(template_dir)
+
+        self.assertTrue(errors.get('HTTP/1.1', '404').endswith('\r\n\r\n<p>Nothing here</p>'), 'Custom page not sent')
+        self.assertTrue(errors.get('HTTP/1.1', '501').endswith('</html>'), 'Missing custom pages use the built in page')
+
 
     @classmethod
     def tearDownClass(self):
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import server
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+def start(server_class, port):
+    thread = threading.Thread(target=server_class(HOST, port).serve)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+def read_response(sock):
+    '''Read one response from sock, returning the (head, body) tuple'''
+    rfile = sock.makefile('rb', 0)
+    lines = []
+    line = rfile.readline()
+    while line.strip():
+        lines.append(line.strip())
+        line = rfile.readline()
+
+    length = 0
+    for line in lines:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':')[1])
+    return '\r\n'.join(lines), rfile.read(length)
+
+class KeepAliveTests():
+    '''Mixed into a TestCase with a port a server is listening on'''
+
+    def connect(self):
+        sock = socket.create_connection((HOST, self.port))
+        sock.settimeout(3)
+        return sock
+
+    def test_persistent_connection(self):
+        sock = self.connect()
+        try:
+            for path in ('/', '/base.css', '/not-found'):
+                sock.sendall('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' %path)
+                head, body = read_response(sock)
+                self.assertTrue('Connection: keep-alive' in head, "Connection was not kept alive")
+        finally:
+            sock.close()
+
+    def test_pipelined_requests(self):
+        '''Requests sent in one packet are answered in order'''
+        sock = self.connect()
+        try:
+            sock.sendall('GET /base.css HTTP/1.1\r\n\r\n'
+                         'GET /not-found HTTP/1.1\r\n\r\n'
+                         'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+            statuses = [read_response(sock)[0].splitlines()[0] for i in range(3)]
+            self.assertTrue(sock.recv(1) == '', "Connection: close was not honoured")
+        finally:
+            sock.close()
+        self.assertTrue(statuses == ['HTTP/1.1 200 OK', 'HTTP/1.1 404 Not Found', 'HTTP/1.1 200 OK'],
+            "Pipelined responses out of order: %s" % statuses)
+
+    def test_http10_closes(self):
+        sock = self.connect()
+        try:
+            sock.sendall('GET / HTTP/1.0\r\n\r\n')
+            head, body = read_response(sock)
+            self.assertTrue('Connection: close' in head, "HTTP/1.0 connection not closed")
+            self.assertTrue(sock.recv(1) == '', "HTTP/1.0 connection not closed")
+        finally:
+            sock.close()
+
+    def test_http10_keep_alive(self):
+        sock = self.connect()
+        try:
+            sock.sendall('GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n')
+            head, body = read_response(sock)
+            self.assertTrue('Connection: keep-alive' in head, "HTTP/1.0 keep-alive not honoured")
+        finally:
+            sock.close()
+
+    def test_redirect_has_length(self):
+        '''Redirects must be delimited for the connection to be reused'''
+        sock = self.connect()
+        try:
+            sock.sendall('GET /deep HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\n\r\n')
+            first = read_response(sock)[0]
+            second = read_response(sock)[0]
+        finally:
+            sock.close()
+        self.assertTrue(first.startswith('HTTP/1.1 301'), "Directory was not redirected")
+        self.assertTrue('Location: /deep/index.html' in first, "Bad redirect location")
+        self.assertTrue(second.startswith('HTTP/1.1 200'), "Request after redirect not served")
+
+class TestThreadedKeepAlive(KeepAliveTests, unittest.TestCase):
+    port = 8082
+
+    @classmethod
+    def setUpClass(self):
+        start(server.ThreadedPyServer, self.port)
+
+class TestEventKeepAlive(KeepAliveTests, unittest.TestCase):
+    port = 8083
+
+    @classmethod
+    def setUpClass(self):
+        start(server.EventPyServer, self.port)
+
+if __name__ == '__main__':
+    unittest.main()
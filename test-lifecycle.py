@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import os
+import server
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+def read_response(sock):
+    '''Read one response from sock, returning the (head, body) tuple'''
+    rfile = sock.makefile('rb', 0)
+    lines = []
+    line = rfile.readline()
+    while line.strip():
+        lines.append(line.strip())
+        line = rfile.readline()
+
+    length = 0
+    for line in lines:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':')[1])
+    return '\r\n'.join(lines), rfile.read(length)
+
+def listen(port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, port))
+    listener.listen(5)
+    return listener
+
+class DrainTests():
+    '''Mixed into a TestCase with a server_class and a free port'''
+
+    def connect(self):
+        sock = socket.create_connection((HOST, self.port))
+        sock.settimeout(3)
+        return sock
+
+    def test_drain(self):
+        '''Stopping closes idle connections but answers requests in flight'''
+        httpd = self.server_class(HOST, self.port)
+        thread = threading.Thread(target=httpd.serve)
+        thread.daemon = True
+        thread.start()
+
+        idle, busy = self.connect(), self.connect()
+        try:
+            idle.sendall('GET / HTTP/1.1\r\n\r\n')
+            read_response(idle)
+            busy.sendall('GET / HTTP/1.1\r\n')
+            time.sleep(0.2)
+
+            httpd.stop()
+            self.assertTrue(idle.recv(1) == '', "Idle connection was not closed")
+            busy.sendall('\r\n')
+            head, body = read_response(busy)
+        finally:
+            idle.close()
+            busy.close()
+
+        self.assertTrue(head.startswith('HTTP/1.1 200 OK'), "Request in flight was dropped")
+        self.assertTrue('Connection: close' in head, "Draining server kept the connection")
+        thread.join(3)
+        self.assertFalse(thread.is_alive(), "serve() did not return")
+        self.assertRaises(socket.error, self.connect)
+
+class TestThreadPoolDrain(DrainTests, unittest.TestCase):
+    server_class = server.ThreadedPyServer
+    port = 8098
+
+class TestEventLoopDrain(DrainTests, unittest.TestCase):
+    server_class = server.EventPyServer
+    port = 8099
+
+class TestReload(unittest.TestCase):
+    def test_reload_index(self):
+        '''A file added after the docroot was walked is found once reloaded'''
+        class SlowIndexServer(server.ThreadedPyServer):
+            index_interval = 600
+
+        httpd = SlowIndexServer(HOST, 8100)
+        thread = threading.Thread(target=httpd.serve)
+        thread.daemon = True
+        thread.start()
+
+        path = os.path.join('www', 'reloaded.txt')
+        try:
+            with open(path, 'w') as f:
+                f.write('reloaded')
+            self.assertTrue(self.get(8100, '/reloaded.txt').startswith('HTTP/1.1 404'),
+                "Index was walked before the reload")
+            httpd.reload()
+            self.assertTrue(self.get(8100, '/reloaded.txt').startswith('HTTP/1.1 200'),
+                "Reload did not walk the docroot")
+        finally:
+            os.remove(path)
+            httpd.stop()
+
+    def get(self, port, path):
+        sock = socket.create_connection((HOST, port))
+        sock.settimeout(3)
+        try:
+            sock.sendall('GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % path)
+            return read_response(sock)[0]
+        finally:
+            sock.close()
+
+class TestSocketActivation(unittest.TestCase):
+    def tearDown(self):
+        for name in ('LISTEN_PID', 'LISTEN_FDS'):
+            os.environ.pop(name, None)
+
+    def test_inherited_socket(self):
+        listener = listen(8101)
+        try:
+            os.environ['LISTEN_PID'] = str(os.getpid())
+            os.environ['LISTEN_FDS'] = '1'
+            inherited = server.inherited_sockets(os.dup(listener.fileno()))
+            self.assertTrue(len(inherited) == 1, "Passed socket was not found")
+            self.assertTrue(inherited[0].getsockname() == (HOST, 8101))
+            self.assertTrue('LISTEN_PID' not in os.environ, "LISTEN_PID was left for children")
+            inherited[0].close()
+        finally:
+            listener.close()
+
+    def test_other_process(self):
+        '''Sockets passed to another process (eg: our parent) are not ours'''
+        os.environ['LISTEN_PID'] = str(os.getppid())
+        os.environ['LISTEN_FDS'] = '1'
+        self.assertTrue(server.inherited_sockets() == [])
+        self.assertTrue('LISTEN_FDS' not in os.environ)
+
+    def test_activated_server(self):
+        '''server.py serves on a socket passed as fd 3 and exits on SIGTERM'''
+        listener = listen(8101)
+        def activate():
+            os.dup2(listener.fileno(), server.LISTEN_FDS_START)
+            os.environ['LISTEN_FDS'] = '1'
+            os.environ['LISTEN_PID'] = str(os.getpid())
+
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen([sys.executable, 'server.py', '--threads', '2'],
+                preexec_fn=activate, stdout=devnull)
+        listener.close()
+        try:
+            sock = socket.create_connection((HOST, 8101))
+            sock.settimeout(5)
+            sock.sendall('GET / HTTP/1.1\r\n\r\n')
+            head, body = read_response(sock)
+            self.assertTrue(head.startswith('HTTP/1.1 200 OK'), "Activated server did not answer")
+
+            process.send_signal(signal.SIGTERM)
+            self.assertTrue(sock.recv(1) == '', "Idle connection was not closed")
+            sock.close()
+            for i in range(50):
+                if process.poll() is not None:
+                    break
+                time.sleep(0.1)
+            self.assertTrue(process.poll() == 0, "Server did not stop cleanly")
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+def children(pid):
+    '''Returns the pids of the child processes of pid, from /proc'''
+    found = []
+    for name in os.listdir('/proc'):
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    found.append(int(name))
+        except (IOError, ValueError, IndexError):
+            pass
+    return found
+
+class TestReusePortHandoff(unittest.TestCase):
+    def test_queued_connections_kept(self):
+        '''Connections queued on the SO_REUSEPORT sockets of workers when
+        the server is replaced are answered by its successor, not reset'''
+        port = 8130
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen([sys.executable, 'server.py', '--workers', '2',
+                '--reuse-port', '--listen', '%s:%d' %(HOST, port)],
+                preexec_fn=os.setsid, stdout=devnull)
+        clients = []
+        try:
+            for i in range(50):
+                if len(children(process.pid)) == 2:
+                    break
+                time.sleep(0.1)
+            time.sleep(0.5)
+            workers = children(process.pid)
+            for pid in workers: # Leave every connection queued
+                os.kill(pid, signal.SIGSTOP)
+            for i in range(20):
+                sock = socket.create_connection((HOST, port), 3)
+                sock.settimeout(10)
+                sock.sendall('GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+                clients.append(sock)
+
+            process.send_signal(signal.SIGUSR2)
+            time.sleep(1)
+            for pid in workers:
+                os.kill(pid, signal.SIGCONT)
+
+            for sock in clients:
+                head, body = read_response(sock)
+                self.assertTrue(head.startswith('HTTP/1.1 200 OK'), "Queued connection lost: %r" % head)
+        finally:
+            for sock in clients:
+                sock.close()
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+            time.sleep(0.5)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import limits
+import os
+import select
+import server
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+def start(httpd):
+    thread = threading.Thread(target=httpd.serve)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.3)
+
+def read_all(sock):
+    data = []
+    try:
+        chunk = sock.recv(65536)
+        while chunk:
+            data.append(chunk)
+            chunk = sock.recv(65536)
+    except socket.error:
+        pass
+    return ''.join(data)
+
+class Slowloris():
+    '''Clients that trickle a request head one byte at a time and never
+    finish it, recording what the server eventually answers'''
+
+    def __init__(self, port, count, interval=0.2):
+        self.socks = [socket.create_connection((HOST, port), 3) for i in range(count)]
+        self.interval = interval
+        self.answers = []
+        self.stopped = False
+        self.thread = threading.Thread(target=self._trickle)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _trickle(self):
+        head = 'GET / HTTP/1.1\r\nX-Padding: ' + 'x' * 1000
+        for byte in head:
+            for sock in select.select(self.socks, [], [], 0)[0]:
+                self._finish(sock)
+            if not self.socks or self.stopped:
+                return
+            for sock in self.socks:
+                try:
+                    sock.send(byte)
+                except socket.error:
+                    pass
+            time.sleep(self.interval)
+
+    def _finish(self, sock):
+        sock.settimeout(1)
+        self.answers.append(read_all(sock))
+        sock.close()
+        self.socks.remove(sock)
+
+    def close(self):
+        self.stopped = True
+        self.thread.join(1)
+        for sock in self.socks:
+            sock.close()
+
+def timed_get(port):
+    '''Returns the status line and seconds taken for GET / on a new connection'''
+    began = time.time()
+    sock = socket.create_connection((HOST, port), 3)
+    try:
+        sock.sendall('GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = read_all(sock)
+    finally:
+        sock.close()
+    return response.split('\r\n', 1)[0], time.time() - began
+
+class TestConnectionLimits(unittest.TestCase):
+    def test_admit(self):
+        counts = limits.ConnectionLimits(max_total=3, max_per_ip=2)
+        self.assertTrue(counts.admit('10.0.0.1') is None)
+        self.assertTrue(counts.admit('10.0.0.1') is None)
+        self.assertTrue(counts.admit('10.0.0.1') == '429')
+        self.assertTrue(counts.admit('10.0.0.2') is None)
+        self.assertTrue(counts.admit('10.0.0.3') == '503')
+        counts.release('10.0.0.1')
+        self.assertTrue(counts.admit('10.0.0.1') is None)
+        self.assertTrue(counts.rejected == {'429':1, '503':1}, counts.rejected)
+
+    def test_unlimited(self):
+        counts = limits.ConnectionLimits()
+        for i in range(100):
+            self.assertTrue(counts.admit('10.0.0.1') is None)
+
+class SlowClientTests():
+    '''Mixed into a TestCase with a server_class and a free port'''
+
+    slow_clients = 6
+
+    def test_slow_clients(self):
+        '''Clients trickling their request heads are answered 408 after
+        header_timeout, and do not slow down other clients meanwhile'''
+        class ImpatientServer(self.server_class):
+            header_timeout = 1.5
+            threads = 8
+        httpd = ImpatientServer(HOST, self.port)
+        start(httpd)
+        slow = Slowloris(self.port, self.slow_clients)
+        try:
+            time.sleep(0.3)
+            latencies = []
+            for i in range(20):
+                status, elapsed = timed_get(self.port)
+                self.assertTrue(status == 'HTTP/1.1 200 OK', status)
+                latencies.append(elapsed)
+            latencies.sort()
+            self.assertTrue(latencies[-2] < 0.25, "Slow clients delayed others: %s" % latencies)
+
+            slow.thread.join(5)
+            self.assertTrue(len(slow.answers) == self.slow_clients, "Slow clients were not cut off")
+            for answer in slow.answers:
+                self.assertTrue(answer.startswith('HTTP/1.1 408 Request Timeout'), answer[:40])
+        finally:
+            slow.close()
+            httpd.stop()
+
+    def test_max_connections(self):
+        class SmallServer(self.server_class):
+            max_connections = 2
+        httpd = SmallServer(HOST, self.port + 1)
+        start(httpd)
+        held = [socket.create_connection((HOST, self.port + 1), 3) for i in range(2)]
+        try:
+            time.sleep(0.2)
+            sock = socket.create_connection((HOST, self.port + 1), 3)
+            response = read_all(sock)
+            sock.close()
+            self.assertTrue(response.startswith('HTTP/1.1 503 Service Unavailable'), response[:40])
+            self.assertTrue('Retry-After: 1\r\n' in response, "503 should say when to retry")
+
+            held.pop().close()
+            time.sleep(0.2)
+            self.assertTrue(timed_get(self.port + 1)[0] == 'HTTP/1.1 200 OK', "Closed connection not released")
+        finally:
+            for sock in held:
+                sock.close()
+            httpd.stop()
+
+    def test_rejected_counted(self):
+        '''Connections turned away are counted, logged and exported'''
+        log = os.path.join(os.getcwd(), 'testrejected.log')
+        class CountingServer(self.server_class):
+            max_connections = 1
+            metrics_path = '/metrics'
+            access_log_path = log
+        httpd = CountingServer(HOST, self.counted_port)
+        thread = threading.Thread(target=httpd.serve)
+        thread.start()
+        time.sleep(0.3)
+        try:
+            held = socket.create_connection((HOST, self.counted_port), 3)
+            time.sleep(0.2)
+            sock = socket.create_connection((HOST, self.counted_port), 3)
+            self.assertTrue(read_all(sock).startswith('HTTP/1.1 503'), "Connection not turned away")
+            sock.close()
+            held.close()
+            time.sleep(0.2)
+
+            sock = socket.create_connection((HOST, self.counted_port), 3)
+            sock.sendall('GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n')
+            text = read_all(sock)
+            sock.close()
+            self.assertTrue('webserver_responses_total{status="503"} 1\n' in text, "503 not counted")
+            self.assertTrue('webserver_connections_rejected_total{status="503"} 1\n' in text,
+                "Rejected connections not exported")
+        finally:
+            httpd.stop()
+            thread.join(5)
+            with open(log) as f:
+                lines = f.readlines()
+            os.remove(log)
+        self.assertTrue(any(' 503 ' in line for line in lines), "503 not logged: %s" % lines)
+
+    def test_max_connections_per_ip(self):
+        class StingyServer(self.server_class):
+            max_connections_per_ip = 1
+        httpd = StingyServer(HOST, self.port + 2)
+        start(httpd)
+        held = socket.create_connection((HOST, self.port + 2), 3)
+        try:
+            time.sleep(0.2)
+            sock = socket.create_connection((HOST, self.port + 2), 3)
+            response = read_all(sock)
+            sock.close()
+            self.assertTrue(response.startswith('HTTP/1.1 429 Too Many Requests'), response[:40])
+        finally:
+            held.close()
+            httpd.stop()
+
+    def test_max_header_size(self):
+        class TerseServer(self.server_class):
+            max_header_size = 512
+        httpd = TerseServer(HOST, self.port + 3)
+        start(httpd)
+        sock = socket.create_connection((HOST, self.port + 3), 3)
+        try:
+            sock.sendall('GET / HTTP/1.1\r\nX-Padding: %s\r\n\r\n' %('x' * 1024))
+            response = read_all(sock)
+        finally:
+            sock.close()
+            httpd.stop()
+        self.assertTrue(response.startswith('HTTP/1.1 431 Request Header Fields Too Large'), response[:50])
+
+class TestThreadPoolLimits(SlowClientTests, unittest.TestCase):
+    server_class = server.ThreadedPyServer
+    port = 8112
+    # More than the pool has threads, which they must not tie up
+    slow_clients = 24
+    counted_port = 8128
+
+class TestEventLoopLimits(SlowClientTests, unittest.TestCase):
+    server_class = server.EventPyServer
+    port = 8116
+    slow_clients = 50
+    counted_port = 8129
+
+class TestDefaultMode(unittest.TestCase):
+    '''server.py run without flags, as runner.sh does'''
+
+    port = 8131
+
+    @classmethod
+    def setUpClass(self):
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen([sys.executable, 'server.py',
+                '--listen', '%s:%d' %(HOST, self.port)], stdout=devnull)
+        for i in range(50):
+            try:
+                socket.create_connection((HOST, self.port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def test_idle_client(self):
+        '''A client that connects and sends nothing does not hold up others'''
+        idle = socket.create_connection((HOST, self.port), 3)
+        try:
+            time.sleep(0.2)
+            status, elapsed = timed_get(self.port)
+        finally:
+            idle.close()
+        self.assertTrue(status == 'HTTP/1.1 200 OK', status)
+        self.assertTrue(elapsed < 0.25, "Idle client delayed another by %.2fs" % elapsed)
+
+    def test_idle_keep_alive_client(self):
+        '''Nor does one idling after a request on a persistent connection'''
+        idle = socket.create_connection((HOST, self.port), 3)
+        try:
+            idle.sendall('GET /base.css HTTP/1.1\r\n\r\n')
+            self.assertTrue(idle.recv(65536).startswith('HTTP/1.1 200 OK'))
+            status, elapsed = timed_get(self.port)
+        finally:
+            idle.close()
+        self.assertTrue(status == 'HTTP/1.1 200 OK', status)
+        self.assertTrue(elapsed < 0.25, "Idle client delayed another by %.2fs" % elapsed)
+
+    def test_slow_clients(self):
+        '''Nor do clients trickling their request heads'''
+        slow = Slowloris(self.port, 3, 0.05)
+        try:
+            time.sleep(0.2)
+            status, elapsed = timed_get(self.port)
+        finally:
+            slow.close()
+        self.assertTrue(status == 'HTTP/1.1 200 OK', status)
+        self.assertTrue(elapsed < 0.25, "Slow clients delayed another by %.2fs" % elapsed)
+
+if __name__ == '__main__':
+    unittest.main()
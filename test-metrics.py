@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import metrics
+import server
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = metrics.Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertTrue(histogram.cumulative() == [(0.1, 2), (1.0, 3), (float('inf'), 4)], 'Bad buckets')
+        self.assertTrue(histogram.count == 4 and histogram.sum == 3.65, 'Bad sum or count')
+
+    def test_render(self):
+        stats = metrics.Metrics()
+        stats.connection_opened()
+        stats.response_sent('404', 100, 0.001, 0.002)
+        text = stats.render([('files', {'hits':3, 'misses':1})], {'429':2}, 5)
+        self.assertTrue('webserver_responses_total{status="404"} 1\n' in text, 'Status not counted')
+        self.assertTrue('webserver_sent_bytes_total 100\n' in text, 'Bytes not counted')
+        self.assertTrue('webserver_connections 1\n' in text, 'Connections not counted')
+        self.assertTrue('webserver_request_duration_seconds_bucket{phase="send",le="0.001"} 1\n' in text, 'Send not timed')
+        self.assertTrue('webserver_request_duration_seconds_count{phase="total"} 1\n' in text, 'Total not timed')
+        self.assertTrue('webserver_cache_hits_total{cache="files"} 3\n' in text, 'Cache hits not shown')
+        self.assertTrue('webserver_connections_rejected_total{status="429"} 2\n' in text, 'Rejections not shown')
+        self.assertTrue('webserver_access_log_dropped_total 5\n' in text, 'Dropped log entries not shown')
+        self.assertFalse('access_log' in stats.render(), 'Dropped entries shown without a log')
+
+    def test_response_length(self):
+        class Body():
+            remaining = 10
+        self.assertTrue(metrics.response_length(['abc', Body()]) == 13, 'Bad response length')
+
+def fetch(port, path):
+    '''Request path and return the (status line, body)'''
+    sock = socket.create_connection((HOST, port), 3)
+    try:
+        sock.sendall('GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % path)
+        response = sock.makefile('rb').read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    return head.split('\r\n')[0], body
+
+def sample(text, name):
+    '''Returns the value of a sample line in the text format'''
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[1])
+    return 0
+
+class EndpointTests():
+    '''Mixed into a TestCase with a port a server is listening on'''
+
+    @classmethod
+    def setUpClass(self):
+        thread = threading.Thread(target=self.server_class(HOST, self.port).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    def test_endpoint(self):
+        before = fetch(self.port, '/metrics')[1]
+        fetch(self.port, '/index.html')
+        fetch(self.port, '/missing.html')
+        status, after = fetch(self.port, '/metrics')
+        self.assertTrue(status == 'HTTP/1.1 200 OK', 'Metrics not served')
+
+        for name, added in (('webserver_responses_total{status="200"}', 2),
+                ('webserver_responses_total{status="404"}', 1),
+                ('webserver_request_duration_seconds_count{phase="parse"}', 3),
+                ('webserver_request_duration_seconds_count{phase="read"}', 1),
+                ('webserver_request_duration_seconds_count{phase="total"}', 3)):
+            self.assertTrue(sample(after, name) - sample(before, name) == added, 'Bad count for %s' % name)
+        self.assertTrue(sample(after, 'webserver_sent_bytes_total') > sample(before, 'webserver_sent_bytes_total'), 'Bytes not counted')
+
+class MetricsServer(server.ThreadedPyServer):
+    metrics_path = '/metrics'
+
+class EventMetricsServer(server.EventPyServer):
+    metrics_path = '/metrics'
+
+class DisabledServer(MetricsServer):
+    metrics_enabled = False
+
+class TestThreadedMetrics(EndpointTests, unittest.TestCase):
+    port = 8094
+    server_class = MetricsServer
+
+class TestEventMetrics(EndpointTests, unittest.TestCase):
+    port = 8095
+    server_class = EventMetricsServer
+
+class TestDisabledMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        thread = threading.Thread(target=DisabledServer(HOST, 8096).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    def test_disabled(self):
+        status, body = fetch(8096, '/metrics')
+        self.assertTrue(status == 'HTTP/1.1 404 Not Found', 'Metrics must be off entirely')
+
+if __name__ == '__main__':
+    unittest.main()
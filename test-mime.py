@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import mime
+import os
+
+class TestMimeTypes(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.types = mime.MimeTypes(files=())
+
+    def test_bundled(self):
+        self.assertTrue(self.types.guess_type('/www/app.js') == 'text/javascript', 'Bad type for js')
+        self.assertTrue(self.types.guess_type('/www/INDEX.HTML') == 'text/html', 'Extensions are case insensitive')
+        self.assertTrue(self.types.guess_type('/www/module.wasm') == 'application/wasm', 'Bad type for wasm')
+        self.assertTrue(self.types.guess_type('/www/font.woff2') == 'font/woff2', 'Bad type for woff2')
+
+    def test_unknown(self):
+        self.assertTrue(self.types.guess_type('/www/file.unknown') == 'application/octet-stream', 'Bad default type')
+        self.assertTrue(self.types.guess_type('/www/v1.2/README') == 'application/octet-stream', 'Dots in directories are not extensions')
+
+    def test_flags(self):
+        html = self.types.get('index.html')
+        self.assertTrue(html.content_type == 'text/html; charset=utf-8', 'Text should have a charset')
+        self.assertTrue(html.compressible, 'Text should be compressible')
+        png = self.types.get('logo.png')
+        self.assertTrue(png.content_type == 'image/png' and not png.compressible, 'Images have no charset and are compressed already')
+        self.assertTrue(self.types.get('data.json').compressible, 'JSON should be compressible')
+        self.assertTrue(self.types.get('icon.svg').compressible, 'SVG should be compressible')
+
+    def test_load(self):
+        fp = os.path.join(os.getcwd(), 'test.types')
+        with open(fp, 'w') as types:
+            types.write('# comment\ntext/x-custom\tcust cst\napplication/x-empty\n')
+        try:
+            types = mime.MimeTypes(files=(fp,))
+        finally:
+            os.remove(fp)
+        self.assertTrue(types.guess_type('a.cst') == 'text/x-custom', 'mime.types not loaded')
+        self.assertFalse(mime.MimeTypes(files=()).load('/nonexistent/mime.types'), 'Missing file should be skipped')
+
+    def test_override(self):
+        types = mime.MimeTypes(files=())
+        types.add(*mime.parse_override('.js=application/javascript'))
+        self.assertTrue(types.get('a.js').content_type == 'application/javascript; charset=utf-8', 'Override not applied')
+        self.assertRaises(ValueError, mime.parse_override, 'js')
+
+if __name__ == '__main__':
+    unittest.main()
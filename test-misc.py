@@ -18,19 +18,55 @@
 # Furthermore, informed use of urllib2 and structure of this class is from
 # Abram Hindle's freetests.py licensed under Apache 2.
 
+import socket
 import urllib2
 import unittest
 
-BASEURL = "http://127.0.0.1:8080"
+HOST, PORT = "127.0.0.1", 8080
+BASEURL = "http://%s:%d" %(HOST, PORT)
 
 class TestRequests(unittest.TestCase):
     def setUp(self,baseurl=BASEURL):
         self.baseurl = baseurl
 
+    def send_raw(self, request):
+        '''Send a raw request and return the response status line'''
+        sock = socket.create_connection((HOST, PORT), 3)
+        try:
+            sock.sendall(request)
+            return sock.makefile().readline().strip()
+        finally:
+            sock.close()
+
     def test_malformed_get(self):
-        url = self.baseurl + "/index.html fake.html"
-        req = urllib2.urlopen(url, None, 3)
-        self.assertTrue(req.getcode()  == 200 , "Server should get first filetype")
+        '''urllib2 refuses to send this, so use a raw socket (issues.md #1)'''
+        status = self.send_raw("GET /index.html fake.html HTTP/1.1\r\n\r\n")
+        self.assertTrue(status == "HTTP/1.1 400 Bad Request", "Malformed request line should be a 400")
+
+    def test_short_request_line(self):
+        status = self.send_raw("GET HTTP/1.1\r\n\r\n")
+        self.assertTrue(status == "HTTP/1.1 400 Bad Request", "Request line without a path should be a 400")
+
+    def test_split_request(self):
+        '''A request head arriving in several packets is parsed once complete'''
+        sock = socket.create_connection((HOST, PORT), 3)
+        try:
+            for part in ("GET /base.css HT", "TP/1.1\r\nHost: loc", "alhost\r\n", "\r\n"):
+                sock.sendall(part)
+            status = sock.makefile().readline().strip()
+        finally:
+            sock.close()
+        self.assertTrue(status == "HTTP/1.1 200 OK", "Split request was not served")
+
+    def test_large_request(self):
+        '''Heads bigger than a single 1024 byte read are still parsed'''
+        cookie = "Cookie: %s\r\n" % ("x" * 4000)
+        status = self.send_raw("GET / HTTP/1.1\r\n" + cookie + "\r\n")
+        self.assertTrue(status == "HTTP/1.1 200 OK", "Large request head was not served")
+
+    def test_query_string(self):
+        req = urllib2.urlopen(self.baseurl + "/index.html?v=1", None, 3)
+        self.assertTrue(req.getcode() == 200, "Query string should be ignored")
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import http
+import server
+import os
+import socket
+import threading
+import time
+
+HOST = "127.0.0.1"
+
+class TestParseRange(unittest.TestCase):
+    def test_single(self):
+        self.assertTrue(http.parse_range('bytes=0-99', 1000) == [(0, 99)], 'Single range not parsed')
+
+    def test_open_ended(self):
+        self.assertTrue(http.parse_range('bytes=900-', 1000) == [(900, 999)], 'Open ended range not parsed')
+        self.assertTrue(http.parse_range('bytes=900-5000', 1000) == [(900, 999)], 'Range end not clamped')
+
+    def test_suffix(self):
+        self.assertTrue(http.parse_range('bytes=-100', 1000) == [(900, 999)], 'Suffix range not parsed')
+        self.assertTrue(http.parse_range('bytes=-5000', 1000) == [(0, 999)], 'Suffix range not clamped')
+
+    def test_multiple(self):
+        self.assertTrue(http.parse_range('bytes=0-0, -1', 10) == [(0, 0), (9, 9)], 'Multiple ranges not parsed')
+
+    def test_unsatisfiable(self):
+        self.assertTrue(http.parse_range('bytes=1000-', 1000) == [], 'Range past the end is unsatisfiable')
+        self.assertTrue(http.parse_range('bytes=-0', 1000) == [], 'Empty suffix is unsatisfiable')
+
+    def test_ignored(self):
+        for value in ('items=0-1', 'bytes=5-1', 'bytes=a-b', 'bytes=', 'bytes=1', 'bytes=' + ','.join(['0-1'] * 17)):
+            self.assertTrue(http.parse_range(value, 1000) is None, 'Range %s should be ignored' % value)
+
+def fetch(port, headers=''):
+    '''Request /base.css and return the (status line, headers, body)'''
+    sock = socket.create_connection((HOST, port), 3)
+    try:
+        sock.sendall('GET /base.css HTTP/1.1\r\nConnection: close\r\n%s\r\n' % headers)
+        rfile = sock.makefile('rb')
+        response = rfile.read()
+    finally:
+        sock.close()
+    head, body = response.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    fields = dict(line.split(': ', 1) for line in lines[1:])
+    return lines[0], fields, body
+
+class RangeTests():
+    '''Mixed into a TestCase with a port a server is listening on'''
+
+    @classmethod
+    def setUpClass(self):
+        with open(os.path.join('www', 'base.css'), 'rb') as fp:
+            self.css = fp.read()
+        self.size = len(self.css)
+        thread = threading.Thread(target=self.server_class(HOST, self.port).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    def test_accept_ranges(self):
+        status, fields, body = fetch(self.port)
+        self.assertTrue(fields.get('Accept-Ranges') == 'bytes', 'Accept-Ranges not advertised')
+
+    def test_single_range(self):
+        status, fields, body = fetch(self.port, 'Range: bytes=2-9\r\n')
+        self.assertTrue(status == 'HTTP/1.1 206 Partial Content', 'Range should be a 206')
+        self.assertTrue(fields['Content-Range'] == 'bytes 2-9/%d' % self.size, 'Bad Content-Range')
+        self.assertTrue(body == self.css[2:10] and fields['Content-Length'] == '8', 'Wrong range sent')
+
+    def test_suffix_range(self):
+        status, fields, body = fetch(self.port, 'Range: bytes=-5\r\n')
+        self.assertTrue(body == self.css[-5:], 'Wrong suffix sent')
+
+    def test_unsatisfiable(self):
+        status, fields, body = fetch(self.port, 'Range: bytes=%d-\r\n' % self.size)
+        self.assertTrue(status == 'HTTP/1.1 416 Requested Range Not Satisfiable', 'Should be a 416')
+        self.assertTrue(fields['Content-Range'] == 'bytes */%d' % self.size, 'Bad 416 Content-Range')
+
+    def test_multipart(self):
+        status, fields, body = fetch(self.port, 'Range: bytes=0-3,-4\r\n')
+        boundary = fields['Content-Type'].split('boundary=')[1]
+        self.assertTrue(fields['Content-Type'].startswith('multipart/byteranges'), 'Not a multipart response')
+        self.assertTrue(len(body) == int(fields['Content-Length']), 'Multipart length is wrong')
+
+        sections = body.split('--' + boundary)
+        self.assertTrue(sections[-1] == '--\r\n', 'Multipart body not terminated')
+        first = sections[1].split('\r\n\r\n', 1)
+        self.assertTrue('Content-Range: bytes 0-3/%d' % self.size in first[0], 'Part missing Content-Range')
+        self.assertTrue(first[1] == self.css[:4] + '\r\n', 'Wrong first part')
+        self.assertTrue(sections[2].split('\r\n\r\n', 1)[1] == self.css[-4:] + '\r\n', 'Wrong second part')
+
+    def test_if_range(self):
+        date = http.http_date(os.stat(os.path.join('www', 'base.css')).st_mtime)
+        status, fields, body = fetch(self.port, 'Range: bytes=0-3\r\nIf-Range: %s\r\n' % date)
+        self.assertTrue(status.startswith('HTTP/1.1 206'), 'Matching If-Range should allow the range')
+        status, fields, body = fetch(self.port, 'Range: bytes=0-3\r\nIf-Range: Thu, 01 Jan 1970 00:00:00 GMT\r\n')
+        self.assertTrue(status.startswith('HTTP/1.1 200') and body == self.css, 'Stale If-Range should send everything')
+
+class CachedServer(server.ThreadedPyServer):
+    pass
+
+class MappedServer(server.ThreadedPyServer):
+    use_mmap = True
+
+class DiskServer(server.ThreadedPyServer):
+    cache_size = 0
+
+class TestCachedRange(RangeTests, unittest.TestCase):
+    port = 8086
+    server_class = CachedServer
+
+class TestMappedRange(RangeTests, unittest.TestCase):
+    port = 8087
+    server_class = MappedServer
+
+class TestDiskRange(RangeTests, unittest.TestCase):
+    port = 8088
+    server_class = DiskServer
+
+if __name__ == '__main__':
+    unittest.main()
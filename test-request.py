@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import http
+
+class TestRequestParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = http.HTTPRequestParser(max_head=256)
+
+    def parse(self, data):
+        self.parser.feed(data)
+        return self.parser.next_request()
+
+    def test_request_line(self):
+        r = self.parse('GET /deep/index.html HTTP/1.1\r\n\r\n')
+        self.assertTrue((r.method, r.path, r.protocol) == ('GET', '/deep/index.html', 'HTTP/1.1'), 'Request line not parsed')
+
+    def test_headers(self):
+        r = self.parse('GET / HTTP/1.1\r\nHost: localhost\r\nAccept: a\r\naccept: b\r\n\r\n')
+        self.assertTrue(r.get_header('Host') == 'localhost', 'Header value not parsed')
+        self.assertTrue(r.get_header('accept') == 'a, b', 'Repeated headers should be joined')
+
+    def test_incomplete(self):
+        self.assertTrue(self.parse('GET / HTTP/1.1\r\nHost: lo') is None, 'Incomplete head should not be parsed')
+        r = self.parse('calhost\r\n\r\n')
+        self.assertTrue(r.get_header('host') == 'localhost', 'Head split across feeds not parsed')
+
+    def test_pipelined(self):
+        self.parser.feed('GET /a HTTP/1.1\r\n\r\nGET /b HTTP/1.1\n\nGET /c')
+        paths = [self.parser.next_request().path, self.parser.next_request().path]
+        self.assertTrue(paths == ['/a', '/b'], 'Pipelined requests not split')
+        self.assertTrue(self.parser.next_request() is None, 'Incomplete third request parsed')
+        self.assertTrue(self.parser.pending() == len('GET /c'), 'Remaining data not kept')
+
+    def test_query_and_quoting(self):
+        r = self.parse('GET /a%20b.html?x=1 HTTP/1.1\r\n\r\n')
+        self.assertTrue(r.path == '/a b.html' and r.query == 'x=1', 'Target not split and unquoted')
+
+    def test_malformed(self):
+        for line in ('GET /file.html other.html HTTP/1.1', 'GET HTTP/1.1', 'GET / FTP/1.0',
+                     'get / HTTP/1.1', 'GET file.html HTTP/1.1', 'GET /%00 HTTP/1.1'):
+            parser = http.HTTPRequestParser()
+            parser.feed(line + '\r\n\r\n')
+            self.assertRaises(http.HTTPParseError, parser.next_request)
+
+    def test_malformed_header(self):
+        self.parser.feed('GET / HTTP/1.1\r\nNo colon here\r\n\r\n')
+        self.assertRaises(http.HTTPParseError, self.parser.next_request)
+
+    def test_head_too_large(self):
+        self.parser.feed('GET / HTTP/1.1\r\nCookie: ' + 'x' * 300)
+        self.assertRaises(http.HTTPParseError, self.parser.next_request)
+
+    def test_parse_error_status(self):
+        self.assertTrue(http.HTTPParseError('bad').status == '400', 'Parse errors should map to 400')
+
+if __name__ == '__main__':
+    unittest.main()
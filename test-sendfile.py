@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import http
+import server
+import os
+import socket
+import threading
+import time
+import urllib2
+
+HOST = "127.0.0.1"
+
+def read_all(sock):
+    data = []
+    chunk = sock.recv(65536)
+    while chunk:
+        data.append(chunk)
+        chunk = sock.recv(65536)
+    return ''.join(data)
+
+class TestFileBody(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        '''Create a binary file larger than one send buffer'''
+        self.fp = os.path.join(os.getcwd(), 'testbody.bin')
+        self.contents = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.fp, 'wb') as fbody:
+            fbody.write(self.contents)
+
+    def transfer(self, body):
+        a, b = socket.socketpair()
+        sender = threading.Thread(target=lambda: (body.send(a), a.close()))
+        sender.start()
+        try:
+            return read_all(b)
+        finally:
+            sender.join()
+            b.close()
+
+    def test_sendfile(self):
+        self.assertTrue(self.transfer(http.FileBody(self.fp)) == self.contents, "File corrupted in transfer")
+
+    def test_buffered_fallback(self):
+        body = http.FileBody(self.fp)
+        body.use_sendfile = False
+        self.assertTrue(self.transfer(body) == self.contents, "File corrupted in buffered transfer")
+
+    def test_region(self):
+        body = http.FileBody(self.fp, 1000, 5000)
+        self.assertTrue(self.transfer(body) == self.contents[1000:6000], "Wrong region of the file sent")
+
+    def test_message_parts(self):
+        m = http.HTTPMessage('HTTP/1.1', '200', 0, self.fp, stream=True)
+        parts = m.get_parts()
+        self.assertTrue(m.get_header().get_length() == len(self.contents), "Length not taken from the open file")
+        self.assertTrue(isinstance(parts[1], http.FileBody), "Body should be streamed")
+        parts[1].close()
+
+    def test_missing_file(self):
+        m = http.HTTPMessage('HTTP/1.1', '200', 0, 'mock123.bin', stream=True)
+        self.assertTrue(m.get_header().get_rstatus() == 'HTTP/1.1 404 Not Found\r\n', "Missing file should be a 404")
+
+    def test_file_shrank(self):
+        '''A file cut short mid-transfer is an error, not a body shorter
+        than its Content-Length'''
+        fp = os.path.join(os.getcwd(), 'testshrank.bin')
+        with open(fp, 'wb') as fbody:
+            fbody.write('x' * 1000)
+        try:
+            for use_sendfile in (True, False):
+                body = http.FileBody(fp)
+                body.use_sendfile = body.use_sendfile and use_sendfile
+                with open(fp, 'r+b') as fbody:
+                    fbody.truncate(500)
+                a, b = socket.socketpair()
+                try:
+                    body.send_some(a)
+                    self.assertRaises(socket.error, body.send_some, a)
+                finally:
+                    body.close()
+                    a.close()
+                    b.close()
+                with open(fp, 'wb') as fbody:
+                    fbody.write('x' * 1000)
+        finally:
+            os.remove(fp)
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.fp)
+
+class LargeFileTests():
+    '''Mixed into a TestCase with a port a server is listening on'''
+
+    def test_large_binary_file(self):
+        req = urllib2.urlopen("http://%s:%d/testlarge.bin" %(HOST, self.port), None, 10)
+        self.assertTrue(req.read() == self.contents, "Large binary file corrupted")
+
+    def test_client_disconnects(self):
+        '''A client that leaves mid-transfer must not affect later requests'''
+        sock = socket.create_connection((HOST, self.port))
+        sock.sendall('GET /testlarge.bin HTTP/1.1\r\n\r\n')
+        sock.recv(1024)
+        sock.close()
+        req = urllib2.urlopen("http://%s:%d/" %(HOST, self.port), None, 3)
+        self.assertTrue(req.getcode() == 200, "Server broken after client disconnect")
+
+    @classmethod
+    def setUpClass(self):
+        self.fp = os.path.join(os.getcwd(), 'www', 'testlarge.bin')
+        self.contents = os.urandom(5 * 1024 * 1024)
+        with open(self.fp, 'wb') as fbody:
+            fbody.write(self.contents)
+
+        thread = threading.Thread(target=self.server_class(HOST, self.port).serve)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.fp)
+
+class TestThreadedLargeFile(LargeFileTests, unittest.TestCase):
+    port = 8084
+    server_class = server.ThreadedPyServer
+
+class TestEventLargeFile(LargeFileTests, unittest.TestCase):
+    port = 8085
+    server_class = server.EventPyServer
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Michael Raypold
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import collections
+import errno
+import http
+import mmap
+import os
+import socket
+import sys
+import threading
+
+def read_all(sock):
+    data = []
+    chunk = sock.recv(65536)
+    while chunk:
+        data.append(chunk)
+        chunk = sock.recv(65536)
+    return ''.join(data)
+
+class CountingSocket():
+    '''Wraps a socket, counting the writes made through send() and writev()'''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sends = 0
+
+    def send(self, data):
+        self.sends += 1
+        return self.sock.send(data)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def gettimeout(self):
+        return self.sock.gettimeout()
+
+class TestSendParts(unittest.TestCase):
+    def transfer(self, parts):
+        a, b = socket.socketpair()
+        sender = threading.Thread(target=lambda: (http.send_parts(a, parts), a.close()))
+        sender.start()
+        try:
+            return read_all(b)
+        finally:
+            sender.join()
+            b.close()
+
+    def test_writev_available(self):
+        if sys.platform.startswith('linux'):
+            self.assertTrue(http._writev is not None, "writev() not loaded from libc")
+
+    def test_header_and_body(self):
+        header = http.HTTPHeader('HTTP/1.1', '200', 'text/plain', 5).get_string()
+        self.assertTrue(self.transfer([header, 'hello']) == header + 'hello', "Response corrupted")
+
+    def test_large_gathered_parts(self):
+        '''Parts larger than the socket buffer are written in several calls'''
+        parts = [os.urandom(1024 * 1024 + n) for n in range(3)]
+        self.assertTrue(self.transfer(list(parts)) == ''.join(parts), "Parts corrupted after partial writes")
+
+    def test_buffer_body(self):
+        data = os.urandom(300000)
+        closed = []
+        body = http.BufferBody(data, 7, 200000, lambda: closed.append(True))
+        self.assertTrue(self.transfer(['head', body, 'tail']) == 'head' + data[7:200007] + 'tail',
+            "BufferBody corrupted")
+        self.assertTrue(closed == [True], "BufferBody not closed exactly once")
+
+    def test_mmap_body(self):
+        m = mmap.mmap(-1, 4096)
+        m.write('x' * 4096)
+        try:
+            self.assertTrue(self.transfer(['head', http.BufferBody(m)]) == 'head' + 'x' * 4096,
+                "Memory mapped body corrupted")
+        finally:
+            m.close()
+
+    def one_write(self, parts):
+        '''Returns the send() calls made writing parts with one write'''
+        a, b = socket.socketpair()
+        for sock in (a, b):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        try:
+            sock = CountingSocket(a)
+            http.send_some(sock, collections.deque(parts))
+            a.close()
+            self.assertTrue(read_all(b) == ''.join(parts), "Response corrupted")
+            return sock.sends
+        finally:
+            b.close()
+
+    def test_small_parts_joined(self):
+        self.assertTrue(self.one_write(['head', 'body', 'tail']) == 1, "Small parts not sent together")
+
+    def test_large_parts_gathered(self):
+        '''Header and a large body go out in one writev(), not one send each'''
+        if http._writev is None:
+            return
+        body = 'x' * (http.JOIN_LIMIT + 1)
+        self.assertTrue(self.one_write(['head', body]) == 0, "Parts written with send()")
+
+class TestSendSome(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+        self.a.setblocking(0)
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def fill(self, parts):
+        '''Send until the socket is full, returning what was sent'''
+        try:
+            while parts and http.send_some(self.a, parts):
+                pass
+        except socket.error as e:
+            self.assertTrue(e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK), "Unexpected error")
+
+    def test_partial_write(self):
+        data = os.urandom(4 * 1024 * 1024)
+        parts = collections.deque(['head', data])
+        self.fill(parts)
+        self.assertTrue(len(parts) == 1, "Header not sent in the first write")
+        self.assertTrue(isinstance(parts[0], buffer), "Rest of the body copied")
+        self.assertTrue(0 < len(parts[0]) < len(data), "Nothing sent")
+
+        received = []
+        reader = threading.Thread(target=lambda: received.append(read_all(self.b)))
+        reader.start()
+        self.a.setblocking(1)
+        http.send_parts(self.a, list(parts))
+        self.a.shutdown(socket.SHUT_WR)
+        reader.join()
+        self.assertTrue(received[0] == 'head' + data, "Body corrupted after a partial write")
+
+    def test_stops_at_file_body(self):
+        fp = os.path.join(os.getcwd(), 'testwritev.bin')
+        with open(fp, 'wb') as f:
+            f.write('body')
+        try:
+            body = http.FileBody(fp)
+            parts = collections.deque(['head', body, 'tail'])
+            self.assertTrue(http.send_some(self.a, parts), "Header not sent")
+            self.assertTrue(list(parts) == [body, 'tail'], "Wrote past the file body")
+            self.fill(parts)
+            self.assertTrue(not parts, "Parts left unsent")
+            self.assertTrue(self.b.recv(100) == 'headbodytail', "Parts sent out of order")
+        finally:
+            os.remove(fp)
+
+class TestResponseParts(unittest.TestCase):
+    def test_message_parts(self):
+        m = http.HTTPMessage('HTTP/1.1', '404', 0, None)
+        parts = m.get_parts()
+        self.assertTrue(len(parts) == 2, "Header and body joined")
+        self.assertTrue(''.join(parts) == m.get_package(), "Parts differ from the package")
+        self.assertTrue(all(isinstance(part, str) for part in parts), "Parts are not bytes")
+
+    def test_error_parts(self):
+        errors = http.ErrorPages()
+        parts = errors.get_parts('HTTP/1.1', '404', 'keep-alive')
+        self.assertTrue(parts[0].startswith('HTTP/1.1 404'), "Status line not first")
+        self.assertTrue(parts[2] is errors.get_parts('HTTP/1.1', '404', 'keep-alive')[2],
+            "Prebuilt body copied")
+        response = errors.get('HTTP/1.1', '404', 'keep-alive')
+        self.assertTrue(response.split('\r\n')[0] == parts[0].rstrip('\r\n'), "Responses differ")
+
+if __name__ == '__main__':
+    unittest.main()